@@ -0,0 +1,245 @@
+#!/usr/bin/env python3.7
+
+# time each report against a big log and save the results as JSON
+#
+#   ./benchmark.py --log /tmp/bench.log --lines 2000000
+#   ./benchmark.py --log /tmp/bench.log --compare benchmark-1a2b3c4.json
+#
+# If the --log file doesn't exist it's made with generate_log.py first, so
+# later runs (eg on other commits) can reuse it. Each report runs in its own
+# process with --no-cache so parsing is always measured, and reports how
+# long each of its stages took (see stages.py). Peak RSS comes from the
+# finished process's rusage.
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import compressed
+import generate_log
+import table_print
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPORTS = (
+    "latencies.py",
+    "latency_hist.py",
+    "proxy_concurrency.py",
+    "per_drive.py",
+    "flow.py",
+)
+# read and filter are only timed in this process, ie with --jobs 1
+STAGES = ("read", "filter", "parse", "aggregate", "render")
+RESULTS_VERSION = 1
+
+
+def count_lines(filename):
+    count = 0
+    for block in compressed.blocks(filename):
+        count += block.count(b"\n")
+    return count
+
+
+def git_commit():
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "HEAD"],
+                cwd=HERE,
+                stderr=subprocess.DEVNULL,
+            )
+            .decode("ascii")
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_report(script, filename, jobs, workdir):
+    """
+    Run one report and return its result dict.
+    """
+    stats_path = os.path.join(workdir, "stats.json")
+    if os.path.exists(stats_path):
+        os.unlink(stats_path)
+    env = dict(os.environ, MPLBACKEND="Agg", LOGFLOW_STATS=stats_path)
+    argv = [
+        sys.executable,
+        os.path.join(HERE, script),
+        "--jobs",
+        str(jobs),
+        "--no-cache",
+        os.path.abspath(filename),
+    ]
+
+    stderr_path = os.path.join(workdir, "stderr.txt")
+    started = time.perf_counter()
+    with open(os.devnull, "w") as devnull, open(stderr_path, "w") as stderr:
+        child = subprocess.Popen(
+            argv, cwd=workdir, env=env, stdout=devnull, stderr=stderr
+        )
+        # wait4 rather than wait, for the child's resource usage
+        _, status, usage = os.wait4(child.pid, 0)
+    wall = time.perf_counter() - started
+    if os.WIFEXITED(status):
+        child.returncode = os.WEXITSTATUS(status)
+    else:
+        child.returncode = -os.WTERMSIG(status)
+
+    # ru_maxrss is in KB on linux and bytes on macOS
+    rss_unit = 1 if sys.platform == "darwin" else 1024
+    result = {
+        "wall": wall,
+        "peak_rss_mb": usage.ru_maxrss * rss_unit / 2 ** 20,
+        "returncode": child.returncode,
+        "stages": {},
+        "counters": {},
+        "skipped": {},
+    }
+    if child.returncode:
+        with open(stderr_path) as f:
+            result["error"] = f.read().strip().splitlines()[-1:]
+        return result
+    try:
+        with open(stats_path) as f:
+            stats = json.load(f)
+    except (OSError, ValueError):
+        return result
+    for key in ("stages", "counters", "skipped"):
+        result[key] = stats.get(key, {})
+    return result
+
+
+def best_of(results):
+    ok = [r for r in results if not r["returncode"]]
+    return min(ok or results, key=lambda r: r["wall"])
+
+
+def results_table(results):
+    header = ("", "wall s") + tuple("%s s" % stage for stage in STAGES)
+    t = [header + ("lines/s", "peak RSS MB")]
+    lines = results["log"]["lines"]
+    for script, result in results["reports"].items():
+        if result["returncode"]:
+            t.append((script, "failed: %s" % " ".join(result["error"])))
+            continue
+        row = [script, "%.2f" % result["wall"]]
+        for stage in STAGES:
+            seconds = result["stages"].get(stage)
+            row.append("-" if seconds is None else "%.2f" % seconds)
+        row.append("%d" % (lines / max(result["wall"], 1e-9)))
+        row.append("%.0f" % result["peak_rss_mb"])
+        t.append(tuple(row))
+    return t
+
+
+def compare_table(old, new):
+    t = [("", "", "before", "after", "change")]
+    for script, result in new["reports"].items():
+        before = old["reports"].get(script)
+        if not before or before["returncode"] or result["returncode"]:
+            continue
+        pairs = [("wall", before["wall"], result["wall"])]
+        for stage in STAGES:
+            if stage in before["stages"] and stage in result["stages"]:
+                pairs.append(
+                    (stage, before["stages"][stage], result["stages"][stage])
+                )
+        pairs.append(
+            ("peak RSS MB", before["peak_rss_mb"], result["peak_rss_mb"])
+        )
+        for name, a, b in pairs:
+            change = (b - a) / a * 100 if a else 0.0
+            t.append(
+                (script, name, "%.2f" % a, "%.2f" % b, "%+.1f%%" % change)
+            )
+            script = ""
+    return t
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--log", help="log to benchmark against, generated if it's missing"
+    )
+    parser.add_argument(
+        "--lines",
+        type=int,
+        default=1000000,
+        help="size of the generated log",
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--jobs", type=int, default=1)
+    parser.add_argument(
+        "--repeat", type=int, default=1, help="keep the fastest of N runs"
+    )
+    parser.add_argument(
+        "--reports", nargs="+", default=list(REPORTS), metavar="SCRIPT"
+    )
+    parser.add_argument(
+        "--output", help="JSON results file (default benchmark-<commit>.json)"
+    )
+    parser.add_argument("--compare", help="earlier JSON results to compare to")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="logflow-bench-") as workdir:
+        filename = args.log or os.path.join(workdir, "bench.log")
+        generated = None
+        if not os.path.exists(filename):
+            generated = ["--lines", str(args.lines), "--seed", str(args.seed)]
+            gen_args = generate_log.make_parser().parse_args(
+                [filename] + generated
+            )
+            print("Generating %s..." % filename, file=sys.stderr)
+            with open(filename, "w") as f:
+                generate_log.generate(gen_args, f)
+
+        commit = git_commit()
+        results = {
+            "version": RESULTS_VERSION,
+            "commit": commit,
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "jobs": args.jobs,
+            "log": {
+                "path": os.path.abspath(filename) if args.log else None,
+                "bytes": os.path.getsize(filename),
+                "lines": count_lines(filename),
+                "generator_args": generated,
+            },
+            "reports": {},
+        }
+        for script in args.reports:
+            runs = []
+            for i in range(args.repeat):
+                print(
+                    "Running %s (%d/%d)..." % (script, i + 1, args.repeat),
+                    file=sys.stderr,
+                )
+                runs.append(run_report(script, filename, args.jobs, workdir))
+            results["reports"][script] = best_of(runs)
+
+    output = args.output or "benchmark-%s.json" % (commit or "unknown")[:7]
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+    print(table_print.table_print(results_table(results)))
+    print("Results written to %s" % output)
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        print()
+        print(table_print.table_print(compare_table(old, results)))
+
+
+if __name__ == "__main__":
+    main()
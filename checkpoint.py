@@ -0,0 +1,221 @@
+# pick up growing logs where the last run left off, eg from an hourly cron
+#
+#   ./logflow.py --reports latencies,per_drive,flow \
+#       --checkpoint swift.checkpoint /var/log/swift/all.log
+#
+# The checkpoint file records how far each log has been read, and the
+# running totals of every report at that point: the globals its STATE
+# names, pickled. The next run with the same reports and options loads
+# those totals back, reads only the lines added since and saves a new
+# checkpoint, so each run costs about as much as the new lines take to
+# parse, however big the log has grown.
+#
+# A log is recognized by a hash of its first HEAD_SIZE bytes rather than by
+# its name or inode, so that logrotate's renaming and its copytruncate both
+# work out. A log whose head no longer matches was rotated or truncated: it
+# is read from its start, and the previous generation is looked for next to
+# it (all.log.1, all.log-20200303, ...) to read the lines it got after the
+# checkpoint. Compressed logs don't grow, so they're read whole, once. One
+# that was compressed before all of it was read can't be picked up part way
+# through, so its last lines are missed (logrotate's delaycompress leaves
+# the latest generation uncompressed, which avoids that).
+
+import glob
+import hashlib
+import os
+import pickle
+import sys
+
+import compressed
+
+
+CHECKPOINT_VERSION = 1
+# bytes at the start of a log that identify it
+HEAD_SIZE = 4096
+
+
+def add_arguments(parser):
+    """
+    Add the --checkpoint option to an argparse parser.
+    """
+    parser.add_argument(
+        "--checkpoint",
+        default=None,
+        metavar="FILE",
+        help="carry on from the totals and log positions saved in FILE, "
+        "read only what was logged since, and save them again",
+    )
+
+
+def _head(filename):
+    # the first HEAD_SIZE bytes of the log, decompressed
+    return next(compressed.blocks(filename, block_size=HEAD_SIZE), b"")
+
+
+def _digest(head):
+    return hashlib.sha1(head).hexdigest()
+
+
+def _matches(head, log):
+    size = log["head_size"]
+    return (
+        size > 0 and len(head) >= size and _digest(head[:size]) == log["head"]
+    )
+
+
+def _last_line_end(filename, size):
+    # offset just past the last complete line in the first size bytes
+    with open(filename, "rb") as f:
+        end = size
+        while end > 0:
+            start = max(end - 2 ** 16, 0)
+            f.seek(start)
+            newline = f.read(end - start).rfind(b"\n")
+            if newline >= 0:
+                return start + newline + 1
+            end = start
+    return 0
+
+
+def _rotated(log):
+    # the file next to where log was that now holds what it did
+    for filename in sorted(glob.glob(glob.escape(log["path"]) + "?*")):
+        if os.path.isfile(filename) and _matches(_head(filename), log):
+            return filename
+    return None
+
+
+def pending(filenames, saved=()):
+    """
+    Work out what's left to read of filenames since the checkpoint whose
+    logs are saved. Returns the (filename, start, end) byte ranges to read,
+    oldest first, and the logs to save in the next checkpoint once they
+    have been.
+    """
+    unmatched = list(saved)
+    pieces = []
+    logs = []
+    for filename in filenames:
+        path = os.path.abspath(filename)
+        head = _head(filename)
+        previous = None
+        for log in unmatched:
+            if _matches(head, log):
+                previous = log
+                if log["path"] == path:
+                    break
+        if previous is not None:
+            unmatched.remove(previous)
+        log = {"path": path, "head_size": len(head), "head": _digest(head)}
+        logs.append(log)
+
+        if compressed.compression(filename) is not None:
+            log["offset"] = None
+            if previous is None:
+                pieces.append((filename, 0, None))
+            elif previous["offset"] is not None:
+                print(
+                    "%s was compressed after the checkpoint, so the lines "
+                    "logged to it since are missed" % filename,
+                    file=sys.stderr,
+                )
+            continue
+
+        # a line still being written is left for next time
+        end = _last_line_end(filename, os.path.getsize(filename))
+        start = 0
+        if previous is not None:
+            if previous["offset"] is not None and previous["offset"] <= end:
+                start = previous["offset"]
+            else:
+                # truncated and written again since
+                unmatched.append(previous)
+        log["offset"] = end
+        if end > start:
+            pieces.append((filename, start, end))
+
+    # logs that were rotated or truncated since, whose ends are elsewhere
+    rotated = []
+    for log in unmatched:
+        if not log["head_size"] or log["offset"] is None:
+            continue
+        filename = _rotated(log)
+        if filename is None:
+            print(
+                "Can't find what %s held at the checkpoint, so the lines "
+                "logged to it since are missed" % log["path"],
+                file=sys.stderr,
+            )
+        elif compressed.compression(filename) is not None:
+            print(
+                "%s was compressed after the checkpoint, so the lines "
+                "logged to it since are missed" % filename,
+                file=sys.stderr,
+            )
+        else:
+            size = os.path.getsize(filename)
+            if size > log["offset"]:
+                rotated.append((filename, log["offset"], size))
+    return rotated + pieces, logs
+
+
+def report_state(report):
+    """
+    The running totals of a report module, the globals its STATE names.
+    """
+    return {name: getattr(report, name) for name in report.STATE}
+
+
+def restore_state(report, state):
+    for name, value in state.items():
+        setattr(report, name, value)
+
+
+def read_checkpoint(path, config):
+    """
+    The checkpoint saved at path, as a dict with the "logs" it had read and
+    the reports' "states" by name. None if there isn't one, or it was saved
+    with a different config (the reports and their options), since its
+    totals wouldn't be for the same thing.
+    """
+    try:
+        with open(path, "rb") as f:
+            checkpoint = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    if checkpoint.get("version") != CHECKPOINT_VERSION:
+        print(
+            "Checkpoint %s is out of date, starting over" % path,
+            file=sys.stderr,
+        )
+        return None
+    if checkpoint["config"] != config:
+        print(
+            "Checkpoint %s is for other reports or options, starting over"
+            % path,
+            file=sys.stderr,
+        )
+        return None
+    return checkpoint
+
+
+def write_checkpoint(path, config, logs, reports):
+    """
+    Save the positions of logs (from pending) and the totals of reports, a
+    list of (name, module), to path.
+    """
+    checkpoint = {
+        "version": CHECKPOINT_VERSION,
+        "config": config,
+        "logs": logs,
+        "states": {name: report_state(report) for name, report in reports},
+    }
+    # never leave half a checkpoint if this is interrupted
+    tmp_name = "%s.tmp.%d" % (path, os.getpid())
+    try:
+        with open(tmp_name, "wb") as f:
+            pickle.dump(checkpoint, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_name, path)
+    finally:
+        if os.path.exists(tmp_name):
+            os.unlink(tmp_name)
@@ -0,0 +1,242 @@
+# read logs that were compressed when they were rotated
+#
+# gzip, xz and bz2 files are recognized by their magic bytes and decompressed
+# as they're read, so they never need unpacking to disk first. A gzip file
+# made of several members (eg `gzip -c part >> log.gz`, pigz or bgzip output)
+# can also be split at member boundaries and each piece decompressed by a
+# different process.
+
+import bz2
+import gzip
+import lzma
+import mmap
+import os
+import time
+import zlib
+
+
+MAGIC = (
+    (b"\x1f\x8b", "gzip"),
+    (b"\xfd7zXZ\x00", "xz"),
+    (b"BZh", "bz2"),
+)
+OPENERS = {"gzip": gzip.open, "xz": lzma.open, "bz2": bz2.open}
+
+# ID1, ID2 and CM (deflate) at the start of every gzip member
+GZIP_HEADER = b"\x1f\x8b\x08"
+
+
+class MemberError(Exception):
+    """
+    A gzip byte range didn't start or end on a member boundary.
+    """
+
+
+class Throughput(object):
+    """
+    Bytes read and time spent decompressing them, to tell whether reading a
+    compressed log is limited by decompression or by parsing.
+    """
+
+    def __init__(self):
+        self.compressed_bytes = 0
+        self.decompressed_bytes = 0
+        self.decompress_time = 0.0
+        self.total_time = 0.0
+
+    def merge(self, other):
+        self.compressed_bytes += other.compressed_bytes
+        self.decompressed_bytes += other.decompressed_bytes
+        self.decompress_time += other.decompress_time
+        self.total_time += other.total_time
+
+    def report(self, elapsed):
+        mb = 2 ** 20
+        parse_time = max(self.total_time - self.decompress_time, 0.0)
+        if self.decompress_time > parse_time:
+            bound = "decompression"
+        else:
+            bound = "parsing"
+        return (
+            "Read %.1f MB compressed, %.1f MB decompressed in %.2fs "
+            "(%.1f MB/s); %.2fs decompressing, %.2fs parsing: %s bound"
+            % (
+                self.compressed_bytes / mb,
+                self.decompressed_bytes / mb,
+                elapsed,
+                self.decompressed_bytes / mb / max(elapsed, 1e-9),
+                self.decompress_time,
+                parse_time,
+                bound,
+            )
+        )
+
+
+def compression(filename):
+    """
+    Return "gzip", "xz" or "bz2" if filename is compressed, else None.
+    """
+    with open(filename, "rb") as f:
+        head = f.read(6)
+    for magic, name in MAGIC:
+        if head.startswith(magic):
+            return name
+    return None
+
+
+def blocks(filename, start=0, end=None, block_size=2 ** 24, stats=None):
+    """
+    Generator of the (decompressed) contents of filename in blocks of bytes.
+
+    start and end are offsets in the file as stored. For a plain file they
+    should be at line boundaries. For a gzip file they must be member
+    boundaries (see member_offsets) and the lines are divided up so that
+    ranges covering the file see every line exactly once: the partial line
+    at the start of a range is skipped, and the last line is finished from
+    the members after it. Compressed files other than gzip can only be read
+    whole.
+    """
+    kind = compression(filename)
+    if kind is None:
+        yield from _plain_blocks(filename, start, end, block_size)
+    elif start == 0 and end is None:
+        yield from _stream_blocks(filename, kind, block_size, stats)
+    elif kind == "gzip":
+        yield from _member_blocks(filename, start, end, block_size, stats)
+    else:
+        raise ValueError("can't read part of a %s file" % kind)
+
+
+def _plain_blocks(filename, start, end, block_size):
+    with open(filename, "rb") as f:
+        f.seek(start)
+        remaining = end - start if end is not None else None
+        while remaining is None or remaining > 0:
+            size = (
+                block_size if remaining is None else min(block_size, remaining)
+            )
+            block = f.read(size)
+            if not block:
+                break
+            if remaining is not None:
+                remaining -= len(block)
+            yield block
+
+
+def _stream_blocks(filename, kind, block_size, stats):
+    if stats is None:
+        stats = Throughput()
+    stats.compressed_bytes += os.path.getsize(filename)
+    with OPENERS[kind](filename, "rb") as f:
+        while True:
+            started = time.perf_counter()
+            block = f.read(block_size)
+            stats.decompress_time += time.perf_counter() - started
+            if not block:
+                break
+            stats.decompressed_bytes += len(block)
+            yield block
+
+
+def _member_blocks(filename, start, end, block_size, stats):
+    if stats is None:
+        stats = Throughput()
+    stats.compressed_bytes += end - start
+    # decompressed data is bigger, so read less at a time
+    read_size = max(block_size // 8, 2 ** 16)
+    skipping = start > 0
+    extending = False
+    with open(filename, "rb") as f:
+        f.seek(start)
+        pos = start
+        pending = b""
+        decompressor = zlib.decompressobj(31)
+        in_member = False
+        while True:
+            if not pending:
+                # only a line's worth is needed past the end of the range
+                pending = f.read(2 ** 16 if extending else read_size)
+                if not pending:
+                    break
+                pos += len(pending)
+            started = time.perf_counter()
+            try:
+                data = decompressor.decompress(
+                    pending, 2 ** 16 if extending else 0
+                )
+            except zlib.error as e:
+                raise MemberError("%s at offset %d: %s" % (filename, pos, e))
+            stats.decompress_time += time.perf_counter() - started
+            stats.decompressed_bytes += len(data)
+            member_end = None
+            in_member = True
+            if decompressor.eof:
+                pending = decompressor.unused_data
+                member_end = pos - len(pending)
+                decompressor = zlib.decompressobj(31)
+                in_member = False
+            else:
+                pending = decompressor.unconsumed_tail
+
+            if skipping:
+                # the previous range finishes this line
+                cut = data.find(b"\n") + 1
+                if cut:
+                    skipping = False
+                data = data[cut:] if cut else b""
+            if extending:
+                cut = data.find(b"\n") + 1
+                if cut:
+                    yield data[:cut]
+                    return
+            if data:
+                yield data
+
+            if member_end is not None and member_end >= end and not extending:
+                if member_end != end:
+                    raise MemberError(
+                        "%s: no gzip member starts at offset %d"
+                        % (filename, end)
+                    )
+                if skipping:
+                    # not one line starts in this range
+                    return
+                extending = True
+        if in_member:
+            raise MemberError("%s: truncated gzip member" % filename)
+
+
+def member_offsets(filename, count):
+    """
+    Return up to count (start, end) byte ranges covering the gzip file
+    filename, each starting at what looks like the start of a member.
+
+    Finding members for certain would mean decompressing everything, so the
+    boundaries are guesses from the member header. blocks() raises
+    MemberError if a guess turns out to be wrong.
+    """
+    size = os.path.getsize(filename)
+    boundaries = [0]
+    if size:
+        with open(filename, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for i in range(1, count):
+                    pos = _next_header(mm, max(size * i // count, 1), size)
+                    if pos < 0:
+                        break
+                    if pos > boundaries[-1]:
+                        boundaries.append(pos)
+    boundaries.append(size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def _next_header(mm, pos, size):
+    while True:
+        pos = mm.find(GZIP_HEADER, pos)
+        if pos < 0 or pos + 10 > size:
+            return -1
+        # reserved flag bits are zero and the OS byte is a known value
+        flags, os_byte = mm[pos + 3], mm[pos + 9]
+        if not flags & 0xE0 and (os_byte <= 13 or os_byte == 255):
+            return pos
+        pos += 1
@@ -0,0 +1,173 @@
+# count how many requests are in flight in each time bucket
+
+import math
+
+import numpy as np
+
+
+class ConcurrencyCounter(object):
+    """
+    Records only where each request starts and ends. The per-bucket counts
+    come from a cumulative sum over those +1/-1 events, so a long request
+    costs no more than a short one. Events are folded into a difference
+    array when the counts are read, so counters that keep growing can be
+    read again cheaply.
+
+    With fractional=True, a request counts only for the part of each bucket
+    it overlaps, eg a 0.25s request inside one 1s bucket adds 0.25.
+    """
+
+    def __init__(self, resolution=1, fractional=False):
+        self._mult = 1 / resolution
+        self.fractional = fractional
+        self._starts = []
+        self._ends = []
+        self._chunks = []
+        # running difference array for buckets _first onwards, with counts
+        # up to (not including) bucket _stop
+        self._first = None
+        self._stop = None
+        self._diff = None
+        self._buckets = None
+
+    def add(self, start, end):
+        start *= self._mult
+        end *= self._mult
+        if not self.fractional:
+            start = int(start)
+            end = int(math.ceil(end))
+            if end == start:
+                end += 1
+        if end > start:
+            self._starts.append(start)
+            self._ends.append(end)
+        self._buckets = None
+
+    def add_many(self, starts, ends):
+        """
+        Vectorized add() for arrays of start and end times.
+        """
+        starts = np.asarray(starts, dtype=np.float64) * self._mult
+        ends = np.asarray(ends, dtype=np.float64) * self._mult
+        if not self.fractional:
+            starts = starts.astype(np.int64)
+            ends = np.ceil(ends).astype(np.int64)
+            ends[ends == starts] += 1
+        keep = ends > starts
+        self._chunks.append((starts[keep], ends[keep]))
+        self._buckets = None
+
+    def merge(self, other):
+        """
+        Add all of the requests counted by other to this counter.
+        """
+        other._fold()
+        if other._diff is not None:
+            self._grow(other._first, other._first + len(other._diff) - 1)
+            offset = other._first - self._first
+            self._diff[offset : offset + len(other._diff)] += other._diff
+            self._stop = max(self._stop, other._stop)
+        self._buckets = None
+
+    def _events(self):
+        dtype = np.float64 if self.fractional else np.int64
+        if self._starts:
+            self._chunks.append(
+                (
+                    np.array(self._starts, dtype=dtype),
+                    np.array(self._ends, dtype=dtype),
+                )
+            )
+            self._starts = []
+            self._ends = []
+        if not self._chunks:
+            return np.empty(0, dtype), np.empty(0, dtype)
+        starts = np.concatenate([c[0] for c in self._chunks])
+        ends = np.concatenate([c[1] for c in self._chunks])
+        self._chunks = []
+        return starts, ends
+
+    def _grow(self, first, last):
+        # make the difference array cover buckets first to last inclusive
+        dtype = np.float64 if self.fractional else np.int64
+        if self._diff is None:
+            self._first = first
+            self._stop = first
+            self._diff = np.zeros(last - first + 1, dtype)
+            return
+        old_last = self._first + len(self._diff) - 1
+        if first >= self._first and last <= old_last:
+            return
+        new_first = min(first, self._first)
+        new_last = max(last, old_last)
+        if last > old_last:
+            # leave room so that a file growing a little at a time (eg
+            # with --follow) doesn't copy the whole array on every update
+            new_last = max(new_last, old_last + len(self._diff) // 4)
+        diff = np.zeros(new_last - new_first + 1, dtype)
+        offset = self._first - new_first
+        diff[offset : offset + len(self._diff)] = self._diff
+        self._first = new_first
+        self._diff = diff
+
+    def _add_at(self, indexes, weights):
+        # bincount is faster for big batches, add.at for small ones
+        if len(indexes) > len(self._diff) // 8:
+            self._diff += np.bincount(
+                indexes, weights=weights, minlength=len(self._diff)
+            ).astype(self._diff.dtype)
+        else:
+            np.add.at(self._diff, indexes, 1 if weights is None else weights)
+
+    def _fold(self):
+        # add the requests recorded since the last call to the running
+        # difference array, so reading the counts again only costs time
+        # proportional to the new requests
+        starts, ends = self._events()
+        if not len(starts):
+            return
+        if self.fractional:
+            first = int(math.floor(starts.min()))
+            last = int(math.floor(ends.max())) + 1
+            stop = int(math.ceil(ends.max())) + 1
+            self._grow(first, last)
+            for points, weight in ((starts, 1.0), (ends, -1.0)):
+                # a point inside bucket j counts for the rest of bucket j and
+                # all of every later bucket
+                j = np.floor(points).astype(np.int64) - self._first
+                frac = points - np.floor(points)
+                self._add_at(j, weight * (1 - frac))
+                self._add_at(j + 1, weight * frac)
+        else:
+            first = int(starts.min())
+            stop = int(ends.max())
+            self._grow(first, stop)
+            self._add_at(starts - self._first, None)
+            self._add_at(ends - self._first, -np.ones(len(ends), np.int64))
+        self._stop = max(self._stop, stop)
+
+    def series(self):
+        """
+        Return (bucket numbers, concurrency) as dense arrays covering every
+        bucket from the first request start to the last request end.
+        """
+        self._fold()
+        if self._diff is None:
+            return np.empty(0, np.int64), np.empty(0, np.int64)
+        values = np.cumsum(self._diff[: self._stop - self._first])
+        if self.fractional:
+            values[np.abs(values) < 1e-9] = 0
+        return np.arange(self._first, self._stop), values
+
+    @property
+    def buckets(self):
+        """
+        Dict of bucket number to concurrency, for buckets with any requests.
+        """
+        if self._buckets is None:
+            keys, values = self.series()
+            nonzero = values != 0
+            self._buckets = dict(
+                zip(keys[nonzero].tolist(), values[nonzero].tolist())
+            )
+        return self._buckets
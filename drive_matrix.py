@@ -0,0 +1,144 @@
+# drives x time usage matrices, saved in a file that can be memory mapped
+#
+# per_drive.py --matrix writes one and drive_usage.py draws it. The older
+# CSV (header row ",,timestamp,timestamp,...", then "server,drive,value,..."
+# per drive) can still be read, but it's parsed in one numpy call rather
+# than cell by cell.
+#
+# File layout, like record_cache.py: 8 byte magic, 8 byte little endian
+# header length, a JSON header, then the values as one row-major array
+# aligned to ALIGNMENT bytes.
+
+import json
+import os
+import struct
+
+import numpy as np
+
+
+MATRIX_MAGIC = b"LOGFLOWM"
+MATRIX_VERSION = 1
+ALIGNMENT = 64
+
+
+class DriveMatrix(object):
+    """
+    values[i, j] is drive i's usage in the step seconds starting at
+    start + j * step. labels[i] is drive i's (server, drive) pair.
+    """
+
+    def __init__(self, values, labels, start, step):
+        self.values = values
+        self.labels = labels
+        self.start = start
+        self.step = step
+
+    def __len__(self):
+        return len(self.labels)
+
+    @property
+    def timestamps(self):
+        return self.start + self.step * np.arange(self.values.shape[1])
+
+
+def write(path, labels, start, step, column_count, rows, dtype):
+    """
+    Write a matrix to path one row at a time, so it never has to be in
+    memory all at once. rows yields (first column, values) for each label
+    in turn; the cells around values are zero.
+    """
+    dtype = np.dtype(dtype)
+    header = {
+        "version": MATRIX_VERSION,
+        "shape": [len(labels), int(column_count)],
+        "dtype": dtype.str,
+        "start": float(start),
+        "step": float(step),
+        "labels": [list(label) for label in labels],
+    }
+    header_size = len(json.dumps(header)) + 32
+    header["offset"] = _aligned(16 + header_size)
+    header_bytes = json.dumps(header).encode("utf-8")
+    header_bytes += b" " * (header_size - len(header_bytes))
+
+    tmp_name = "%s.tmp.%d" % (path, os.getpid())
+    try:
+        with open(tmp_name, "wb") as f:
+            f.write(MATRIX_MAGIC)
+            f.write(struct.pack("<Q", header_size))
+            f.write(header_bytes)
+            f.write(b"\0" * (header["offset"] - f.tell()))
+            for first, values in rows:
+                row = np.zeros(column_count, dtype)
+                row[first : first + len(values)] = values
+                f.write(row.tobytes())
+        os.replace(tmp_name, path)
+    finally:
+        if os.path.exists(tmp_name):
+            os.unlink(tmp_name)
+
+
+def _aligned(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def read(path):
+    """
+    Return the DriveMatrix in path with its values memory mapped.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MATRIX_MAGIC)) != MATRIX_MAGIC:
+            raise ValueError("%s is not a drive matrix file" % path)
+        (header_size,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_size).decode("utf-8"))
+    if header.get("version") != MATRIX_VERSION:
+        raise ValueError(
+            "%s is drive matrix version %s, not %s"
+            % (path, header.get("version"), MATRIX_VERSION)
+        )
+    shape = tuple(header["shape"])
+    if shape[0] and shape[1]:
+        values = np.memmap(
+            path,
+            dtype=header["dtype"],
+            mode="r",
+            offset=header["offset"],
+            shape=shape,
+        )
+    else:
+        values = np.zeros(shape, header["dtype"])
+    labels = [tuple(label) for label in header["labels"]]
+    return DriveMatrix(values, labels, header["start"], header["step"])
+
+
+def read_csv(path):
+    """
+    Return a DriveMatrix from a CSV file. Timestamps are assumed to be
+    evenly spaced, and cells to be plain numbers.
+    """
+    labels = []
+    cells = []
+    with open(path, "r", newline="") as f:
+        timestamps = [float(x) for x in f.readline().rstrip().split(",")[2:]]
+        for line in f:
+            server, drive, rest = line.rstrip("\r\n").split(",", 2)
+            labels.append((server, drive))
+            cells.append(rest)
+    if cells:
+        # one parse of every cell, instead of a float() call per cell
+        values = np.loadtxt(cells, dtype=np.float64, delimiter=",", ndmin=2)
+    else:
+        values = np.zeros((0, len(timestamps)))
+    step = timestamps[1] - timestamps[0] if len(timestamps) > 1 else 1.0
+    return DriveMatrix(values, labels, timestamps[0], step)
+
+
+def load(path):
+    """
+    Read path as a drive matrix file, or as CSV if it isn't one.
+    """
+    with open(path, "rb") as f:
+        magic = f.read(len(MATRIX_MAGIC))
+    if magic == MATRIX_MAGIC:
+        return read(path)
+    return read_csv(path)
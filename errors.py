@@ -0,0 +1,137 @@
+# timeouts between the proxy and the storage servers, from proxy error lines
+#
+#   ERROR with Object server 10.0.0.5:6000/d4 re: Trying to GET /v1/a/c/o:
+#   ChunkTimeout (10.0s) (txn: tx6...)
+#
+# An incident log can have hundreds of thousands of these, so lines are
+# first checked for a couple of fixed strings and the ones that pass are
+# split with str.partition and friends rather than a regex with several
+# lazy groups. The events are kept as flat lists, so counting them into time
+# bins for a chart is a couple of NumPy calls however many there are.
+
+import collections
+
+import numpy as np
+
+
+# every timeout line contains these; see timeout_lines and scan_lines
+NEEDLES = (b"ERROR with ", b"Timeout (")
+
+TimeoutEvent = collections.namedtuple(
+    "TimeoutEvent",
+    [
+        "backend_type",  # Object, Container, Account
+        "backend",  # ip:port of the storage server
+        "device",
+        "method",
+        "path",
+        "timeout_type",  # Timeout, ChunkTimeout, ConnectionTimeout, ...
+        "timeout",  # seconds
+        "txn",
+    ],
+)
+
+
+def timeout_lines(lines):
+    """
+    The lines that might be timeouts, without parsing any of them.
+    """
+    for line in lines:
+        if "ERROR with " in line and "Timeout (" in line:
+            yield line
+
+
+def parse_timeout(record):
+    """
+    Turn a logparse.ErrorLine into a TimeoutEvent, or None if it isn't a
+    timeout talking to a storage server.
+    """
+    message = record.message
+    if not message.startswith("ERROR with "):
+        return None
+    end = message.rfind("Timeout (")
+    if end < 0:
+        return None
+    backend_type, sep, rest = message[11:end].partition(" server ")
+    if not sep:
+        return None
+    address, sep, rest = rest.partition(" re: ")
+    if not sep:
+        return None
+    # the type is the word before "Timeout", after the last ": "
+    request, sep, timeout_type = rest.rpartition(": ")
+    if not sep:
+        return None
+    amount_end = message.find("s)", end)
+    try:
+        timeout = float(message[end + 9 : amount_end])
+    except ValueError:
+        return None
+    backend, _, device = address.partition("/")
+    method, path = "", request
+    if request.startswith("Trying to "):
+        # not eg "Trying to get final status of PUT to /v1/..."
+        word, _, rest = request[10:].partition(" ")
+        if word.isupper():
+            method, path = word, rest
+    txn = ""
+    txn_start = message.find("(txn: ", amount_end)
+    if txn_start >= 0:
+        txn = message[txn_start + 6 : message.find(")", txn_start)]
+    return TimeoutEvent(
+        backend_type,
+        backend,
+        device,
+        method,
+        path,
+        timeout_type + "Timeout",
+        timeout,
+        txn,
+    )
+
+
+class Timeouts(object):
+    """
+    Timeout events with their times, counted by type and by backend server.
+    """
+
+    def __init__(self):
+        self.times = []
+        self.types = []
+        self.by_type = collections.Counter()
+        self.by_backend = collections.Counter()
+
+    def __len__(self):
+        return len(self.times)
+
+    def add(self, when, event):
+        self.times.append(when)
+        self.types.append(event.timeout_type)
+        self.by_type[event.timeout_type] += 1
+        self.by_backend["%s %s" % (event.backend_type, event.backend)] += 1
+
+    def merge(self, other):
+        self.times.extend(other.times)
+        self.types.extend(other.types)
+        self.by_type.update(other.by_type)
+        self.by_backend.update(other.by_backend)
+
+    def binned(self, bin_size):
+        """
+        Count the events into bins of bin_size seconds. Returns the bin
+        edges and a dict of timeout type to its count in each bin.
+        """
+        times = np.asarray(self.times, dtype=np.float64)
+        if not len(times):
+            return np.empty(0), {}
+        first = np.floor(times.min() / bin_size) * bin_size
+        bins = ((times - first) // bin_size).astype(np.int64)
+        bin_count = int(bins.max()) + 1
+        edges = first + bin_size * np.arange(bin_count + 1)
+        types = np.asarray(self.types)
+        counts = {}
+        for timeout_type in sorted(self.by_type):
+            counts[timeout_type] = np.bincount(
+                bins[types == timeout_type], minlength=bin_count
+            )
+        return edges, counts
@@ -3,7 +3,16 @@
 import re
 import sys
 import argparse
-import pygraphviz as pgv
+import heapq
+import json
+
+import logfiles
+import logparse
+import parallel
+import stages
+import table_print
+import timerange
+import traces
 
 
 parser = argparse.ArgumentParser()
@@ -11,47 +20,107 @@ parser.add_argument("--use-server-type", default=False, action="store_true")
 parser.add_argument(
     "--show-response-codes", default=False, action="store_true"
 )
-parser.add_argument("filename")
-args = parser.parse_args()
-
-storage_log_pattern = r"""
-.*?  # remote_addr
-\s-\s-\s
-\[.*?\]  # datetime
-\s
-"(.*?)\s.*?"  # req method and path
-\s
-(\d\d\d)  # status int
-\s
-.*?  # content length
-\s
-".*?"  # referrer
-\s
-".*?"  # txn id
-\s
-"(.*?)\s(\d*?)"  # user agent
-\s
-.*?  # transaction time
-\s
-(\d{1,6})  # server pid
-"""
-
-auth_pattern = r"""
-User:\s
-.*?  # user id
-uses\stoken\s
-.*?\s
-\(trans_id .*?\)
-"""
-
-storage_log_regex = re.compile(storage_log_pattern, re.VERBOSE | re.MULTILINE)
-auth_pattern_regex = re.compile(auth_pattern, re.VERBOSE | re.MULTILINE)
+parser.add_argument("--jobs", type=int, default=1)
+parser.add_argument(
+    "--no-cache",
+    default=False,
+    action="store_true",
+    help="does nothing, as this report doesn't use the record cache; taken "
+    "so the reports all accept the same options",
+)
+parser.add_argument(
+    "--trace",
+    default=False,
+    action="store_true",
+    help="join lines by transaction id and show per-hop latency",
+)
+parser.add_argument(
+    "--max-open-traces",
+    type=int,
+    default=100000,
+    help="with --trace, most transactions to hold waiting for the proxy line",
+)
+parser.add_argument(
+    "--trace-max-age",
+    type=float,
+    default=300.0,
+    help="with --trace, seconds of log time to hold an unfinished transaction",
+)
+parser.add_argument(
+    "--top-edges",
+    type=int,
+    default=None,
+    metavar="K",
+    help="only keep the K edges with the most calls",
+)
+parser.add_argument(
+    "--group",
+    action="append",
+    default=[],
+    metavar="PATTERN=NAME",
+    help="merge nodes matching the regex PATTERN into one called NAME, eg "
+    r"'(\S+-server) \d+=\1' to collapse pids (can be given more than once)",
+)
+parser.add_argument(
+    "--format",
+    choices=("png", "text", "dot", "json"),
+    default="png",
+    help="draw out.png, or write the edges as a table, DOT or JSON without "
+    "laying out the graph",
+)
+parser.add_argument(
+    "--output", help="file to write (default out.png, or stdout for text)"
+)
+timerange.add_arguments(parser)
+logfiles.add_arguments(parser)
+
+args = None
+time_range = None
+node_groups = []
+# the records add_records wants, or None to be handed raw lines instead
+KINDS = None
+# whether add_records needs all the records in time order, not in chunks
+ORDERED = False
+
+
+def init(argv=None):
+    """
+    Parse the command line (or argv, when run from logflow.py).
+    """
+    global args, time_range, KINDS, ORDERED
+    args = parser.parse_args(argv)
+    args.filenames = logfiles.expand(args.filenames, parser)
+    time_range = timerange.from_args(args, parser)
+
+    del node_groups[:]
+    for group in args.group:
+        pattern, sep, name = group.rpartition("=")
+        if not sep or not pattern:
+            parser.error("--group needs PATTERN=NAME, got %r" % group)
+        try:
+            node_groups.append((re.compile(pattern), name))
+        except re.error as e:
+            parser.error("bad --group pattern %r: %s" % (pattern, e))
+
+    if args.trace:
+        KINDS = (logparse.ProxyAccess, logparse.StorageAccess)
+    else:
+        KINDS = None
+    # a request's lines are spread over the logs of the nodes it touched,
+    # and over the chunks of a single log, so it's never read in chunks
+    ORDERED = args.trace
+
+
+# without --trace, each storage line is an edge from the service that made
+# the request to the server, and each auth line one from the proxy to auth.
+# Only these fields of the storage lines are parsed. The background daemons
+# log storage lines as other server types (see st_map), so those count too.
+EDGE_KINDS = (logparse.StorageAccess, logparse.AuthLine)
+EDGE_FIELDS = ("method", "status", "source", "source_pid", "server_pid")
 
 st_map = {"obj-server": "object-server", "swift": "container-reconciler"}
 
-g = pgv.AGraph(
-    strict=False,
-    directed=True,
+graph_attrs = dict(
     overlap="prism",
     overlap_shrink="true",
     sep=".25",
@@ -62,75 +131,347 @@ g = pgv.AGraph(
 )
 servers_found = set()
 
-edge_tracker = dict()
-
-max_found_edge_weight = 0
 max_edge_weight = 5
 
+_group_memo = {}
+
+
+def _group(node):
+    # the same few names come up on every line, so remember the answers
+    try:
+        return _group_memo[node]
+    except KeyError:
+        pass
+    name = node
+    for pattern, template in node_groups:
+        m = pattern.search(node)
+        if m:
+            name = m.expand(template)
+            break
+    _group_memo[node] = name
+    return name
+
 
-def _add_edge(s1, s2, method, status):
-    global max_found_edge_weight
+def _add_edge(edge_tracker, s1, s2, method, status):
     if not args.show_response_codes:
         status = ""
-    key = s1 + s2 + method + status
-    if method or status:
-        if status:
-            label = "%s (%s)" % (method, status)
-        else:
-            label = method
-    else:
-        label = ""
+    if node_groups:
+        s1 = _group(s1)
+        s2 = _group(s2)
+    key = (s1, s2, method, status)
+    edge_tracker[key] = edge_tracker.get(key, 0) + 1
 
-    if key in edge_tracker:
-        edge_tracker[key][2] += 1
+
+def _label(edge):
+    if edge["status"]:
+        label = "%s (%s)" % (edge["method"], edge["status"])
+    else:
+        label = edge["method"]
+    if label:
+        label = "%dx %s" % (edge["count"], label)
     else:
-        edge_tracker[key] = [(s1, s2, method), label, 1]
-    max_found_edge_weight = max(edge_tracker[key][2], max_found_edge_weight)
+        label = "%dx" % edge["count"]
+    if "p50" in edge:
+        label += "\np50 %s p99 %s" % (_ms(edge["p50"]), _ms(edge["p99"]))
+    return label
+
 
+def _thickness(edge, max_found_edge_weight):
+    return max(
+        float(edge["count"]) / max_found_edge_weight * max_edge_weight, 1.0
+    )
 
-def _write_edges():
-    for edge in edge_tracker.values():
-        (src, target, method), label, count = edge
-        label = "%dx %s" % (count, label) if label else "%dx" % (count)
-        edge_thickness = max(
-            float(count) / max_found_edge_weight * max_edge_weight, 1.0
+
+def _color(edge):
+    # edges that are usually the slowest part of their request
+    if edge.get("critical", 0) > 0.5:
+        return "red"
+    return "black"
+
+
+def _prune(edges):
+    if args.top_edges is None or len(edges) <= args.top_edges:
+        return edges
+    keep = set(
+        heapq.nlargest(
+            args.top_edges, range(len(edges)), key=lambda i: edges[i]["count"]
         )
-        g.add_edge(
-            src, target, label=label, weight=count, penwidth=edge_thickness
+    )
+    # same order as before, so the layout doesn't shuffle
+    return [edge for i, edge in enumerate(edges) if i in keep]
+
+
+def draw_png(edges, prog, filename):
+    # only needed for drawing, and slow to import
+    import pygraphviz as pgv
+
+    g = pgv.AGraph(strict=False, directed=True, **graph_attrs)
+    max_found_edge_weight = max((e["count"] for e in edges), default=0)
+    for edge in edges:
+        attrs = dict(
+            label=_label(edge),
+            weight=edge["count"],
+            penwidth=_thickness(edge, max_found_edge_weight),
         )
+        if args.trace:
+            attrs["color"] = _color(edge)
+        g.add_edge(edge["from"], edge["to"], **attrs)
+    g.graph_attr["ratio"] = "0.618"
+    g.layout(prog=prog)
+    g.draw(filename, prog=prog)
 
 
-with open(args.filename, "rb") as f:
-    for rawline in f:
-        rawline = rawline.strip()
-        if not rawline or rawline.startswith("#"):
-            continue
-        line = rawline[16:]  # pull off syslog timestamp
-        if not line:
+def _dot_quote(text):
+    text = text.replace("\\", "\\\\").replace('"', '\\"')
+    return '"%s"' % text.replace("\n", "\\n")
+
+
+def dot_text(edges, prog):
+    out = ["digraph flow {"]
+    attrs = dict(graph_attrs, ratio="0.618", layout=prog)
+    out.append(
+        "    graph [%s];"
+        % ", ".join(
+            "%s=%s" % (k, _dot_quote(str(v))) for k, v in attrs.items()
+        )
+    )
+    max_found_edge_weight = max((e["count"] for e in edges), default=0)
+    for edge in edges:
+        out.append(
+            "    %s -> %s [label=%s, weight=%d, penwidth=%.2f, color=%s];"
+            % (
+                _dot_quote(edge["from"]),
+                _dot_quote(edge["to"]),
+                _dot_quote(_label(edge)),
+                edge["count"],
+                _thickness(edge, max_found_edge_weight),
+                _color(edge),
+            )
+        )
+    out.append("}")
+    return "\n".join(out) + "\n"
+
+
+def _node_names(record):
+    source = st_map.get(record.source, record.source)
+    server_type = st_map.get(record.server_type, record.server_type)
+    source_pid = record.source_pid
+    server_pid = record.server_pid
+    if args.use_server_type:
+        source_pid = ""
+        server_pid = ""
+    return (
+        ("%s %s" % (source, source_pid)).strip(),
+        ("%s %s" % (server_type, server_pid)).strip(),
+    )
+
+
+def _hop_names(record):
+    source, target = _node_names(record)
+    return _group(source), _group(target)
+
+
+def _ms(seconds):
+    return "%.1fms" % (seconds * 1000)
+
+
+def trace_edges(index):
+    edges = []
+    for (src, target, method), stats in index.edges.items():
+        p50, p99 = stats.percentiles([0.5, 0.99])
+        edges.append(
+            {
+                "from": src,
+                "to": target,
+                "method": method,
+                "status": "",
+                "count": stats.calls,
+                "p50": float(p50),
+                "p99": float(p99),
+                "critical": stats.critical / stats.calls,
+            }
+        )
+    return edges
+
+
+def trace_table(index, edges):
+    t = [
+        (
+            None,
+            "%d transactions, %d unfinished"
+            % (index.completed, index.evicted),
+        ),
+        ("From", "To", "Method", "Calls", "p50", "p99", "Critical Path"),
+    ]
+    for edge in sorted(edges, key=lambda e: e["count"], reverse=True):
+        t.append(
+            (
+                edge["from"],
+                edge["to"],
+                edge["method"],
+                edge["count"],
+                _ms(edge["p50"]),
+                _ms(edge["p99"]),
+                "%d%%" % (edge["critical"] * 100),
+            )
+        )
+    return t
+
+
+def new_partial():
+    if args.trace:
+        return traces.TraceIndex(
+            _hop_names, args.max_open_traces, args.trace_max_age
+        )
+    return dict()
+
+
+def add_records(index, records):
+    for record in records:
+        if time_range.contains(record.end_time):
+            index.add(record)
+
+
+def add_lines(edge_tracker, lines):
+    if time_range:
+        lines = (
+            line for line in lines if time_range.contains_syslog(line[:15])
+        )
+    records = logparse.parse_lines(
+        lines, kinds=EDGE_KINDS, fields=EDGE_FIELDS, storage_types=None
+    )
+    for record in records:
+        if isinstance(record, logparse.AuthLine):
+            _add_edge(edge_tracker, "proxy-server", "auth", "", "")
             continue
-        server_name, line = line.split(" ", 1)
-        server_type, line = line.split(": ", 1)
-        server_type = st_map.get(server_type.strip(), server_type.strip())
-        m = storage_log_regex.match(line)
-        if m:
-            (method, status, source, source_pid, server_pid) = m.groups()
-            if args.use_server_type:
-                source_pid = ""
-                server_pid = ""
-            source = st_map.get(source, source)
-            source = "%s %s" % (source, source_pid)
-            dest = "%s %s" % (server_type, server_pid)
-            _add_edge(source, dest, method, status)
+        source, dest = _node_names(record)
+        _add_edge(
+            edge_tracker, source, dest, record.method, str(record.status)
+        )
+
+
+# the merged partials: a TraceIndex with --trace, otherwise a dict of edge
+# to count, merged in file order so edges are added to the graph in the
+# order they were first seen, same as a single pass would
+merged = None
+# the globals holding the totals, saved by logflow.py --checkpoint
+STATE = ("merged",)
+
+
+def add_partial(partial):
+    global merged
+    if args.trace:
+        # transactions still waiting for their proxy line at the end of the
+        # log; their hops still count, they just can't be put on a critical
+        # path
+        partial.close()
+    if merged is None:
+        merged = partial
+    elif args.trace:
+        merged.merge(partial)
+    else:
+        for key, count in partial.items():
+            merged[key] = merged.get(key, 0) + count
+
+
+def collect(lines):
+    partial = new_partial()
+    if KINDS is None:
+        add_lines(partial, lines)
+    else:
+        add_records(partial, logparse.parse_lines(lines, kinds=KINDS))
+    return partial
+
+
+def merged_edges():
+    """
+    The edges from all of the partials, after --top-edges.
+    """
+    if merged is None:
+        add_partial(new_partial())
+    if args.trace:
+        return _prune(trace_edges(merged))
+    return _prune(
+        [
+            {
+                "from": s1,
+                "to": s2,
+                "method": method,
+                "status": status,
+                "count": count,
+            }
+            for (s1, s2, method, status), count in merged.items()
+        ]
+    )
+
+
+def edge_table(edges):
+    t = [("From", "To", "Method", "Status", "Calls")]
+    for edge in sorted(edges, key=lambda e: e["count"], reverse=True):
+        t.append(
+            (
+                edge["from"],
+                edge["to"],
+                edge["method"],
+                edge["status"],
+                edge["count"],
+            )
+        )
+    return t
+
+
+def summary():
+    return {"edges": merged_edges()}
+
+
+def finish():
+    edges = merged_edges()
+    if args.trace and args.format == "png":
+        print(table_print.table_print(trace_table(merged, edges)))
+
+    with stages.stage("render"):
+        if args.use_server_type:
+            prog = "fdp"
         else:
-            m = auth_pattern_regex.match(line)
-            if m:
-                _add_edge("proxy-server", "auth", "", "")
-
-_write_edges()
-g.graph_attr["ratio"] = "0.618"
-if args.use_server_type:
-    prog = "fdp"
-else:
-    prog = "twopi"
-g.layout(prog=prog)
-g.draw("out.png", prog=prog)
+            prog = "twopi"
+        if args.format == "png":
+            draw_png(edges, prog, args.output or "out.png")
+        else:
+            if args.format == "text":
+                if args.trace:
+                    table = trace_table(merged, edges)
+                else:
+                    table = edge_table(edges)
+                text = table_print.table_print(table) + "\n"
+            elif args.format == "dot":
+                text = dot_text(edges, prog)
+            else:
+                text = json.dumps({"edges": edges}, indent=2) + "\n"
+            if args.output:
+                with open(args.output, "w") as f:
+                    f.write(text)
+            else:
+                sys.stdout.write(text)
+
+
+if __name__ == "__main__":
+    init()
+    with stages.stage("parse"):
+        if ORDERED:
+            partial = new_partial()
+            add_records(
+                partial,
+                logfiles.merge_records(
+                    args.filenames, KINDS, args.jobs, time_range=time_range
+                ),
+            )
+            chunks = [partial]
+        else:
+            chunks = parallel.map_chunks(
+                args.filenames, collect, args.jobs, time_range=time_range
+            )
+    with stages.stage("aggregate"):
+        for chunk in chunks:
+            add_partial(chunk)
+
+    finish()
@@ -0,0 +1,164 @@
+# follow a growing log like `tail -F` and keep a report's numbers current
+#
+# Only bytes appended since the last poll are read and parsed, and each
+# batch of new lines is handed to the report to fold into its running
+# totals, so an update costs time proportional to the new lines rather than
+# to the size of the file.
+
+import os
+import sys
+import time
+
+import compressed
+import table_print
+
+
+def follow_lines(filename, poll_interval=1.0, block_size=2 ** 20):
+    """
+    Generator of lists of complete lines (without line endings) as they are
+    appended to filename, starting from the beginning of the file. Yields an
+    empty list after each poll that found nothing new, so the caller gets a
+    chance to do periodic work on a quiet log.
+
+    If filename is replaced by a new file (log rotation, detected by a
+    change of inode) the new file is read from its start. If it's truncated
+    in place, reading starts over from its start too.
+    """
+    f = None
+    inode = None
+    leftover = b""
+    try:
+        while True:
+            if f is None:
+                try:
+                    f = open(filename, "rb")
+                except FileNotFoundError:
+                    # between the rotated file moving away and the new one
+                    # appearing
+                    yield []
+                    time.sleep(poll_interval)
+                    continue
+                inode = os.fstat(f.fileno()).st_ino
+                leftover = b""
+
+            block = f.read(block_size)
+            if block:
+                block = leftover + block
+                cut = block.rfind(b"\n") + 1
+                leftover = block[cut:]
+                if cut:
+                    text = block[:cut].decode("utf-8", "replace")
+                    yield text.split("\n")[:-1]
+                continue
+
+            # at the end of the file, so see if it's been rotated or
+            # truncated before waiting for more
+            try:
+                st = os.stat(filename)
+            except FileNotFoundError:
+                st = None
+            if st is not None and st.st_ino != inode:
+                # everything written to the old file has been read
+                f.close()
+                f = None
+                continue
+            if st is not None and st.st_size < f.tell():
+                f.seek(0)
+                leftover = b""
+                continue
+            yield []
+            time.sleep(poll_interval)
+    finally:
+        if f is not None:
+            f.close()
+
+
+def follow_files(filenames, poll_interval=1.0):
+    """
+    follow_lines for several files at once, eg one log per node. Each list
+    holds new lines from any of them, with each file's lines in order.
+    """
+    if len(filenames) == 1:
+        yield from follow_lines(filenames[0], poll_interval)
+        return
+    followers = [follow_lines(f, poll_interval=0) for f in filenames]
+    while True:
+        lines = []
+        for follower in followers:
+            lines.extend(next(follower))
+        yield lines
+        if not lines:
+            time.sleep(poll_interval)
+
+
+def add_arguments(parser):
+    """
+    Add the --follow options shared by the reports to an argparse parser.
+    """
+    parser.add_argument(
+        "--follow",
+        default=False,
+        action="store_true",
+        help="keep reading the log as it grows and print running totals",
+    )
+    parser.add_argument(
+        "--refresh",
+        type=float,
+        default=10.0,
+        help="seconds between summaries with --follow",
+    )
+    parser.add_argument(
+        "--render-interval",
+        type=float,
+        default=None,
+        help="seconds between redrawing the charts with --follow",
+    )
+
+
+def run(
+    filenames,
+    update,
+    summarize,
+    render=None,
+    refresh=10.0,
+    render_interval=None,
+    poll_interval=1.0,
+):
+    """
+    Follow the logs filenames until interrupted, calling update(lines) with
+    each batch of new lines. Every `refresh` seconds, print
+    table_print(summarize()). If render is given, call it every
+    `render_interval` seconds and once more on exit.
+    """
+    for filename in filenames:
+        if (
+            os.path.exists(filename)
+            and compressed.compression(filename) is not None
+        ):
+            raise SystemExit("can't follow %s, it's compressed" % filename)
+    last_summary = last_render = time.monotonic()
+    line_count = 0
+    try:
+        for lines in follow_files(filenames, poll_interval):
+            if lines:
+                update(lines)
+                line_count += len(lines)
+            now = time.monotonic()
+            if now - last_summary >= refresh:
+                print("%s: %d lines" % (time.strftime("%H:%M:%S"), line_count))
+                print(table_print.table_print(summarize()))
+                print()
+                sys.stdout.flush()
+                last_summary = now
+            if (
+                render
+                and render_interval
+                and now - last_render >= render_interval
+            ):
+                render()
+                last_render = now
+    except KeyboardInterrupt:
+        print(file=sys.stderr)
+    print(table_print.table_print(summarize()))
+    if render:
+        render()
@@ -0,0 +1,447 @@
+#!/usr/bin/env python3.7
+
+# write a synthetic swift log, eg for benchmarking the reports
+#
+# Each client request is logged the way a real cluster logs it: maybe an
+# auth line, a line from every storage server the proxy talked to (plus the
+# container updates for object writes), now and then a backend timeout, and
+# finally the proxy's access line. Lines come out in syslog time order.
+
+import argparse
+import heapq
+import math
+import random
+import sys
+import time
+
+
+PROXY_PORT = 8080
+SERVER_PORTS = {"account": 6202, "container": 6201, "object": 6200}
+
+USER_AGENTS = (
+    "curl/7.68.0",
+    "python-swiftclient-3.9.0",
+    "rclone/v1.51.0",
+    "aws-cli/1.18.69",
+)
+
+SUCCESS_STATUS = {"GET": 200, "HEAD": 204, "PUT": 201, "DELETE": 204}
+
+
+def weights(spec):
+    """
+    Parse "GET=60,PUT=25" into (["GET", "PUT"], [60.0, 25.0]).
+    """
+    names = []
+    values = []
+    for item in spec.split(","):
+        name, _, value = item.partition("=")
+        names.append(name.strip())
+        values.append(float(value))
+    return names, values
+
+
+class Cluster(object):
+    def __init__(self, args, rng):
+        self.args = args
+        self.rng = rng
+        self.proxies = ["px%02d" % i for i in range(1, args.proxies + 1)]
+        self.nodes = [
+            ("sn%02d" % i, "10.0.1.%d" % i)
+            for i in range(1, args.storage_nodes + 1)
+        ]
+        # device names are unique across the cluster, like a SAIO's d1-d4
+        self.drives = [
+            (node, "d%d" % (n * args.drives + d + 1))
+            for n, node in enumerate(self.nodes)
+            for d in range(args.drives)
+        ]
+        self.pids = {
+            (node[0], server): rng.randint(1000, 32000)
+            for node in self.nodes
+            for server in SERVER_PORTS
+        }
+        self.proxy_pids = {p: rng.randint(1000, 32000) for p in self.proxies}
+        self.methods = weights(args.mix)
+        self.targets = weights(args.targets)
+        self._dates = {}
+        self._seq = 0
+        self.pending = []
+
+    def dates(self, t):
+        # syslog prefix, proxy date and storage date for a unix time
+        second = int(t)
+        try:
+            return self._dates[second]
+        except KeyError:
+            pass
+        local = time.localtime(second)
+        utc = time.gmtime(second)
+        dates = (
+            "%s %2d %s"
+            % (
+                time.strftime("%b", local),
+                local.tm_mday,
+                time.strftime("%H:%M:%S", local),
+            ),
+            time.strftime("%d/%b/%Y/%H/%M/%S", utc),
+            time.strftime("%d/%b/%Y:%H:%M:%S +0000", utc),
+        )
+        if len(self._dates) > 100000:
+            self._dates.clear()
+        self._dates[second] = dates
+        return dates
+
+    def log(self, t, host, server_type, message):
+        self._seq += 1
+        prefix = self.dates(t)[0]
+        line = "%s %s %s: %s\n" % (prefix, host, server_type, message)
+        heapq.heappush(self.pending, (t, self._seq, line))
+
+    def latency(self):
+        return self.rng.lognormvariate(
+            math.log(self.args.latency_median), self.args.latency_sigma
+        )
+
+    def storage(
+        self,
+        proxy,
+        replica,
+        t,
+        duration,
+        target,
+        method,
+        path,
+        status,
+        length,
+        txn_id,
+        referer,
+        source,
+    ):
+        (node, ip), drive = replica
+        partition = self.rng.randint(0, 1023)
+        pid = self.pids[(node, target)]
+        self.log(
+            t + duration,
+            node,
+            "%s-server" % target,
+            '%s - - [%s] "%s /%s/%d%s" %d %s "%s" "%s" "%s" %.4f "-" %d %d'
+            % (
+                "10.0.0.%d" % (self.proxies.index(proxy) + 1),
+                self.dates(t + duration)[2],
+                method,
+                drive,
+                partition,
+                path[3:],
+                status,
+                length,
+                referer,
+                txn_id,
+                source,
+                duration,
+                pid,
+                0,
+            ),
+        )
+
+    def request(self, t):
+        rng = self.rng
+        args = self.args
+        method = rng.choices(*self.methods)[0]
+        target = rng.choices(*self.targets)[0]
+        account = "AUTH_test%d" % rng.randint(1, args.accounts)
+        path = "/v1/%s" % account
+        if target != "account":
+            path += "/c%d" % rng.randint(1, 50)
+        if target == "object":
+            path += "/o%d" % rng.randint(1, 1000000)
+        txn_id = "tx%021x-%010x" % (rng.getrandbits(84), int(t))
+        proxy = rng.choice(self.proxies)
+        client_ip = "192.168.%d.%d" % (
+            rng.randint(0, 255),
+            rng.randint(1, 254),
+        )
+
+        if rng.random() < args.auth_rate:
+            self.log(
+                t,
+                proxy,
+                "proxy-server",
+                "User: test uses token AUTH_tk%032x (trans_id %s)"
+                % (rng.getrandbits(128), txn_id),
+            )
+
+        failed = rng.random() < args.error_rate
+        status = 503 if failed else SUCCESS_STATUS[method]
+        if target == "object":
+            length = rng.randint(1, 4 * 2 ** 20)
+        else:
+            # a listing
+            length = rng.randint(2, 8192)
+        duration = self.latency()
+        referer = "%s http://%s:%d%s" % (method, proxy, PROXY_PORT, path)
+        source = "proxy-server %d" % self.proxy_pids[proxy]
+        backend_start = t + min(0.001, duration / 10)
+
+        # reads go to one replica, writes to all of them
+        replicas = rng.sample(self.drives, args.replicas)
+        if method in ("GET", "HEAD"):
+            replicas = replicas[:1]
+            if target == "object" and rng.random() < args.timeout_rate:
+                backend_start = self.timeout(
+                    proxy, backend_start, method, path, txn_id, client_ip
+                )
+        for replica in replicas:
+            backend = duration * rng.uniform(0.5, 0.95)
+            self.storage(
+                proxy,
+                replica,
+                backend_start,
+                backend,
+                target,
+                method,
+                path,
+                status,
+                # the object body, either way it went
+                length if method in ("GET", "PUT") else "-",
+                txn_id,
+                referer,
+                source,
+            )
+            if target == "object" and method in ("PUT", "DELETE"):
+                # the object server updates the container listing
+                self.storage(
+                    proxy,
+                    rng.choice(self.drives),
+                    backend_start + backend * 0.8,
+                    backend * 0.05,
+                    "container",
+                    method,
+                    path,
+                    201 if method == "PUT" else 204,
+                    "-",
+                    txn_id,
+                    "%s http://%s:%d/%s%s"
+                    % (
+                        method,
+                        replica[0][1],
+                        SERVER_PORTS["object"],
+                        replica[1],
+                        path[3:],
+                    ),
+                    "obj-server %d" % self.pids[(replica[0][0], "object")],
+                )
+        end = backend_start + duration
+
+        if rng.random() < args.internal_rate:
+            # the proxy checks the account exists before acting on it
+            internal = duration * 0.2
+            self.storage(
+                proxy,
+                rng.choice(self.drives),
+                t,
+                internal * 0.5,
+                "account",
+                "HEAD",
+                "/v1/%s" % account,
+                204,
+                "-",
+                txn_id,
+                "HEAD http://%s:%d/v1/%s" % (proxy, PROXY_PORT, account),
+                source,
+            )
+            self.proxy_line(
+                proxy,
+                t,
+                t + internal,
+                "-",
+                "-",
+                "HEAD",
+                "/v1/%s" % account,
+                204,
+                "Swift",
+                "-",
+                0,
+                0,
+                txn_id,
+                "GET_INFO",
+                None,
+            )
+
+        self.proxy_line(
+            proxy,
+            t,
+            end,
+            client_ip,
+            client_ip,
+            method,
+            path,
+            status,
+            rng.choice(USER_AGENTS),
+            "AUTH_tk%09x..." % rng.getrandbits(36),
+            length if method == "PUT" and not failed else 0,
+            length if method == "GET" and not failed else 0,
+            txn_id,
+            "-",
+            0 if target == "object" else None,
+        )
+
+    def timeout(self, proxy, t, method, path, txn_id, client_ip):
+        # the first replica doesn't answer in time; returns when the proxy
+        # moves on to the next one
+        if self.rng.random() < 0.5:
+            kind, seconds = "Connection", self.args.conn_timeout
+        else:
+            kind, seconds = "", self.args.node_timeout
+        (node, ip), drive = self.rng.choice(self.drives)
+        self.log(
+            t + seconds,
+            proxy,
+            "proxy-server",
+            "ERROR with Object server %s:%d/%s re: Trying to %s %s: "
+            "%sTimeout (%.1fs) (txn: %s) (client_ip: %s)"
+            % (
+                ip,
+                SERVER_PORTS["object"],
+                drive,
+                method,
+                path,
+                kind,
+                seconds,
+                txn_id,
+                client_ip,
+            ),
+        )
+        return t + seconds
+
+    def proxy_line(
+        self,
+        proxy,
+        start,
+        end,
+        client_ip,
+        remote_addr,
+        method,
+        path,
+        status,
+        user_agent,
+        token,
+        bytes_recvd,
+        bytes_sent,
+        txn_id,
+        source,
+        policy_index,
+    ):
+        fields = [
+            client_ip,
+            remote_addr,
+            self.dates(end)[1],
+            method,
+            path,
+            "HTTP/1.0",
+            str(status),
+            "-",
+            user_agent,
+            token,
+            str(bytes_recvd) if bytes_recvd else "-",
+            str(bytes_sent) if bytes_sent else "-",
+            "-",
+            txn_id,
+            "-",
+            "%.4f" % (end - start),
+            source,
+            "-",
+            "%.9f" % start,
+            "%.9f" % end,
+        ]
+        if policy_index is not None:
+            fields.append(str(policy_index))
+        self.log(end, proxy, "proxy-server", " ".join(fields))
+
+
+def generate(args, out):
+    rng = random.Random(args.seed)
+    cluster = Cluster(args, rng)
+    written = 0
+    t = args.start
+    while written + len(cluster.pending) < args.lines:
+        t += rng.expovariate(args.rate)
+        # nothing logged from now on can be earlier than t
+        while cluster.pending and cluster.pending[0][0] <= t:
+            out.write(heapq.heappop(cluster.pending)[2])
+            written += 1
+        cluster.request(t)
+    while cluster.pending:
+        out.write(heapq.heappop(cluster.pending)[2])
+        written += 1
+    return written
+
+
+def make_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("output", help='log file to write, or "-"')
+    parser.add_argument("--lines", type=int, default=1000000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument(
+        "--start",
+        type=float,
+        default=1583200000.0,
+        help="unix time of the first request",
+    )
+    parser.add_argument(
+        "--rate", type=float, default=200.0, help="client requests per second"
+    )
+    parser.add_argument("--mix", default="GET=60,PUT=20,HEAD=15,DELETE=5")
+    parser.add_argument(
+        "--targets", default="object=85,container=10,account=5"
+    )
+    parser.add_argument("--accounts", type=int, default=20)
+    parser.add_argument("--proxies", type=int, default=4)
+    parser.add_argument("--storage-nodes", type=int, default=8)
+    parser.add_argument(
+        "--drives", type=int, default=12, help="drives per storage node"
+    )
+    parser.add_argument("--replicas", type=int, default=3)
+    parser.add_argument(
+        "--latency-median",
+        type=float,
+        default=0.05,
+        help="median request time in seconds (log-normal)",
+    )
+    parser.add_argument("--latency-sigma", type=float, default=1.0)
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.005,
+        help="fraction of requests that fail with a 503",
+    )
+    parser.add_argument(
+        "--timeout-rate",
+        type=float,
+        default=0.002,
+        help="fraction of object reads where a backend times out",
+    )
+    parser.add_argument("--conn-timeout", type=float, default=0.5)
+    parser.add_argument("--node-timeout", type=float, default=10.0)
+    parser.add_argument("--auth-rate", type=float, default=0.05)
+    parser.add_argument(
+        "--internal-rate",
+        type=float,
+        default=0.1,
+        help="fraction of requests that make an internal GET_INFO request",
+    )
+    return parser
+
+
+if __name__ == "__main__":
+    args = make_parser().parse_args()
+    started = time.time()
+    if args.output == "-":
+        written = generate(args, sys.stdout)
+    else:
+        with open(args.output, "w") as f:
+            written = generate(args, f)
+    print(
+        "Wrote %d lines in %.1fs" % (written, time.time() - started),
+        file=sys.stderr,
+    )
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3.7
+
+# request counts, bytes and latency percentiles for proxy requests grouped
+# by any of the dimensions in groups.DIMENSIONS, eg
+#
+#   ./group_by.py --by method,status_class all.log
+#   ./group_by.py --by account --where method=PUT --sort bytes all.log
+
+import argparse
+import json
+import sys
+
+import groups
+import logfiles
+import logparse
+import parallel
+import stages
+import table_print
+import timerange
+
+
+p_measures = [
+    (0.5, "P50"),
+    (0.9, "P90"),
+    (0.99, "P99"),
+]
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--by",
+    default="method,status_class",
+    help="comma separated dimensions to group by, from: %s"
+    % ", ".join(groups.DIMENSIONS),
+)
+parser.add_argument(
+    "--where",
+    action="append",
+    default=[],
+    metavar="DIMENSION=VALUE",
+    help="only count requests with this value (can be given more than once;"
+    " values for the same dimension are alternatives)",
+)
+parser.add_argument(
+    "--sort", choices=sorted(groups.SORT_KEYS), default="count"
+)
+parser.add_argument(
+    "--top", type=int, default=20, help="how many groups to list"
+)
+parser.add_argument(
+    "--max-groups",
+    type=int,
+    default=1000,
+    help="most groups to track; requests past that are counted as (other)",
+)
+parser.add_argument("--format", choices=("text", "json"), default="text")
+parser.add_argument("--jobs", type=int, default=1)
+parser.add_argument(
+    "--no-cache",
+    default=False,
+    action="store_true",
+    help="does nothing, as this report doesn't use the record cache; taken "
+    "so the reports all accept the same options",
+)
+timerange.add_arguments(parser)
+logfiles.add_arguments(parser)
+
+args = None
+time_range = None
+dimensions = []
+filters = {}
+
+
+def init(argv=None):
+    """
+    Parse the command line (or argv, when run from logflow.py).
+    """
+    global args, time_range, dimensions, filters
+    args = parser.parse_args(argv)
+    args.filenames = logfiles.expand(args.filenames, parser)
+    time_range = timerange.from_args(args, parser)
+
+    dimensions = [name.strip() for name in args.by.split(",") if name.strip()]
+    filters = {}
+    for where in args.where:
+        name, sep, value = where.partition("=")
+        if not sep:
+            parser.error("--where needs DIMENSION=VALUE, got %r" % where)
+        filters.setdefault(name.strip(), set()).add(value)
+    try:
+        groups.GroupBy(dimensions, filters)
+    except ValueError as e:
+        parser.error(str(e))
+
+
+# the records add_records wants
+KINDS = (logparse.ProxyAccess,)
+
+
+def new_partial():
+    return groups.GroupBy(dimensions, filters, args.max_groups)
+
+
+def add_records(group_by, records):
+    for record in records:
+        if time_range.contains(record.end_time):
+            group_by.add(record)
+
+
+# all of the partials merged
+merged = None
+# the globals holding the totals, saved by logflow.py --checkpoint
+STATE = ("merged",)
+
+
+def add_partial(partial):
+    global merged
+    if merged is None:
+        merged = partial
+    else:
+        merged.merge(partial)
+
+
+def collect(lines):
+    group_by = new_partial()
+    add_records(group_by, logparse.parse_lines(lines, kinds=KINDS))
+    return group_by
+
+
+def megabytes(count):
+    return "%.1f" % (count / 2 ** 20)
+
+
+def group_rows(group_by):
+    """
+    (key, stats, percentile values, concurrency) for the top groups.
+    """
+    span = group_by.span()
+    rows = []
+    for key, stats in group_by.top(args.top, args.sort):
+        values = stats.latencies.percentiles([p for p, name in p_measures])
+        # mean requests in flight over the whole log (Little's law)
+        concurrency = stats.busy_time / span if span else 0.0
+        rows.append((key, stats, values, concurrency))
+    return rows
+
+
+def group_table(group_by):
+    span = group_by.span()
+    total = sum(stats.count for stats in group_by.groups.values())
+    t = [
+        (
+            None,
+            "%d requests in %d groups over %.0fs"
+            % (total, len(group_by.groups), span),
+        )
+    ]
+    header = tuple(dimensions) + ("Requests", "MB In", "MB Out")
+    header += tuple(name for p, name in p_measures)
+    header += ("Max", "Concurrency")
+    t.append(header)
+    for key, stats, values, concurrency in group_rows(group_by):
+        row = key + (
+            stats.count,
+            megabytes(stats.bytes_recvd),
+            megabytes(stats.bytes_sent),
+        )
+        row += tuple("%.4f" % value for value in values)
+        row += ("%.4f" % stats.latencies.max, "%.2f" % concurrency)
+        t.append(row)
+    return t
+
+
+def summary():
+    if merged is None:
+        add_partial(new_partial())
+    groups_json = []
+    for key, stats, values, concurrency in group_rows(merged):
+        group = dict(zip(dimensions, key))
+        group.update(
+            requests=stats.count,
+            bytes_recvd=stats.bytes_recvd,
+            bytes_sent=stats.bytes_sent,
+            max=stats.latencies.max,
+            concurrency=concurrency,
+        )
+        for (p, name), value in zip(p_measures, values):
+            group[name.lower()] = float(value)
+        groups_json.append(group)
+    return {
+        "requests": sum(stats.count for stats in merged.groups.values()),
+        "groups": len(merged.groups),
+        "span": merged.span(),
+        "top": groups_json,
+    }
+
+
+def finish():
+    if args.format == "json":
+        print(json.dumps(summary(), indent=2))
+        return
+    if merged is None:
+        add_partial(new_partial())
+    print(table_print.table_print(group_table(merged)))
+
+
+if __name__ == "__main__":
+    init()
+    with stages.stage("parse"):
+        chunks = parallel.map_chunks(
+            args.filenames, collect, args.jobs, time_range=time_range
+        )
+    with stages.stage("aggregate"):
+        for chunk in chunks:
+            add_partial(chunk)
+
+    print("Done", file=sys.stderr)
+
+    finish()
@@ -0,0 +1,209 @@
+# aggregate proxy requests by any combination of dimensions in one pass
+#
+# Each proxy access record is keyed by the values of the chosen dimensions
+# (eg method and status class) and counted into that group's stats. Groups
+# are capped at max_groups; requests that would start a new group past that
+# go into an "(other)" group instead, so memory stays bounded whatever the
+# dimensions, eg grouping by account on a cluster with millions of them.
+
+import hdr
+import logparse
+
+
+# dimensions are plain functions so a GroupBy can be pickled back from a
+# worker process
+
+
+def _method(record):
+    return record.method
+
+
+def _status(record):
+    return str(record.status)
+
+
+def _status_class(record):
+    return "%dxx" % (record.status // 100)
+
+
+def _policy(record):
+    return record.policy_index
+
+
+def _host(record):
+    return record.host
+
+
+def _source(record):
+    return "client" if record.source == "-" else "internal"
+
+
+def _user_agent(record):
+    return record.user_agent
+
+
+def _path_parts(record):
+    # "/v1/AUTH_test/c/o" -> ["", "v1", "AUTH_test", "c", "o"]
+    parts = record.path.split("/", 4)
+    if len(parts) < 3 or parts[1] != "v1":
+        return None
+    return parts
+
+
+def _account(record):
+    parts = _path_parts(record)
+    return parts[2] if parts else "-"
+
+
+def _container(record):
+    parts = _path_parts(record)
+    return "/".join(parts[2:4]) if parts and len(parts) > 3 else "-"
+
+
+def _depth(record):
+    depth = logparse.path_depth(record)
+    if depth >= 4:
+        return "object"
+    return {2: "account", 3: "container"}.get(depth, "other")
+
+
+# dimension name -> function of a ProxyAccess record giving its value
+DIMENSIONS = {
+    "method": _method,
+    "status": _status,
+    "status_class": _status_class,
+    "policy": _policy,
+    "account": _account,
+    "container": _container,
+    "depth": _depth,
+    "host": _host,
+    "source": _source,
+    "user_agent": _user_agent,
+}
+
+OTHER = "(other)"
+
+
+class GroupStats(object):
+    def __init__(self):
+        self.count = 0
+        self.bytes_recvd = 0
+        self.bytes_sent = 0
+        # total request time in microseconds, for the mean concurrency;
+        # whole numbers so the total doesn't depend on the order the
+        # requests and partials were added in
+        self.busy_micros = 0
+        self.latencies = hdr.HdrHistogram()
+
+    def add(self, record):
+        self.count += 1
+        self.bytes_recvd += record.bytes_recvd
+        self.bytes_sent += record.bytes_sent
+        self.busy_micros += round(record.request_time * 1e6)
+        self.latencies.record(record.request_time)
+
+    def merge(self, other):
+        self.count += other.count
+        self.bytes_recvd += other.bytes_recvd
+        self.bytes_sent += other.bytes_sent
+        self.busy_micros += other.busy_micros
+        self.latencies.merge(other.latencies)
+
+    @property
+    def busy_time(self):
+        """
+        Total request time in seconds.
+        """
+        return self.busy_micros / 1e6
+
+
+class GroupBy(object):
+    """
+    Stats for proxy requests grouped by the named dimensions (see
+    DIMENSIONS). filters is a dict of dimension name to the set of values
+    to keep; other requests are skipped.
+    """
+
+    def __init__(self, dimensions, filters=None, max_groups=1000):
+        unknown = set(dimensions) | set(filters or ())
+        unknown -= set(DIMENSIONS)
+        if unknown:
+            raise ValueError(
+                "unknown dimension %s (known: %s)"
+                % (", ".join(sorted(unknown)), ", ".join(DIMENSIONS))
+            )
+        self.dimensions = tuple(dimensions)
+        self.filters = dict(filters or {})
+        self.max_groups = max_groups
+        self._keys = [DIMENSIONS[name] for name in self.dimensions]
+        self._filters = [
+            (DIMENSIONS[name], values) for name, values in self.filters.items()
+        ]
+        self.groups = {}
+        self.first_start = None
+        self.last_end = None
+
+    def _group(self, key):
+        try:
+            return self.groups[key]
+        except KeyError:
+            pass
+        if len(self.groups) >= self.max_groups:
+            key = (OTHER,) * len(self.dimensions)
+            if key in self.groups:
+                return self.groups[key]
+        stats = self.groups[key] = GroupStats()
+        return stats
+
+    def add(self, record):
+        for value_of, values in self._filters:
+            if value_of(record) not in values:
+                return
+        key = tuple(value_of(record) for value_of in self._keys)
+        self._group(key).add(record)
+        if self.first_start is None or record.start_time < self.first_start:
+            self.first_start = record.start_time
+        if self.last_end is None or record.end_time > self.last_end:
+            self.last_end = record.end_time
+
+    def merge(self, other):
+        """
+        Add other's groups (eg from another part of the log) to these.
+        """
+        for key, stats in other.groups.items():
+            self._group(key).merge(stats)
+        for t in (other.first_start, other.last_end):
+            if t is None:
+                continue
+            if self.first_start is None or t < self.first_start:
+                self.first_start = t
+            if self.last_end is None or t > self.last_end:
+                self.last_end = t
+
+    def top(self, count, sort_by="count"):
+        """
+        The count biggest groups by sort_by (one of SORT_KEYS), as a list of
+        (key, stats).
+        """
+        sort_key = SORT_KEYS[sort_by]
+        ranked = sorted(
+            self.groups.items(),
+            key=lambda item: sort_key(item[1]),
+            reverse=True,
+        )
+        return ranked[:count]
+
+    def span(self):
+        if self.first_start is None:
+            return 0.0
+        return self.last_end - self.first_start
+
+
+SORT_KEYS = {
+    "count": lambda stats: stats.count,
+    "bytes": lambda stats: stats.bytes_recvd + stats.bytes_sent,
+    "p50": lambda stats: stats.latencies.percentiles([0.5])[0],
+    "p99": lambda stats: stats.latencies.percentiles([0.99])[0],
+    "max": lambda stats: stats.latencies.max,
+    "time": lambda stats: stats.busy_time,
+}
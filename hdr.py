@@ -0,0 +1,123 @@
+# constant memory latency histograms, laid out like HdrHistogram
+#
+# Values are counted in integer units (microseconds by default). Each power
+# of two range of values is split into the same number of equal width
+# sub-buckets, enough for `significant_digits` decimal digits, so a value
+# is reported to within 1 / sub_bucket_count of itself wherever it falls and
+# the whole histogram is a few thousand counters however many samples go
+# in. Recording is a couple of integer operations per value, and histograms
+# with the same layout merge by adding their counts.
+
+import math
+
+import numpy as np
+
+
+class HdrHistogram(object):
+    """
+    Counts of values from 0 to max_value (in seconds, like request_time),
+    each reported to within relative_error of itself, or half a unit for
+    the very smallest. Larger values are counted as max_value, but the
+    exact maximum is kept in self.max.
+    """
+
+    def __init__(self, significant_digits=2, unit=1e-6, max_value=100000.0):
+        if not 1 <= significant_digits <= 5:
+            raise ValueError("significant_digits must be from 1 to 5")
+        self.significant_digits = significant_digits
+        self.unit = unit
+        self.max_value = max_value
+        # smallest power of two with a sub-bucket per unit of the last digit
+        self.sub_bucket_bits = math.ceil(
+            math.log2(2 * 10 ** significant_digits)
+        )
+        self.sub_bucket_count = 2 ** self.sub_bucket_bits
+        self.sub_bucket_half = self.sub_bucket_count // 2
+        self._mask = self.sub_bucket_count - 1
+        self._top = int(max_value / unit)
+        self.counts = np.zeros(self._index(self._top) + 1, dtype=np.int64)
+        self.total = 0
+        self.max = 0.0
+
+    @property
+    def relative_error(self):
+        """
+        The most a reported value can differ from the recorded one, as a
+        fraction of it.
+        """
+        return 1.0 / self.sub_bucket_count
+
+    def _index(self, units):
+        bucket = (units | self._mask).bit_length() - self.sub_bucket_bits
+        bucket = max(bucket, 0)
+        return bucket * self.sub_bucket_half + (units >> bucket)
+
+    def record(self, value):
+        units = min(int(value / self.unit), self._top)
+        self.counts[self._index(max(units, 0))] += 1
+        self.total += 1
+        if value > self.max:
+            self.max = value
+
+    def record_many(self, values):
+        """
+        Record an array of values at once.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if not len(values):
+            return
+        units = np.clip((values / self.unit).astype(np.int64), 0, self._top)
+        # frexp's exponent is the bit length, exactly, for these sizes
+        _, bit_length = np.frexp((units | self._mask).astype(np.float64))
+        buckets = np.maximum(bit_length - self.sub_bucket_bits, 0)
+        indexes = buckets * self.sub_bucket_half + (units >> buckets)
+        self.counts += np.bincount(indexes, minlength=len(self.counts))
+        self.total += len(values)
+        self.max = max(self.max, float(values.max()))
+
+    def merge(self, other):
+        """
+        Add other's samples to this one. Both must have the same layout.
+        """
+        if (other.significant_digits, other.unit, other.max_value) != (
+            self.significant_digits,
+            self.unit,
+            self.max_value,
+        ):
+            raise ValueError("can't merge histograms with different layouts")
+        self.counts += other.counts
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def values(self):
+        """
+        The value each counter reports: the middle of its range of units.
+        """
+        indexes = np.arange(len(self.counts))
+        buckets = np.maximum(
+            (indexes - self.sub_bucket_count) // self.sub_bucket_half + 1, 0
+        )
+        sub_buckets = indexes - buckets * self.sub_bucket_half
+        lowest = sub_buckets << buckets
+        return (lowest + 2.0 ** buckets / 2) * self.unit
+
+    def percentiles(self, ps):
+        """
+        Return the value at each fraction in ps, or NaN if there are no
+        samples. Uses the same rank as indexing a sorted list at int(n * p).
+        """
+        if not self.total:
+            return np.full(len(ps), np.nan)
+        cumulative = np.cumsum(self.counts)
+        ranks = (self.total * np.asarray(ps)).astype(np.int64)
+        indexes = np.searchsorted(cumulative, ranks, side="right")
+        indexes = np.minimum(indexes, len(self.counts) - 1)
+        return np.minimum(self.values()[indexes], self.max)
+
+    def nonzero(self):
+        """
+        (values, counts) for the counters with any samples, eg to plot with
+        ax.hist(values, weights=counts).
+        """
+        used = np.flatnonzero(self.counts)
+        return np.minimum(self.values()[used], self.max), self.counts[used]
@@ -0,0 +1,104 @@
+# draw a rows x time grid of values (eg drives x seconds) as a single image
+#
+# Drawing a marker or rectangle per cell takes minutes once there are
+# thousands of drives and a day of seconds. Instead the values go into a
+# dense array that's reduced to about the output resolution as it's built,
+# then drawn with one imshow call, so drawing time doesn't depend on how
+# many cells there are.
+
+import math
+
+import numpy as np
+
+
+REDUCERS = {"max": np.maximum, "mean": np.add}
+
+
+class Heatmap(object):
+    """
+    row_count rows of column_count cells, stored at most max_columns wide.
+    When there are more cells than that, each stored column covers several
+    cells and holds their max or mean, depending on `how`.
+    """
+
+    def __init__(self, row_count, column_count, max_columns=4096, how="max"):
+        if how not in REDUCERS:
+            raise ValueError("how must be one of %s" % ", ".join(REDUCERS))
+        self.how = how
+        self.column_count = column_count
+        self.factor = max(1, math.ceil(column_count / max_columns))
+        self.matrix = np.zeros(
+            (row_count, math.ceil(column_count / self.factor)),
+            dtype=np.float64,
+        )
+
+    def add_row(self, row, start, values):
+        """
+        Fill in cells start, start + 1, ... of row with values.
+        """
+        self.add_rows(row, start, np.asarray(values)[None, :])
+
+    def add_rows(self, row, start, values):
+        """
+        Fill in a block of rows from row on at once from a 2D array, eg a
+        slice of a memory mapped matrix.
+        """
+        if not values.size:
+            return
+        if self.how == "mean":
+            # sum in floats so small integer types don't overflow
+            values = values.astype(np.float64)
+        columns = (np.arange(values.shape[1]) + start) // self.factor
+        # columns only ever go up, so each run of equal ones is one slice
+        firsts = np.flatnonzero(np.diff(columns, prepend=-1))
+        reduce = REDUCERS[self.how]
+        reduced = reduce.reduceat(values, firsts, axis=1)
+        target = self.matrix[row : row + len(values), columns[firsts]]
+        self.matrix[row : row + len(values), columns[firsts]] = reduce(
+            target, reduced
+        )
+
+    def values(self, max_rows=None):
+        """
+        The stored matrix, with rows merged the same way if there are more
+        than max_rows of them.
+        """
+        matrix = self.matrix
+        if self.how == "mean":
+            widths = np.full(matrix.shape[1], float(self.factor))
+            widths[-1] = self.column_count - self.factor * (len(widths) - 1)
+            matrix = matrix / widths
+        if max_rows and len(matrix) > max_rows:
+            factor = math.ceil(len(matrix) / max_rows)
+            firsts = np.arange(0, len(matrix), factor)
+            matrix = REDUCERS[self.how].reduceat(matrix, firsts, axis=0)
+            if self.how == "mean":
+                heights = np.diff(np.append(firsts, len(self.matrix)))
+                matrix = matrix / heights[:, None]
+        return matrix
+
+
+def draw(ax, heatmap, extent, cmap, vmin=None, vmax=None, max_rows=None):
+    """
+    Draw heatmap on ax with imshow. extent is (left, right, bottom, top) in
+    data coordinates; row 0 is at the bottom.
+    """
+    return ax.imshow(
+        heatmap.values(max_rows),
+        aspect="auto",
+        interpolation="nearest",
+        origin="lower",
+        extent=extent,
+        cmap=cmap,
+        vmin=vmin,
+        vmax=vmax,
+    )
+
+
+def pixel_size(fig):
+    """
+    (width, height) of fig in pixels when it's saved, the most detail worth
+    keeping in a heatmap drawn on it.
+    """
+    width, height = fig.get_size_inches() * fig.dpi
+    return int(width), int(height)
@@ -1,66 +1,84 @@
 #!/usr/bin/env python3.7
 
+import argparse
 import datetime
+import json
 import sys
-import pprint
-import matplotlib as mpl
-import matplotlib.pyplot as plt
-from matplotlib.ticker import FuncFormatter
-import matplotlib.patches as mpatches
-from collections import defaultdict
-import math
+import numpy as np
+import follow
+import hdr
+import logfiles
+import plotting
+import record_cache
+import rolling
+import stages
 import table_print
+import timerange
 
 
-@FuncFormatter
 def time_formatter(x, pos):
     dt = datetime.datetime.fromtimestamp(x)
     return dt.strftime("%H:%M:%S")
 
 
-x, y = [], []
-colors = []
-with open(sys.argv[1], "r") as fp:
-    for i, line in enumerate(fp):
-        if not i % 50:
-            print("\rLines processed: %d..." % i, end="", file=sys.stderr)
-            sys.stderr.flush()
-        line = line.split()
-        if len(line) < 26:
-            continue
-        if line[4] not in ("proxy-server:", "swift:"):
-            continue
-        if line[21] != "-":
-            continue
-
-        rsyslog_host = line[3]
-        method = line[8]
-        if method != "GET":
-            # only process GET requests
-            continue
-        # bytes_sent = 0 if line[16] == "-" else int(line[16])
-        request_time = float(line[20])
-        request_start = float(line[23])
-
-        request_path = line[9]
-        if request_path in ("/auth/v1.0", "/info"):
-            continue
-        if not request_path.startswith("/v1/"):
-            request_path = "/v1/FAKE_s3" + request_path
-        if request_path.count("/") <= 3:
-            # only process objects
-            continue
-        colors.append(
-            {
-                1: "#99C94548",  # ???
-                2: "#52BCA348",  # account
-                3: "#5D69B148",  # container
-            }.get(request_path.count("/"), "#E5860648")
-        )  # object
-        x.append(request_start)
-        y.append(request_time)
-
-print("\nDone", file=sys.stderr)
+def log_latency_formatter(x, pos):
+    return "%gs" % 10 ** x
+
+
+# past this many requests a scatter plot is slow to draw and just a blob
+SCATTER_LIMIT = 200000
+# density plot bins: time across, log latency up
+DENSITY_COLUMNS = 600
+DENSITY_ROWS = 150
+# faster than this all looks the same on a log scale
+MIN_LATENCY = 0.0001
+
+# path depth -> scatter color
+DEPTH_COLORS = np.array(
+    [
+        "#E5860648",  # object
+        "#99C94548",  # ???
+        "#52BCA348",  # account
+        "#5D69B148",  # container
+        "#E5860648",  # object
+    ]
+)
+# name, colormap and path depths for each panel of the density plot
+DENSITY_CLASSES = (
+    ("Account", "Greens", (2, 2)),
+    ("Container", "Purples", (3, 3)),
+    ("Object", "Oranges", (4, 255)),
+)
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--jobs", type=int, default=1)
+parser.add_argument("--no-cache", default=False, action="store_true")
+parser.add_argument(
+    "--plot",
+    choices=("auto", "scatter", "density"),
+    default="auto",
+    help="draw request_latencies.png as a scatter of every request, or as "
+    "a time x latency density per request class (auto: scatter for up to "
+    "%d requests)" % SCATTER_LIMIT,
+)
+plotting.add_arguments(parser)
+follow.add_arguments(parser)
+timerange.add_arguments(parser)
+logfiles.add_arguments(parser)
+
+args = None
+time_range = None
+
+
+def init(argv=None):
+    """
+    Parse the command line (or argv, when run from logflow.py).
+    """
+    global args, time_range
+    args = parser.parse_args(argv)
+    args.filenames = logfiles.expand(args.filenames, parser)
+    time_range = timerange.from_args(args, parser)
 
 
 p_measures = [
@@ -73,127 +91,272 @@ p_measures = [
 ]
 
 
-# table for the total span of data
-percentile_data = y[:]
-percentile_data.sort()
-len_data = len(percentile_data)
-t = [(None, "%d samples" % len_data)]
-for p, name in p_measures:
-    i = int(len_data * p)
-    val_str = "%.4f" % percentile_data[i]
-    t.append((name, val_str))
-t.append(("Max", "%.4f" % percentile_data[-1]))
-print(table_print.table_print(t))
+# arrays of request start times, latencies and path depths, one of each
+# per add_columns call
+starts = []
+latencies = []
+depths = []
+# all of the latencies so far, for the percentile table
+histogram = hdr.HdrHistogram()
+# the globals holding the totals, saved by logflow.py --checkpoint
+STATE = ("starts", "latencies", "depths", "histogram")
+
+
+# the AccessColumns columns add_columns reads
+COLUMNS = (
+    "kind",
+    "client",
+    "method",
+    "path_depth",
+    "start_time",
+    "request_time",
+)
+
+
+def add_columns(columns):
+    selected = (
+        (columns["kind"] == record_cache.PROXY)
+        # only process client requests
+        & columns["client"]
+        # only process GET requests
+        & columns.where("method", "GET")
+        # only process objects
+        & (columns["path_depth"] > 3)
+    )
+    starts.append(columns["start_time"][selected])
+    latencies.append(columns["request_time"][selected])
+    depths.append(columns["path_depth"][selected])
+    histogram.record_many(latencies[-1])
+
+
+def _joined(arrays, dtype):
+    return np.concatenate(arrays) if arrays else np.empty(0, dtype)
+
+
+def update(lines):
+    add_columns(record_cache.AccessColumns.from_lines(lines, COLUMNS))
+
+
+def summarize():
+    t = [(None, "%d samples" % histogram.total)]
+    if not histogram.total:
+        return t
+    values = histogram.percentiles([p for p, name in p_measures])
+    for (p, name), value in zip(p_measures, values):
+        t.append((name, "%.4f" % value))
+    t.append(("Max", "%.4f" % histogram.max))
+    return t
+
+
+def summary():
+    result = {"samples": histogram.total, "percentiles": {}, "max": None}
+    if histogram.total:
+        values = histogram.percentiles([p for p, name in p_measures])
+        for (p, name), value in zip(p_measures, values):
+            result["percentiles"][name] = float(value)
+        result["max"] = histogram.max
+    return result
+
+
+def draw_scatter(x, y, path_depths):
+    _, plt = plotting.pyplot()
+    import matplotlib.patches as mpatches
 
+    fig, ax = plt.subplots(1, 1, figsize=(12, 4))
 
-# latency scatter plot
-
-mpl.rcParams.update(mpl.rcParamsDefault)
-fig, ax = plt.subplots(1, 1, figsize=(12, 4))
-
-ax.scatter(x, y, s=1, c=colors)
-
-ax.xaxis.set_major_formatter(time_formatter)
-
-labels = ax.get_xticklabels()
-plt.setp(labels, rotation=45, horizontalalignment="right")
+    colors = DEPTH_COLORS[np.minimum(path_depths, len(DEPTH_COLORS) - 1)]
+    ax.scatter(x, y, s=1, c=colors.tolist())
 
-unkown_patch = mpatches.Patch(color="#99C94548", label="??")
-acct_patch = mpatches.Patch(color="#52BCA348", label="Account")
-cont_patch = mpatches.Patch(color="#5D69B148", label="Container")
-obj_patch = mpatches.Patch(color="#E5860648", label="Object")
+    ax.xaxis.set_major_formatter(time_formatter)
 
-plt.legend(handles=[acct_patch, cont_patch, obj_patch])
+    labels = ax.get_xticklabels()
+    plt.setp(labels, rotation=45, horizontalalignment="right")
+
+    unkown_patch = mpatches.Patch(color="#99C94548", label="??")
+    acct_patch = mpatches.Patch(color="#52BCA348", label="Account")
+    cont_patch = mpatches.Patch(color="#5D69B148", label="Container")
+    obj_patch = mpatches.Patch(color="#E5860648", label="Object")
+
+    plt.legend(handles=[acct_patch, cont_patch, obj_patch])
+
+    plt.title("Request Latencies")
+    return fig
+
+
+def draw_density(x, y, path_depths):
+    # a 2D histogram per request class, so drawing takes as long for a
+    # billion requests as for a thousand
+    classes = []
+    for name, cmap, (lowest, highest) in DENSITY_CLASSES:
+        selected = (path_depths >= lowest) & (path_depths <= highest)
+        if selected.any():
+            classes.append((name, cmap, selected))
+    _, plt = plotting.pyplot()
+    from matplotlib.colors import LogNorm
+    from matplotlib.ticker import MultipleLocator
+
+    fig, axes = plt.subplots(
+        len(classes),
+        1,
+        figsize=(12, 1 + 3 * len(classes)),
+        sharex=True,
+        squeeze=False,
+    )
+
+    log_y = np.log10(np.maximum(y, MIN_LATENCY))
+    first, last = x.min(), max(x.max(), x.min() + 1)
+    time_edges = np.linspace(first, last, DENSITY_COLUMNS + 1)
+    lowest, highest = log_y.min(), max(log_y.max(), log_y.min() + 1)
+    log_edges = np.linspace(lowest, highest, DENSITY_ROWS + 1)
+    for ax, (name, cmap, selected) in zip(axes[:, 0], classes):
+        counts, _, _ = np.histogram2d(
+            log_y[selected], x[selected], bins=(log_edges, time_edges)
+        )
+        ax.imshow(
+            np.ma.masked_equal(counts, 0),
+            aspect="auto",
+            interpolation="nearest",
+            origin="lower",
+            extent=(first, last, lowest, highest),
+            cmap=cmap,
+            norm=LogNorm(),
+        )
+        ax.set_ylabel(name)
+        # a tick per power of ten
+        ax.yaxis.set_major_locator(MultipleLocator(1))
+        ax.yaxis.set_major_formatter(log_latency_formatter)
 
-plt.title("Request Latencies")
+    ax.xaxis.set_major_formatter(time_formatter)
+    labels = ax.get_xticklabels()
+    plt.setp(labels, rotation=45, horizontalalignment="right")
 
-plt.tight_layout()
+    axes[0, 0].set_title("Request Latencies")
+    return fig
 
-plt.style.use("fivethirtyeight")
-mpl.rcParams["font.sans-serif"] = "B612"
-mpl.rcParams["font.family"] = "B612"
-mpl.rcParams["axes.labelsize"] = 10
-mpl.rcParams["xtick.labelsize"] = 8
-mpl.rcParams["ytick.labelsize"] = 8
-mpl.rcParams["text.color"] = "k"
 
-fig.savefig("request_latencies.png")
+def render():
+    x = _joined(starts, np.float64)
+    y = _joined(latencies, np.float64)
+    path_depths = _joined(depths, np.uint8)
+    if not len(x):
+        # nothing logged yet with --follow
+        return
+    mpl, plt = plotting.pyplot()
 
-print("Done with request_latencies.png")
+    # latency scatter or density plot
+    mpl.rcParams.update(mpl.rcParamsDefault)
+    plot = args.plot
+    if plot == "auto":
+        plot = "scatter" if len(x) <= SCATTER_LIMIT else "density"
+    if plot == "scatter":
+        fig = draw_scatter(x, y, path_depths)
+    else:
+        fig = draw_density(x, y, path_depths)
 
+    plt.tight_layout()
 
-# rolling latencies chart
+    plt.style.use("fivethirtyeight")
+    mpl.rcParams["font.sans-serif"] = "B612"
+    mpl.rcParams["font.family"] = "B612"
+    mpl.rcParams["axes.labelsize"] = 10
+    mpl.rcParams["xtick.labelsize"] = 8
+    mpl.rcParams["ytick.labelsize"] = 8
+    mpl.rcParams["text.color"] = "k"
 
-sorted_value_pairs = [(x[i], y[i]) for i in range(len(x))]
-sorted_value_pairs.sort()
-latency_rolling_data = defaultdict(list)
+    fig.savefig("request_latencies.png")
+    plt.close(fig)
 
+    print("Done with request_latencies.png")
 
-class LatencyCounter(object):
-    def __init__(self):
-        self.buckets = defaultdict(list)
+    # rolling latencies chart
 
-    def add(self, start, end, val):
-        start = int(start)
-        end = int(math.ceil(end))
-        if end == start:
-            end += 1
-        for i in range(start, end, 1):
-            self.buckets[i].append(val)
+    lookbacks = (5, 10, 30, 60, 900)
+    with stages.stage("aggregate"):
+        rolling_data = rolling.rolling_percentiles(
+            x, y, lookbacks, [p for p, name in p_measures]
+        )
 
+    for lookback_seconds in lookbacks:
+        mpl.rcParams.update(mpl.rcParamsDefault)
+        fig, ax = plt.subplots(1, 1, figsize=(12, 4))
+
+        plotable_x, percentile_values = rolling_data[lookback_seconds]
+        for p, name in p_measures:
+            plotable_y = percentile_values[p]
+
+            ax.plot(
+                plotable_x,
+                plotable_y,
+                label=name,
+                linestyle="-",
+                marker="None",
+                alpha=0.4,
+            )
+
+        plt.title(
+            "Rolling Request Latencies, Every %d Seconds" % lookback_seconds
+        )
 
-latency_over_time = LatencyCounter()
-for t, val in sorted_value_pairs:
-    latency_over_time.add(t, t + val, val)
+        ax.legend(loc="best", fancybox=True)
+        ax.xaxis.set_major_formatter(time_formatter)
 
-time_buckets = list(latency_over_time.buckets.keys())
-time_buckets.sort()
+        plt.tight_layout()
 
+        plt.style.use("fivethirtyeight")
+        mpl.rcParams["font.sans-serif"] = "B612"
+        mpl.rcParams["font.family"] = "B612"
+        mpl.rcParams["axes.labelsize"] = 10
+        mpl.rcParams["xtick.labelsize"] = 8
+        mpl.rcParams["ytick.labelsize"] = 8
+        mpl.rcParams["text.color"] = "k"
 
-for lookback_seconds in (5, 10, 30, 60, 900):
-    mpl.rcParams.update(mpl.rcParamsDefault)
-    fig, ax = plt.subplots(1, 1, figsize=(12, 4))
+        outname = "rolling_request_latencies_%dsec.png" % lookback_seconds
 
-    for p, name in p_measures:
-        plotable_x = []
-        plotable_y = []
-        for t in time_buckets[lookback_seconds:]:
-            t_start = t - lookback_seconds
-            all_timings = []
-            for t2 in range(t_start, t):
-                all_timings.extend(latency_over_time.buckets[t2])
-            all_timings.sort()
-            p_index = int(len(all_timings) * p)
-
-            plotable_x.append(t)
-            plotable_y.append(all_timings[p_index])
-
-        ax.plot(
-            plotable_x,
-            plotable_y,
-            label=name,
-            linestyle="-",
-            marker="None",
-            alpha=0.4,
-        )
+        fig.savefig(outname)
+        plt.close(fig)
 
-    plt.title("Rolling Request Latencies, Every %d Seconds" % lookback_seconds)
+        print(f"Done with {outname}")
 
-    ax.legend(loc="best", fancybox=True)
-    ax.xaxis.set_major_formatter(time_formatter)
 
-    plt.tight_layout()
+def finish():
+    if args.format == "json":
+        print(json.dumps(summary(), indent=2))
+        return
 
-    plt.style.use("fivethirtyeight")
-    mpl.rcParams["font.sans-serif"] = "B612"
-    mpl.rcParams["font.family"] = "B612"
-    mpl.rcParams["axes.labelsize"] = 10
-    mpl.rcParams["xtick.labelsize"] = 8
-    mpl.rcParams["ytick.labelsize"] = 8
-    mpl.rcParams["text.color"] = "k"
+    # table for the total span of data
+    print(table_print.table_print(summarize()))
 
-    outname = "rolling_request_latencies_%dsec.png" % lookback_seconds
+    if args.format == "png":
+        with stages.stage("render"):
+            render()
 
-    fig.savefig(outname)
 
-    print(f"Done with {outname}")
+if __name__ == "__main__":
+    init()
+    if args.follow:
+        follow.run(
+            args.filenames,
+            update,
+            summarize,
+            render if args.format == "png" else None,
+            args.refresh,
+            args.render_interval,
+        )
+    else:
+        # without the cache, only GET requests are charted, so skip every
+        # other line without reading it
+        with stages.stage("parse"):
+            columns = record_cache.load_columns(
+                args.filenames,
+                args.jobs,
+                not args.no_cache,
+                needles=(b" GET /",),
+                time_range=time_range,
+                names=COLUMNS,
+            )
+        with stages.stage("aggregate"):
+            add_columns(columns)
+
+        print("Done", file=sys.stderr)
+
+        finish()
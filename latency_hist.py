@@ -1,94 +1,191 @@
 #!/usr/bin/env python3.7
 
+import argparse
 import datetime
+import json
 import sys
-import pprint
-import matplotlib as mpl
-import matplotlib.pyplot as plt
-from matplotlib.ticker import FuncFormatter
+import numpy as np
+import hdr
+import logfiles
+import plotting
+import record_cache
+import stages
+import table_print
+import timerange
 
 
 TIME_BUCKET_SIZE = 1.0
+# bars in the histogram, and rows in its table
+BIN_COUNT = 100
 
 
-@FuncFormatter
 def time_formatter(x, pos):
     dt = datetime.datetime.fromtimestamp(x)
     return dt.strftime("%H:%M:%S")
 
 
-colors = []
-x = []
-with open(sys.argv[1], "r") as fp:
-    for i, raw_line in enumerate(fp):
-        if not i % 50:
-            print("\rLines processed: %d..." % i, end="", file=sys.stderr)
-            sys.stderr.flush()
-        line = raw_line.split()
-        if len(line) < 26:
-            continue
-        if line[4] not in ("proxy-server:", "swift:"):
-            continue
-        if line[21] != "-":
-            continue
-
-        rsyslog_host = line[3]
-        method = line[8]
-        if method != "GET":
-            # only process GET requests
-            continue
-        bytes_sent = 0 if line[16] == "-" else int(line[16])
-        request_time = float(line[20])
-        request_start = float(line[23])
-        if request_start < 1583173200.0:
-            # filter stuff that's not supposed to be there
-            continue
-        if request_time >= 600:
-            print()
-            print(raw_line)
-            continue
-
-        request_path = line[9]
-        if request_path in ("/auth/v1.0", "/info"):
-            continue
-        if not request_path.startswith("/v1/"):
-            request_path = "/v1/FAKE_s3" + request_path
-        if request_path.count("/") <= 3:
-            # only process objects
-            continue
-        # colors.append(
-        #     {
-        #         1: "#99C94548",  # ???
-        #         2: "#52BCA348",  # account
-        #         3: "#5D69B148",  # container
-        #     }.get(request_path.count("/"), "#E5860648")
-        # )  # object
-        x.append(request_time)
-
-print("\nDone", file=sys.stderr)
-
-mpl.rcParams.update(mpl.rcParamsDefault)
-fig, ax = plt.subplots(1, 1, figsize=(12, 4))
-
-ax.hist(x, bins=100)
-
-ax.xaxis.set_major_formatter(time_formatter)
-
-labels = ax.get_xticklabels()
-plt.setp(labels, rotation=45, horizontalalignment="right")
-
-plt.yscale("log")
-
-plt.title("Request Latencies")
-
-plt.tight_layout()
-
-plt.style.use("fivethirtyeight")
-mpl.rcParams["font.sans-serif"] = "B612"
-mpl.rcParams["font.family"] = "B612"
-mpl.rcParams["axes.labelsize"] = 10
-mpl.rcParams["xtick.labelsize"] = 8
-mpl.rcParams["ytick.labelsize"] = 8
-mpl.rcParams["text.color"] = "k"
-
-fig.savefig("request_latencies_hist.png")
+parser = argparse.ArgumentParser()
+parser.add_argument("--jobs", type=int, default=1)
+parser.add_argument("--no-cache", default=False, action="store_true")
+plotting.add_arguments(parser)
+timerange.add_arguments(parser)
+logfiles.add_arguments(parser)
+
+args = None
+time_range = None
+
+
+def init(argv=None):
+    """
+    Parse the command line (or argv, when run from logflow.py).
+    """
+    global args, time_range
+    args = parser.parse_args(argv)
+    args.filenames = logfiles.expand(args.filenames, parser)
+    time_range = timerange.from_args(args, parser)
+
+
+latencies = hdr.HdrHistogram()
+# (start, duration) of the GET requests too long to chart
+too_long_requests = []
+# the globals holding the totals, saved by logflow.py --checkpoint
+STATE = ("latencies", "too_long_requests")
+
+
+# the AccessColumns columns add_columns reads
+COLUMNS = (
+    "kind",
+    "client",
+    "method",
+    "path_depth",
+    "start_time",
+    "request_time",
+)
+
+
+def add_columns(columns):
+    request_start = columns["start_time"]
+    request_time = columns["request_time"]
+    selected = (
+        (columns["kind"] == record_cache.PROXY)
+        # only process client requests
+        & columns["client"]
+        # only process GET requests
+        & columns.where("method", "GET")
+    )
+    too_long = selected & (request_time >= 600)
+    too_long_requests.extend(
+        zip(request_start[too_long].tolist(), request_time[too_long].tolist())
+    )
+
+    # only process objects
+    selected &= (request_time < 600) & (columns["path_depth"] > 3)
+    latencies.record_many(request_time[selected])
+
+
+def bins():
+    """
+    The histogram as BIN_COUNT (low, high, count) bars, like the chart's.
+    """
+    values, counts = latencies.nonzero()
+    if not len(values):
+        return []
+    counts, edges = np.histogram(values, bins=BIN_COUNT, weights=counts)
+    return [
+        (float(low), float(high), int(count))
+        for low, high, count in zip(edges[:-1], edges[1:], counts)
+    ]
+
+
+def summarize():
+    t = [(None, "%d samples" % latencies.total)]
+    t.append(("From", "To", "Requests"))
+    for low, high, count in bins():
+        if count:
+            t.append(("%.4f" % low, "%.4f" % high, count))
+    return t
+
+
+def summary():
+    return {
+        "samples": latencies.total,
+        "max": latencies.max if latencies.total else None,
+        "too_long": [
+            {"start": start, "duration": duration}
+            for start, duration in too_long_requests
+        ],
+        "bins": [
+            {"from": low, "to": high, "count": count}
+            for low, high, count in bins()
+        ],
+    }
+
+
+def render():
+    mpl, plt = plotting.pyplot()
+    mpl.rcParams.update(mpl.rcParamsDefault)
+    fig, ax = plt.subplots(1, 1, figsize=(12, 4))
+
+    # each histogram counter as one weighted sample, so drawing doesn't
+    # depend on how many requests there were
+    values, counts = latencies.nonzero()
+    ax.hist(values, bins=BIN_COUNT, weights=counts)
+
+    ax.xaxis.set_major_formatter(time_formatter)
+
+    labels = ax.get_xticklabels()
+    plt.setp(labels, rotation=45, horizontalalignment="right")
+
+    plt.yscale("log")
+
+    plt.title("Request Latencies")
+
+    plt.tight_layout()
+
+    plt.style.use("fivethirtyeight")
+    mpl.rcParams["font.sans-serif"] = "B612"
+    mpl.rcParams["font.family"] = "B612"
+    mpl.rcParams["axes.labelsize"] = 10
+    mpl.rcParams["xtick.labelsize"] = 8
+    mpl.rcParams["ytick.labelsize"] = 8
+    mpl.rcParams["text.color"] = "k"
+
+    fig.savefig("request_latencies_hist.png")
+    plt.close(fig)
+
+
+def finish():
+    if args.format == "json":
+        print(json.dumps(summary(), indent=2))
+        return
+
+    for start, duration in too_long_requests:
+        print()
+        print("%.4fs request started at %.6f" % (duration, start))
+
+    if args.format == "text":
+        print(table_print.table_print(summarize()))
+    else:
+        with stages.stage("render"):
+            render()
+
+
+if __name__ == "__main__":
+    init()
+    # without the cache, only GET requests are charted, so skip every other
+    # line without reading it
+    with stages.stage("parse"):
+        columns = record_cache.load_columns(
+            args.filenames,
+            args.jobs,
+            not args.no_cache,
+            needles=(b" GET /",),
+            time_range=time_range,
+            names=COLUMNS,
+        )
+    with stages.stage("aggregate"):
+        add_columns(columns)
+
+    print("Done", file=sys.stderr)
+
+    finish()
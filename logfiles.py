@@ -0,0 +1,214 @@
+# reading several logs as one, eg one per proxy and storage node
+#
+#   ./proxy_concurrency.py logs/px*/all.log logs/sn*/all.log
+#   ./flow.py --trace --jobs 8 'logs/*/all.log'
+#
+# Every report takes any number of log files or glob patterns (quoted, so
+# the shell doesn't expand them first). Reports that only add things up
+# process every file's chunks in one pool of workers (see
+# parallel.map_chunks), since the order doesn't matter to them. Ones that
+# need the records in time order across the files, like flow --trace
+# joining a request's proxy and storage lines, read them with
+# merge_records: each file is parsed in order on its own and the records
+# are merged with a heap, which only ever holds the next few records of
+# each file. With --jobs, the files are shared between that many processes
+# that each merge theirs, and their records are merged again. Every
+# record's host field says which node logged it, so that isn't lost in the
+# merge.
+
+import glob
+import heapq
+import multiprocessing
+import operator
+import os
+import queue
+
+import compressed
+import logparse
+import parallel
+import stages
+
+
+# records sent at a time from a file's parsing process to the merge
+MERGE_BATCH = 4096
+# batches each of those processes can get ahead of the merge
+MERGE_QUEUE = 4
+# seconds to wait for a batch before checking its process is still running
+MERGE_POLL = 1.0
+
+_end_time = operator.attrgetter("end_time")
+
+
+def add_arguments(parser):
+    """
+    Add the log files argument shared by the reports to an argparse parser.
+    """
+    parser.add_argument(
+        "filenames",
+        nargs="+",
+        metavar="filename",
+        help="log files or glob patterns, eg one log per node",
+    )
+
+
+def expand(patterns, parser=None):
+    """
+    The files matching each of patterns, in order and without repeats. A
+    pattern without wildcards is taken as a filename as it is. Reports the
+    error through parser (or raises ValueError) if a pattern matches
+    nothing.
+    """
+    filenames = []
+    for pattern in patterns:
+        if glob.escape(pattern) == pattern:
+            matches = [pattern]
+        else:
+            matches = sorted(glob.glob(pattern))
+        if not matches:
+            message = "no files match %s" % pattern
+            if parser is None:
+                raise ValueError(message)
+            parser.error(message)
+        for filename in matches:
+            if filename not in filenames:
+                filenames.append(filename)
+    return filenames
+
+
+def _records(filename, kinds, fields, time_range, spans):
+    start, end = parallel.file_span(filename, time_range, spans)
+    lines = logparse.read_lines(filename, start, end)
+    return logparse.parse_lines(lines, kinds=kinds, fields=fields)
+
+
+def _merged(filenames, kinds, fields, time_range, spans):
+    streams = [
+        _records(f, kinds, fields, time_range, spans) for f in filenames
+    ]
+    return heapq.merge(*streams, key=_end_time)
+
+
+def _groups(filenames, count):
+    # split the files into count runs of about as many bytes each, keeping
+    # them in order, so records with the same end time come out in file
+    # order however the files are split
+    sizes = [os.path.getsize(f) for f in filenames]
+    total = sum(sizes)
+    groups = [[]]
+    done = 0
+    for i, filename in enumerate(filenames):
+        unstarted = count - len(groups)
+        if groups[-1] and unstarted > 0:
+            if unstarted >= len(filenames) - i or (
+                done >= total * len(groups) / count
+            ):
+                groups.append([])
+        groups[-1].append(filename)
+        done += sizes[i]
+    return groups
+
+
+def _produce(filenames, kinds, fields, time_range, spans, records_queue):
+    # in a process of its own, so the stages are only these files'
+    stages.reset()
+    try:
+        batch = []
+        records = _merged(filenames, kinds, fields, time_range, spans)
+        for record in records:
+            batch.append(record)
+            if len(batch) >= MERGE_BATCH:
+                records_queue.put(batch)
+                batch = []
+        if batch:
+            records_queue.put(batch)
+    except Exception as e:
+        records_queue.put(e)
+    else:
+        records_queue.put(stages.snapshot())
+
+
+def _consume(records_queue, process):
+    while True:
+        try:
+            item = records_queue.get(timeout=MERGE_POLL)
+        except queue.Empty:
+            # anything it sent before it exited is still there to get
+            if process.is_alive() or not records_queue.empty():
+                continue
+            raise RuntimeError(
+                "a process reading the logs exited with code %s before "
+                "it was done" % process.exitcode
+            )
+        if isinstance(item, list):
+            yield from item
+        elif isinstance(item, Exception):
+            raise item
+        else:
+            stages.merge(item)
+            return
+
+
+def merge_records(
+    filenames,
+    kinds=(logparse.ProxyAccess, logparse.StorageAccess),
+    jobs=1,
+    fields=None,
+    time_range=None,
+    spans=None,
+):
+    """
+    Generator of the access records of kinds (which must have an end_time)
+    from all of filenames, merged into end_time order. Each file is expected
+    to be in about that order already, as syslog writes it.
+
+    With more than one job, the files are split between up to `jobs`
+    processes, each of which merges its share and sends the records on to
+    be merged with the others' a batch at a time, waiting once it's
+    MERGE_QUEUE batches ahead. Otherwise they're parsed here as the merge
+    needs them.
+
+    With a time_range, only the slice of each file it covers is read (see
+    timerange.TimeRange.offsets); the caller still has to check the times.
+    spans can give the byte range to read of some files instead (see
+    parallel.map_files).
+    """
+    if jobs <= 1 or len(filenames) == 1:
+        total = None
+        if not any(compressed.compression(f) for f in filenames):
+            total = sum(os.path.getsize(f) for f in filenames)
+        records = _merged(filenames, kinds, fields, time_range, spans)
+        stages.start_progress(total)
+        try:
+            yield from records
+        finally:
+            stages.stop_progress()
+        return
+
+    # fork so the processes see the calling script's time range and so on
+    context = multiprocessing.get_context("fork")
+    processes = []
+    streams = []
+    try:
+        for group in _groups(filenames, min(jobs, len(filenames))):
+            records_queue = context.Queue(MERGE_QUEUE)
+            process = context.Process(
+                target=_produce,
+                args=(
+                    group,
+                    kinds,
+                    fields,
+                    time_range,
+                    spans,
+                    records_queue,
+                ),
+                daemon=True,
+            )
+            process.start()
+            processes.append(process)
+            streams.append(_consume(records_queue, process))
+        yield from heapq.merge(*streams, key=_end_time)
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3.7
+
+# run several reports over the logs while reading them only once, eg
+#
+#   ./logflow.py --reports latencies,proxy_concurrency,per_drive,flow all.log
+#   ./logflow.py --reports flow,group_by --options "flow=--trace" \
+#       --options "group_by=--by account --sort bytes" 'logs/*/all.log'
+#
+# Each report script can be imported and driven through a few functions:
+#
+#   init(argv)             parse its own command line
+#   add_columns(columns)   take the AccessColumns of the access lines
+#   COLUMNS                the columns add_columns reads
+#   KINDS                  the logparse record types add_records wants, or
+#                          None for add_lines to get the raw lines
+#   ORDERED                True if add_records needs all the records in
+#                          time order rather than a chunk at a time
+#   new_partial()          an empty, picklable result for one chunk
+#   add_records(partial, records) or add_lines(partial, lines)
+#   add_partial(partial)   fold a chunk's result into the report's totals
+#   finish()               print its summary and draw its charts
+#   summary()              its summary as something json.dumps can write
+#   STATE                  the globals holding its totals, for --checkpoint
+#
+# A report implements add_columns, the KINDS group, or both. The logs are
+# split into chunks as usual (see parallel.map_chunks) and each chunk is read
+# a batch of lines at a time. Every batch is parsed once, into just the
+# record types some report subscribes to, and each report is handed only the
+# types it asked for. The access records also become the columns for the
+# reports that take them, unless those come from current caches. When no
+# cache will be written, only the COLUMNS the reports read are made, from
+# just the fields of each line they need (see logparse.projection). An
+# ORDERED report reads the logs separately, whole and merged into time
+# order. Once the logs are read the reports finish in parallel processes,
+# so the whole run takes about as long as the slowest report would on its
+# own. With --format json the summaries are written as one JSON object
+# keyed by report name. With --checkpoint, each run only reads what was
+# logged since the last one and adds it to the totals that one saved (see
+# checkpoint.py).
+
+import argparse
+import concurrent.futures
+import contextlib
+import importlib
+import io
+import itertools
+import json
+import multiprocessing
+import shlex
+import sys
+
+import checkpoint
+import logfiles
+import logparse
+import parallel
+import record_cache
+import stages
+import timerange
+
+
+REPORTS = (
+    "latencies",
+    "latency_hist",
+    "proxy_concurrency",
+    "per_drive",
+    "flow",
+    "group_by",
+)
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--reports",
+    required=True,
+    help="comma separated reports to run, from: %s" % ", ".join(REPORTS),
+)
+parser.add_argument(
+    "--options",
+    action="append",
+    default=[],
+    metavar="REPORT=ARGS",
+    help="extra command line arguments for one report, eg "
+    "'flow=--trace --format json' (can be given more than once)",
+)
+parser.add_argument(
+    "--format",
+    choices=("png", "text", "json"),
+    default="png",
+    help="draw each report's charts, or only print their summaries as "
+    "tables (text) or as JSON; text and json don't need matplotlib",
+)
+parser.add_argument("--jobs", type=int, default=1)
+parser.add_argument("--no-cache", default=False, action="store_true")
+parser.add_argument(
+    "--render-jobs",
+    type=int,
+    default=None,
+    help="processes to finish the reports in (default one per report)",
+)
+checkpoint.add_arguments(parser)
+timerange.add_arguments(parser)
+logfiles.add_arguments(parser)
+
+
+def load_reports(names, options, common_args, filenames):
+    """
+    Import and init each named report, returning a list of (name, module).
+    """
+    extra = {}
+    for option in options:
+        name, sep, text = option.partition("=")
+        if not sep or name not in names:
+            parser.error(
+                "--options needs REPORT=ARGS for one of the reports, got %r"
+                % option
+            )
+        extra[name] = extra.get(name, []) + shlex.split(text)
+    reports = []
+    for name in names:
+        if name not in REPORTS:
+            parser.error(
+                "unknown report %s (known: %s)" % (name, ", ".join(REPORTS))
+            )
+        report = importlib.import_module(name)
+        report.init(extra.get(name, []) + common_args + filenames)
+        reports.append((name, report))
+    return reports
+
+
+def _batches(lines, size):
+    lines = iter(lines)
+    while True:
+        batch = list(itertools.islice(lines, size))
+        if not batch:
+            return
+        yield batch
+
+
+# set up before the log is read, and seen by the worker processes
+column_reports = []
+record_reports = []
+want_columns = False
+# only make these columns, from only these record fields (None for all)
+column_names = None
+fields = None
+kinds = ()
+
+
+def scan(lines):
+    """
+    Parse one chunk of the log for every report. Returns the chunk's
+    AccessColumns (None if no report needs them parsed) and the partial
+    result of each of record_reports.
+    """
+    partials = [report.new_partial() for report in record_reports]
+    parts = []
+    for batch in _batches(lines, logparse.BATCH_SIZE):
+        records = list(logparse.parse_lines(batch, kinds=kinds, fields=fields))
+        if want_columns:
+            parts.append(
+                record_cache.AccessColumns.from_records(records, column_names)
+            )
+        for report, partial in zip(record_reports, partials):
+            if report.KINDS is None:
+                report.add_lines(partial, batch)
+            elif set(report.KINDS) == set(kinds):
+                report.add_records(partial, records)
+            else:
+                report.add_records(
+                    partial,
+                    [r for r in records if isinstance(r, report.KINDS)],
+                )
+    if not want_columns:
+        return None, partials
+    return record_cache.AccessColumns.concatenate(parts), partials
+
+
+def _finish(name):
+    # in a worker process, so hand back what it printed to be shown in
+    # order rather than mixed up with the other reports' output. The forked
+    # process already has the report imported with all its totals.
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        importlib.import_module(name).finish()
+    return out.getvalue()
+
+
+def finish_all(reports, jobs):
+    if jobs <= 1 or len(reports) == 1:
+        for name, report in reports:
+            report.finish()
+        return
+    context = multiprocessing.get_context("fork")
+    with concurrent.futures.ProcessPoolExecutor(
+        jobs, mp_context=context
+    ) as pool:
+        futures = [pool.submit(_finish, name) for name, report in reports]
+        for future in futures:
+            sys.stdout.write(future.result())
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    args.filenames = logfiles.expand(args.filenames, parser)
+    time_range = timerange.from_args(args, parser)
+    common_args = []
+    for flag, value in (("--start", args.start), ("--end", args.end)):
+        if value is not None:
+            common_args += [flag, repr(value)]
+    if args.format != "png":
+        # group_by has no charts, so only takes text or json
+        common_args += ["--format", args.format]
+    names = [name.strip() for name in args.reports.split(",") if name.strip()]
+    reports = load_reports(names, args.options, common_args, args.filenames)
+
+    # the parts of the logs to read, all of them unless resuming
+    read_files = args.filenames
+    spans = None
+    config = {"reports": names, "options": args.options}
+    if args.checkpoint:
+        if time_range:
+            parser.error("--checkpoint can't be used with --start or --end")
+        saved = checkpoint.read_checkpoint(args.checkpoint, config)
+        saved_logs = ()
+        if saved is not None:
+            print("Resuming from %s" % args.checkpoint, file=sys.stderr)
+            for name, report in reports:
+                checkpoint.restore_state(report, saved["states"][name])
+            saved_logs = saved["logs"]
+        pieces, logs = checkpoint.pending(args.filenames, saved_logs)
+        read_files = [filename for filename, _, _ in pieces]
+        spans = {filename: (start, end) for filename, start, end in pieces}
+    # a cache covers all of a log, so isn't any use for part of one
+    use_cache = not args.no_cache and not args.checkpoint
+
+    column_reports = [r for _, r in reports if hasattr(r, "add_columns")]
+    record_reports = [r for _, r in reports if hasattr(r, "KINDS")]
+    # reports that need all the records in time order read them on their
+    # own, merged from the logs (see logfiles.merge_records), since chunks
+    # of even one log would cut across what they join up
+    merged_reports = [
+        r for r in record_reports if getattr(r, "ORDERED", False)
+    ]
+    record_reports = [r for r in record_reports if r not in merged_reports]
+
+    columns = None
+    if column_reports and use_cache:
+        cached = [record_cache.read_cache(f) for f in args.filenames]
+        if all(part is not None for part in cached):
+            if len(cached) == 1:
+                columns = cached[0]
+            else:
+                columns = record_cache.AccessColumns.concatenate(cached)
+            print("Loaded %d cached records" % len(columns), file=sys.stderr)
+    want_columns = bool(column_reports) and columns is None
+    wanted = set()
+    if want_columns:
+        wanted.update((logparse.ProxyAccess, logparse.StorageAccess))
+    for report in record_reports:
+        wanted.update(report.KINDS or ())
+    kinds = tuple(k for k in logparse.ALL_KINDS if k in wanted)
+
+    access_kinds = {logparse.ProxyAccess, logparse.StorageAccess}
+    if (
+        want_columns
+        and (not use_cache or time_range)
+        and all(hasattr(report, "COLUMNS") for report in column_reports)
+        # the other reports get whole records
+        and not any(access_kinds & set(r.KINDS or ()) for r in record_reports)
+    ):
+        # select_range needs end_time
+        column_names = {"end_time"}
+        for report in column_reports:
+            column_names.update(report.COLUMNS)
+        fields = record_cache.column_fields(column_names)
+
+    with stages.stage("parse"):
+        file_chunks = []
+        if want_columns or record_reports:
+            # a lone report reading a few lines can skip the rest unread
+            needles = None
+            if not want_columns and len(record_reports) == 1:
+                needles = getattr(record_reports[0], "NEEDLES", None)
+            file_chunks = parallel.map_files(
+                read_files,
+                scan,
+                args.jobs,
+                needles=needles,
+                time_range=time_range,
+                spans=spans,
+            )
+        if want_columns:
+            parts = []
+            for filename, chunks in zip(read_files, file_chunks):
+                part = record_cache.AccessColumns.concatenate(
+                    [chunk_columns for chunk_columns, _ in chunks]
+                )
+                if use_cache and not time_range:
+                    try:
+                        record_cache.write_cache(filename, part)
+                    except OSError as e:
+                        print("Not writing cache: %s" % e, file=sys.stderr)
+                parts.append(part)
+            if len(parts) == 1:
+                columns = parts[0]
+            else:
+                columns = record_cache.AccessColumns.concatenate(parts)
+        if columns is not None and time_range:
+            columns = record_cache.select_range(columns, time_range)
+
+        merged_partials = []
+        for report in merged_reports:
+            partial = report.new_partial()
+            report.add_records(
+                partial,
+                logfiles.merge_records(
+                    read_files,
+                    report.KINDS,
+                    args.jobs,
+                    time_range=time_range,
+                    spans=spans,
+                ),
+            )
+            merged_partials.append((report, partial))
+
+    with stages.stage("aggregate"):
+        for report in column_reports:
+            report.add_columns(columns)
+        for chunks in file_chunks:
+            for _, partials in chunks:
+                for report, partial in zip(record_reports, partials):
+                    report.add_partial(partial)
+        for report, partial in merged_partials:
+            report.add_partial(partial)
+
+    if args.checkpoint:
+        with stages.stage("checkpoint"):
+            checkpoint.write_checkpoint(args.checkpoint, config, logs, reports)
+
+    print("Done", file=sys.stderr)
+
+    if args.format == "json":
+        summaries = {name: report.summary() for name, report in reports}
+        print(json.dumps(summaries, indent=2))
+    else:
+        with stages.stage("render"):
+            finish_all(reports, args.render_jobs or len(reports))
@@ -0,0 +1,686 @@
+# parse swift syslog lines into typed records
+#
+# Every report reads the same kinds of lines, so the splitting lives here and
+# the scripts only decide which records they care about.
+#
+#   proxy access:   Jul  8 03:01:55 saio proxy-server: <21 fields>
+#   storage access: Jul  8 03:01:55 saio object-server: 127.0.0.1 - - [...]
+#   auth:           Jul  8 03:01:55 saio proxy-server: User: test uses ...
+#   error:          Jul  8 03:01:55 saio proxy-server: ERROR with ...
+
+import collections
+import mmap
+import operator
+import os
+import sys
+import time
+
+import numpy as np
+
+import compressed
+import stages
+import timestamps
+
+
+PROXY_SERVER_TYPES = frozenset(("proxy-server", "swift", "swift_proxy"))
+STORAGE_SERVER_TYPES = frozenset(
+    ("account-server", "container-server", "object-server")
+)
+
+BATCH_SIZE = 65536
+# how much of a file scan_lines searches between progress updates
+SCAN_WINDOW = 2 ** 24
+
+ProxyAccess = collections.namedtuple(
+    "ProxyAccess",
+    [
+        "host",
+        "server_type",
+        "client_ip",
+        "remote_addr",
+        "method",
+        "path",
+        "status",
+        "user_agent",
+        "bytes_recvd",
+        "bytes_sent",
+        "txn_id",
+        "request_time",
+        "source",
+        "log_info",
+        "start_time",
+        "end_time",
+        "policy_index",
+    ],
+)
+
+StorageAccess = collections.namedtuple(
+    "StorageAccess",
+    [
+        "host",
+        "server_type",
+        "remote_addr",
+        "method",
+        "path",
+        "status",
+        "content_length",
+        "referer",
+        "txn_id",
+        "source",
+        "source_pid",
+        "request_time",
+        "start_time",
+        "end_time",
+        "server_pid",
+        "policy_index",
+    ],
+)
+
+AuthLine = collections.namedtuple(
+    "AuthLine", ["timestamp", "host", "server_type", "user", "txn_id"]
+)
+
+ErrorLine = collections.namedtuple(
+    "ErrorLine", ["timestamp", "host", "server_type", "message"]
+)
+
+ALL_KINDS = (ProxyAccess, StorageAccess, AuthLine, ErrorLine)
+
+
+def _int_or_zero(val):
+    return 0 if val == "-" else int(val)
+
+
+# proxy access lines with fewer fields than this are skipped
+_PROXY_FIELDS = 20
+
+
+def _parse_proxy(host, server_type, rest):
+    fields = rest.split()
+    if len(fields) < _PROXY_FIELDS:
+        stages.skipped["proxy line with too few fields"] += 1
+        return None
+    try:
+        request_time = float(fields[15])
+        start_time = float(fields[18])
+        end_time = float(fields[19])
+        status = int(fields[6])
+    except ValueError:
+        stages.skipped["proxy line with a bad number"] += 1
+        return None
+    return ProxyAccess(
+        host,
+        server_type,
+        fields[0],
+        fields[1],
+        fields[3],
+        fields[4],
+        status,
+        fields[8],
+        _int_or_zero(fields[10]),
+        _int_or_zero(fields[11]),
+        fields[13],
+        request_time,
+        fields[16],
+        fields[17],
+        start_time,
+        end_time,
+        fields[20] if len(fields) > 20 else "-",
+    )
+
+
+def _parse_storage(host, server_type, rest):
+    # the quoted fields are the only ones that can contain spaces, so
+    # splitting on the quote character gives a fixed layout:
+    # 0 addr - - [datetime]  1 method path  2 status length  3 referer
+    # 5 txn id  7 user agent  8 request time  9 extra info  10 pid policy
+    parts = rest.split('"')
+    if len(parts) < 11:
+        stages.skipped["storage line with too few fields"] += 1
+        return None
+    prefix = parts[0]
+    open_bracket = prefix.find("[")
+    close_bracket = prefix.find("]", open_bracket)
+    if open_bracket < 0 or close_bracket < 0:
+        stages.skipped["storage line without a date"] += 1
+        return None
+    try:
+        method, path = parts[1].split(" ", 1)
+        status, content_length = parts[2].split()
+        request_time = float(parts[8])
+        end_time = timestamps.storage_timestamp(
+            prefix[open_bracket + 1 : close_bracket]
+        )
+        status = int(status)
+    except ValueError:
+        stages.skipped["storage line with a bad field"] += 1
+        return None
+    source, _, source_pid = parts[7].rpartition(" ")
+    if not source:
+        source, source_pid = source_pid, ""
+    tail = parts[10].split()
+    return StorageAccess(
+        host,
+        server_type,
+        prefix.split(" ", 1)[0],
+        method,
+        path,
+        status,
+        _int_or_zero(content_length),
+        parts[3],
+        parts[5],
+        source,
+        source_pid,
+        request_time,
+        end_time - request_time,
+        end_time,
+        tail[0] if tail else "",
+        tail[1] if len(tail) > 1 else "-",
+    )
+
+
+def _parse_auth(timestamp, host, server_type, rest):
+    # User: test uses token AUTH_tk... (trans_id tx...)
+    fields = rest.split()
+    if len(fields) < 7 or fields[2] != "uses" or fields[3] != "token":
+        stages.skipped["bad auth line"] += 1
+        return None
+    return AuthLine(timestamp, host, server_type, fields[1], fields[-1][:-1])
+
+
+# Projections: parsers for reports that only want a few fields of each
+# access record. They fill in just those fields and leave the rest None.
+# They skip the same short lines the full parser does, but only check the
+# parts of the line they decode, so a line the full parser would skip for a
+# bad field they don't look at still gets through.
+
+# ProxyAccess field -> index in the split line, and how to decode it
+_PROXY_SOURCES = {
+    "client_ip": (0, None),
+    "remote_addr": (1, None),
+    "method": (3, None),
+    "path": (4, None),
+    "status": (6, int),
+    "user_agent": (8, None),
+    "bytes_recvd": (10, _int_or_zero),
+    "bytes_sent": (11, _int_or_zero),
+    "txn_id": (13, None),
+    "request_time": (15, float),
+    "source": (16, None),
+    "log_info": (17, None),
+    "start_time": (18, float),
+    "end_time": (19, float),
+    "policy_index": (20, None),
+}
+# the fields from here on can be split off the end of the line, without
+# splitting the path, user agent and so on before them
+_PROXY_TAIL = 15
+
+
+def _has_fields(text, count):
+    # whether text has at least count fields, without splitting it: the
+    # proxy quotes any spaces in its fields, so they're one space apart
+    return text.count(" ") >= count - 1
+
+
+def _split_proxy_tail(rest):
+    tail = rest.rsplit(None, 6)
+    if len(tail) < 7 or not _has_fields(tail[0], _PROXY_FIELDS - 6):
+        return None
+    if "." in tail[6]:
+        # only 20 fields, so that's end_time rather than policy_index
+        return tail[2:] + ["-"]
+    return tail[1:]
+
+
+def _proxy_parser(fields):
+    """
+    A function like _parse_proxy that only decodes the named fields.
+    """
+    plan = [
+        (ProxyAccess._fields.index(name),) + _PROXY_SOURCES[name]
+        for name in fields
+        if name in _PROXY_SOURCES
+    ]
+    template = [None] * len(ProxyAccess._fields)
+    indexes = [index for _, index, _ in plan]
+    if min(indexes, default=_PROXY_TAIL) >= _PROXY_TAIL:
+        offset = _PROXY_TAIL
+        split = _split_proxy_tail
+    else:
+        offset = 0
+        last = max(indexes)
+
+        def split(rest):
+            values = rest.split(None, last + 1)
+            if len(values) <= last:
+                if last != 20 or len(values) != 20:
+                    return None
+                values.append("-")
+            elif last + 1 < _PROXY_FIELDS and (
+                len(values) == last + 1
+                or not _has_fields(values[-1], _PROXY_FIELDS - last - 1)
+            ):
+                return None
+            return values
+
+    def parse(host, server_type, rest):
+        values = split(rest)
+        if values is None:
+            stages.skipped["proxy line with too few fields"] += 1
+            return None
+        row = list(template)
+        row[0] = host
+        row[1] = server_type
+        try:
+            for position, index, decode in plan:
+                value = values[index - offset]
+                row[position] = value if decode is None else decode(value)
+        except ValueError:
+            stages.skipped["proxy line with a bad number"] += 1
+            return None
+        return ProxyAccess._make(row)
+
+    return parse
+
+
+# fill in groups of StorageAccess fields from a line split on quotes (see
+# _parse_storage); each raises ValueError if its part of the line is bad
+
+
+def _storage_remote_addr(row, parts):
+    row[2] = parts[0].split(" ", 1)[0]
+
+
+def _storage_request(row, parts):
+    row[3], row[4] = parts[1].split(" ", 1)
+
+
+def _storage_response(row, parts):
+    status, content_length = parts[2].split()
+    row[5] = int(status)
+    row[6] = _int_or_zero(content_length)
+
+
+def _storage_referer(row, parts):
+    row[7] = parts[3]
+
+
+def _storage_txn_id(row, parts):
+    row[8] = parts[5]
+
+
+def _storage_source(row, parts):
+    source, _, source_pid = parts[7].rpartition(" ")
+    if not source:
+        source, source_pid = source_pid, ""
+    row[9] = source
+    row[10] = source_pid
+
+
+def _storage_times(row, parts):
+    prefix = parts[0]
+    open_bracket = prefix.find("[")
+    close_bracket = prefix.find("]", open_bracket)
+    if open_bracket < 0 or close_bracket < 0:
+        raise ValueError("no date")
+    request_time = float(parts[8])
+    end_time = timestamps.storage_timestamp(
+        prefix[open_bracket + 1 : close_bracket]
+    )
+    row[11] = request_time
+    row[12] = end_time - request_time
+    row[13] = end_time
+
+
+def _storage_server(row, parts):
+    tail = parts[10].split()
+    row[14] = tail[0] if tail else ""
+    row[15] = tail[1] if len(tail) > 1 else "-"
+
+
+# these only look at the prefix and the last four parts, so the line can be
+# split from the right instead, leaving the request and referer in one piece
+_STORAGE_TAIL_FILLS = (
+    _storage_remote_addr,
+    _storage_source,
+    _storage_times,
+    _storage_server,
+)
+_UNSPLIT = [None] * 6
+
+
+def _split_storage_tail(rest):
+    tail = rest.rsplit('"', 4)
+    if len(tail) < 5:
+        return tail
+    return tail[:1] + _UNSPLIT + tail[1:]
+
+
+# StorageAccess field -> the function that fills it in
+_STORAGE_SOURCES = {
+    "remote_addr": _storage_remote_addr,
+    "method": _storage_request,
+    "path": _storage_request,
+    "status": _storage_response,
+    "content_length": _storage_response,
+    "referer": _storage_referer,
+    "txn_id": _storage_txn_id,
+    "source": _storage_source,
+    "source_pid": _storage_source,
+    "request_time": _storage_times,
+    "start_time": _storage_times,
+    "end_time": _storage_times,
+    "server_pid": _storage_server,
+    "policy_index": _storage_server,
+}
+
+
+def _storage_parser(fields):
+    """
+    A function like _parse_storage that only decodes the named fields.
+    """
+    plan = []
+    for name in fields:
+        fill = _STORAGE_SOURCES.get(name)
+        if fill is not None and fill not in plan:
+            plan.append(fill)
+    template = [None] * len(StorageAccess._fields)
+    if all(fill in _STORAGE_TAIL_FILLS for fill in plan):
+        split = _split_storage_tail
+    else:
+
+        def split(rest):
+            return rest.split('"')
+
+    def parse(host, server_type, rest):
+        parts = split(rest)
+        if len(parts) < 11:
+            stages.skipped["storage line with too few fields"] += 1
+            return None
+        row = list(template)
+        row[0] = host
+        row[1] = server_type
+        try:
+            for fill in plan:
+                fill(row, parts)
+        except ValueError:
+            stages.skipped["storage line with a bad field"] += 1
+            return None
+        return StorageAccess._make(row)
+
+    return parse
+
+
+_projections = {}
+
+
+def projection(fields=None):
+    """
+    The (proxy, storage) access line parsers that decode just the named
+    fields of ProxyAccess and StorageAccess records, or every field if
+    fields is None. host and server_type are always filled in.
+    """
+    if fields is None:
+        return _parse_proxy, _parse_storage
+    key = tuple(sorted(set(fields)))
+    try:
+        return _projections[key]
+    except KeyError:
+        pass
+    unknown = set(key) - set(ProxyAccess._fields) - set(StorageAccess._fields)
+    if unknown:
+        raise ValueError("unknown field %s" % ", ".join(sorted(unknown)))
+    parsers = _projections[key] = (_proxy_parser(key), _storage_parser(key))
+    return parsers
+
+
+def path_depth(record):
+    """
+    How far down the account/container/object hierarchy a request path is:
+    2 for an account, 3 for a container and 4 or more for an object. Proxy
+    paths without the /v1/ prefix are s3 style and count as if they had it.
+    Auth and info requests are 0.
+    """
+    path = record.path
+    if isinstance(record, StorageAccess):
+        # /device/partition/account/...
+        return path.count("/") - 1
+    if path in ("/auth/v1.0", "/info"):
+        return 0
+    if not path.startswith("/v1/"):
+        return path.count("/") + 2
+    return path.count("/")
+
+
+def parse_line(
+    line,
+    kinds=ALL_KINDS,
+    server_types=None,
+    fields=None,
+    storage_types=STORAGE_SERVER_TYPES,
+):
+    """
+    Turn one syslog line into a record, or None if it isn't one of the
+    requested kinds. Lines that can't be parsed at all are counted in
+    stages.skipped by reason; ones of other kinds aren't, since skipping
+    those is the point. With fields, access records only have those fields
+    decoded (see projection).
+
+    StorageAccess records come from the access lines of storage_types. If
+    that's None, a storage style access line from any server type is one,
+    eg the object updater's (obj-server) or container reconciler's (swift).
+    """
+    parse_proxy, parse_storage = projection(fields)
+    return _parse_line(
+        line, kinds, server_types, storage_types, parse_proxy, parse_storage
+    )
+
+
+def _parse_line(
+    line, kinds, server_types, storage_types, parse_proxy, parse_storage
+):
+    # syslog prefix is a fixed width timestamp, then host and server type
+    try:
+        host, server_type, rest = line[16:].split(None, 2)
+    except ValueError:
+        stages.skipped["short line"] += 1
+        return None
+    if server_type[-1:] != ":":
+        stages.skipped["no server type"] += 1
+        return None
+    server_type = server_type[:-1]
+    if server_types is not None and server_type not in server_types:
+        return None
+    if rest.startswith("ERROR"):
+        if ErrorLine in kinds:
+            return ErrorLine(line[:15], host, server_type, rest.rstrip())
+        return None
+    if storage_types is None:
+        if " - - [" in rest:
+            if StorageAccess in kinds:
+                return parse_storage(host, server_type, rest)
+            return None
+    elif server_type in storage_types:
+        if StorageAccess in kinds and " - - [" in rest:
+            return parse_storage(host, server_type, rest)
+        return None
+    if server_type in PROXY_SERVER_TYPES:
+        if rest.startswith("User: "):
+            if AuthLine in kinds:
+                return _parse_auth(line[:15], host, server_type, rest)
+            return None
+        if ProxyAccess in kinds:
+            return parse_proxy(host, server_type, rest)
+    return None
+
+
+def parse_lines(
+    lines,
+    kinds=ALL_KINDS,
+    server_types=None,
+    fields=None,
+    storage_types=STORAGE_SERVER_TYPES,
+):
+    """
+    Generator of records from an iterable of lines. Lines that aren't one of
+    the requested kinds are skipped. With fields, only those fields of the
+    access records are decoded and the rest are None, which is quicker when
+    a report only needs a few of them. storage_types is as for parse_line.
+    """
+    parse_proxy, parse_storage = projection(fields)
+    count = 0
+    try:
+        for line in lines:
+            record = _parse_line(
+                line,
+                kinds,
+                server_types,
+                storage_types,
+                parse_proxy,
+                parse_storage,
+            )
+            if record is not None:
+                count += 1
+                yield record
+    finally:
+        stages.count("parse.records", count)
+
+
+def columns(records, fields, batch_size=BATCH_SIZE):
+    """
+    Collect records into batches of numpy arrays, one array per field name.
+    Yields a dict of field name to array for every batch_size records.
+    """
+    fields = tuple(fields)
+    if len(fields) == 1:
+        getter = lambda record, g=operator.attrgetter(fields[0]): (g(record),)
+    else:
+        getter = operator.attrgetter(*fields)
+    rows = []
+    for record in records:
+        rows.append(getter(record))
+        if len(rows) >= batch_size:
+            yield _to_columns(fields, rows)
+            rows = []
+    if rows:
+        yield _to_columns(fields, rows)
+
+
+def _to_columns(fields, rows):
+    return {name: np.array(col) for name, col in zip(fields, zip(*rows))}
+
+
+def read_lines(filename, start=0, end=None, block_size=2 ** 24, stats=None):
+    """
+    Generator of the lines in filename between byte offsets start and end,
+    without line endings. start and end should be at line boundaries.
+    Compressed files are decompressed as they're read (see compressed.blocks
+    for what start and end mean then).
+    """
+    leftover = b""
+    blocks = compressed.blocks(filename, start, end, block_size, stats)
+    while True:
+        # don't yield inside the stage, or the caller's time is charged to it
+        with stages.stage("read"):
+            block = next(blocks, None)
+            if block is None:
+                break
+            nbytes = len(block)
+            block = leftover + block
+            cut = block.rfind(b"\n") + 1
+            leftover = block[cut:]
+            lines = block[:cut].decode("utf-8", "replace").split("\n")[:-1]
+        stages.advance(nbytes, len(lines))
+        yield from lines
+    if leftover:
+        stages.advance(0, 1)
+        yield leftover.decode("utf-8", "replace")
+
+
+def _scan(buf, needles, start, end):
+    first, rest = needles[0], needles[1:]
+    pos = buf.find(first, start, end)
+    while pos >= 0:
+        line_start = max(buf.rfind(b"\n", start, pos) + 1, start)
+        line_end = buf.find(b"\n", pos, end)
+        if line_end < 0:
+            line_end = end
+        for needle in rest:
+            if buf.find(needle, line_start, line_end) < 0:
+                break
+        else:
+            yield buf[line_start:line_end].decode("utf-8", "replace")
+        pos = buf.find(first, line_end + 1, end)
+
+
+def scan_lines(filename, needles, start=0, end=None, stats=None):
+    """
+    Generator of the lines in filename between byte offsets start and end
+    that contain every one of needles (bytes), without line endings.
+
+    The file is memory mapped and searched for the first needle with find(),
+    so lines that can't match are skipped without being copied or decoded.
+    Put the rarest needle first. Compressed files are searched the same way
+    one decompressed block at a time.
+    """
+    if compressed.compression(filename) is not None:
+        leftover = b""
+        blocks = compressed.blocks(filename, start, end, stats=stats)
+        while True:
+            with stages.stage("read"):
+                block = next(blocks, None)
+                if block is None:
+                    break
+                nbytes = len(block)
+                block = leftover + block
+                cut = block.rfind(b"\n") + 1
+                leftover = block[cut:]
+            with stages.stage("filter"):
+                lines = list(_scan(block, needles, 0, cut))
+            stages.advance(nbytes, len(lines))
+            yield from lines
+        lines = list(_scan(leftover, needles, 0, len(leftover)))
+        stages.advance(0, len(lines))
+        yield from lines
+        return
+
+    with open(filename, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if end is None or end > size:
+            end = size
+        if start >= end:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # a window at a time, so progress can be shown
+            pos = start
+            while pos < end:
+                stop = min(pos + SCAN_WINDOW, end)
+                with stages.stage("filter"):
+                    newline = mm.find(b"\n", stop - 1, end)
+                    stop = end if newline < 0 else newline + 1
+                    lines = list(_scan(mm, needles, pos, stop))
+                stages.advance(stop - pos, len(lines))
+                yield from lines
+                pos = stop
+
+
+if __name__ == "__main__":
+    # benchmark the parser against a log file
+    import table_print
+
+    counts = collections.Counter()
+    start = time.time()
+    line_count = 0
+    for filename in sys.argv[1:]:
+        for line in read_lines(filename):
+            line_count += 1
+            record = parse_line(line)
+            counts[type(record).__name__] += 1
+    elapsed = time.time() - start
+
+    t = [(None, "%d lines in %.3fs" % (line_count, elapsed))]
+    for name, count in counts.most_common():
+        t.append((name, count))
+    t.append(("lines/sec", "%d" % (line_count / max(elapsed, 1e-9))))
+    print(table_print.table_print(t))
@@ -0,0 +1,220 @@
+# split log files into chunks and process them on several cores
+
+import concurrent.futures
+import multiprocessing
+import os
+import sys
+import time
+
+import compressed
+import logparse
+import stages
+
+
+CHUNKS_PER_JOB = 4
+
+
+def chunk_offsets(filename, count, start=0, end=None):
+    """
+    Return up to count (start, end) byte ranges covering filename (or the
+    part of it from start to end), each starting at the beginning of a
+    line.
+    """
+    size = os.path.getsize(filename) if end is None else end
+    boundaries = [start]
+    with open(filename, "rb") as f:
+        for i in range(1, count):
+            f.seek(max(start + (size - start) * i // count, boundaries[-1]))
+            f.readline()
+            offset = f.tell()
+            if offset >= size:
+                break
+            if offset > boundaries[-1]:
+                boundaries.append(offset)
+    boundaries.append(size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def _lines(filename, start=0, end=None, needles=None, stats=None):
+    if needles:
+        return logparse.scan_lines(filename, needles, start, end, stats)
+    return logparse.read_lines(filename, start, end, stats=stats)
+
+
+def _run_chunk(func, filename, start, end, needles):
+    # the worker was forked from inside the caller's stages, and may have
+    # run other chunks already
+    stages.reset()
+    stats = compressed.Throughput()
+    started = time.perf_counter()
+    with stages.stage("parse"):
+        result = func(_lines(filename, start, end, needles, stats))
+    stats.total_time = time.perf_counter() - started
+    return result, stats, stages.snapshot()
+
+
+def file_span(filename, time_range=None, spans=None):
+    """
+    The (start, end) byte range of filename to read: the one spans gives
+    for it, else the slice time_range covers, else all of it.
+    """
+    if spans and filename in spans:
+        return spans[filename]
+    if time_range:
+        return time_range.offsets(filename)
+    return 0, None
+
+
+def _file_chunks(filename, jobs, time_range, spans):
+    # the (filename, start, end) pieces to split filename into
+    first, last = file_span(filename, time_range, spans)
+    kind = compressed.compression(filename)
+    if jobs <= 1:
+        offsets = [(first, last)]
+    elif kind is None:
+        offsets = chunk_offsets(filename, jobs * CHUNKS_PER_JOB, first, last)
+    elif kind == "gzip":
+        offsets = compressed.member_offsets(filename, jobs * CHUNKS_PER_JOB)
+    else:
+        offsets = [(0, None)]
+    return [(filename, start, end) for start, end in offsets]
+
+
+def map_files(
+    filenames,
+    func,
+    jobs=1,
+    progress_interval=1.0,
+    needles=None,
+    time_range=None,
+    spans=None,
+):
+    """
+    Call func(lines) over the whole of each of filenames. Returns a list
+    with a list for each file of func's results for it, in file order. With
+    more than one job, the files are split at line boundaries and all of
+    the chunks are handed to one pool of worker processes, so func must
+    return something picklable that the caller can merge.
+
+    If needles is given, func only sees the lines containing all of them
+    (see logparse.scan_lines).
+
+    If time_range is given, only the slice of each file it covers is read
+    (see timerange.TimeRange.offsets). func still has to check the times of
+    the records it gets, since the slice has some slack either side.
+
+    spans can give the (start, end) byte range to read of some of the files
+    instead, eg what's been added since a checkpoint. Both should be at the
+    start of a line.
+
+    Compressed files are decompressed as they're read. Only gzip files with
+    several members can be split between jobs; the throughput is reported
+    so it's clear whether decompressing or parsing is the slow part.
+
+    Progress is shown on stderr every progress_interval seconds, and the
+    workers' stage times and counts are added to this process's (see
+    stages.merge).
+    """
+    started = time.perf_counter()
+    chunks = []
+    for filename in filenames:
+        chunks.extend(_file_chunks(filename, jobs, time_range, spans))
+    compressed_input = any(compressed.compression(f) for f in filenames)
+
+    stats = compressed.Throughput()
+    results = None
+    if jobs > 1 and len(chunks) > 1:
+        try:
+            results = _map_pool(func, jobs, chunks, needles, stats)
+        except compressed.MemberError as e:
+            print(
+                "Can't split the logs, reading each in one piece: %s" % e,
+                file=sys.stderr,
+            )
+            stats = compressed.Throughput()
+            chunks = [
+                (f,) + file_span(f, time_range, spans) for f in filenames
+            ]
+            if len(chunks) > 1:
+                results = _map_pool(func, jobs, chunks, needles, stats)
+    if results is None:
+        # only known for uncompressed files
+        total = None
+        if not compressed_input:
+            total = 0
+            for filename, first, last in chunks:
+                if last is None:
+                    last = os.path.getsize(filename)
+                total += last - first
+        stages.start_progress(total, progress_interval)
+        try:
+            results = [
+                func(_lines(filename, first, last, needles, stats))
+                for filename, first, last in chunks
+            ]
+        finally:
+            stages.stop_progress()
+        stats.total_time = time.perf_counter() - started
+    if compressed_input:
+        print(stats.report(time.perf_counter() - started), file=sys.stderr)
+
+    by_file = {filename: [] for filename in filenames}
+    for (filename, _, _), result in zip(chunks, results):
+        by_file[filename].append(result)
+    return [by_file[filename] for filename in filenames]
+
+
+def map_chunks(
+    filenames,
+    func,
+    jobs=1,
+    progress_interval=1.0,
+    needles=None,
+    time_range=None,
+):
+    """
+    map_files, but with all of the results in one list in file order.
+    filenames can also be a single filename.
+    """
+    if isinstance(filenames, str):
+        filenames = [filenames]
+    results = []
+    for file_results in map_files(
+        filenames, func, jobs, progress_interval, needles, time_range
+    ):
+        results.extend(file_results)
+    return results
+
+
+def _map_pool(func, jobs, chunks, needles, stats):
+    # fork so the worker processes see the calling script's functions
+    context = multiprocessing.get_context("fork")
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(
+        jobs, mp_context=context
+    ) as pool:
+        futures = [
+            pool.submit(_run_chunk, func, filename, start, end, needles)
+            for filename, start, end in chunks
+        ]
+        started = time.perf_counter()
+        read_bytes = stages.counters().get("read.bytes", 0)
+        for i, future in enumerate(futures):
+            result, chunk_stats, chunk_stages = future.result()
+            results.append(result)
+            stats.merge(chunk_stats)
+            stages.merge(chunk_stages)
+            mb = (stages.counters()["read.bytes"] - read_bytes) / 2 ** 20
+            print(
+                "\rChunks processed: %d/%d, %.1f MB at %.1f MB/s..."
+                % (
+                    i + 1,
+                    len(futures),
+                    mb,
+                    mb / max(time.perf_counter() - started, 1e-9),
+                ),
+                end="",
+                file=sys.stderr,
+            )
+    print(file=sys.stderr)
+    return results
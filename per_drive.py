@@ -1,12 +1,19 @@
 #!/usr/bin/env python3.7
 
-from collections import defaultdict
+import argparse
+import json
 import sys
-import matplotlib as mpl
-import matplotlib.pyplot as plt
-from matplotlib.ticker import FuncFormatter
-import math
-import ciso8601
+from concurrency import ConcurrencyCounter
+import numpy as np
+import drive_matrix
+import follow
+import heatmap
+import logfiles
+import plotting
+import record_cache
+import stages
+import table_print
+import timerange
 import datetime
 
 
@@ -23,165 +30,248 @@ color_palette = [
 ]
 
 
-class ConcurrencyCounter(object):
-    def __init__(self, resolution=1):
-        self._mult = 1 / resolution
-        self.buckets = defaultdict(int)
-
-    def add(self, start, end):
-        start = int(start * self._mult)
-        end = int(math.ceil(end * self._mult))
-        if end == start:
-            end += 1
-        for i in range(start, end, 1):
-            self.buckets[i] += 1
-
-
 TIME_BUCKET_SIZE = 1.0
 
-drive_counters = defaultdict(lambda: ConcurrencyCounter(TIME_BUCKET_SIZE))
-
 
-@FuncFormatter
 def time_formatter(x, pos):
     x *= TIME_BUCKET_SIZE
     dt = datetime.datetime.fromtimestamp(x)
     return dt.strftime("%H:%M:%S")
 
 
-month_name_to_number = [
-    None,
-    "Jan",
-    "Feb",
-    "Mar",
-    "Apr",
-    "May",
-    "Jun",
-    "Jul",
-    "Aug",
-    "Sep",
-    "Oct",
-    "Nov",
-    "Dec",
-]
-
-
-with open(sys.argv[1], "rb", buffering=10 * 2 ** 20) as fp:
-    for i, raw_line in enumerate(fp):
-        if not i % 500:
-            print("\rLines processed: %d..." % i, end="", file=sys.stderr)
-            # sys.stderr.flush()
-        raw_line = raw_line.strip()
-        if not raw_line or raw_line[0] == b"#":
-            continue
-
-        # if i >= 500000:
-        #     break
-
-        # early filtering for faster processing
-        if b"object-server" not in raw_line:
-            continue
-        if b"- -" not in raw_line:
-            continue
-
-        line = raw_line[16:]  # filter off syslog timestamp
-
-        try:
-            server_type, parts = line.split(b":", 1)
-        except ValueError:
-            continue
-
-        server_type = server_type.strip()
-        try:
-            server_name, server_type = server_type.split()
-        except ValueError:
-            continue
-        if server_type == b"object-server":
-            parts = parts.strip().decode("ascii")
-            splitted = parts.split()
-
-            path = splitted[6][:-1]  # take off the last " character
-            drive = path.split("/")[1]
-
-            req_duration = float(splitted[-4])
-            (datetime_first, datetime_end) = splitted[3:5]
-            logged_time = datetime_first + " " + datetime_end
-            logged_time = logged_time[1:-1]  # strip the []
+parser = argparse.ArgumentParser()
+parser.add_argument("--jobs", type=int, default=1)
+parser.add_argument("--no-cache", default=False, action="store_true")
+parser.add_argument(
+    "--matrix",
+    metavar="FILE",
+    help="also save the drives x time matrix to FILE, for drive_usage.py",
+)
+plotting.add_arguments(parser)
+follow.add_arguments(parser)
+timerange.add_arguments(parser)
+logfiles.add_arguments(parser)
 
-            # like "27/Feb/2020 20:43:38 +0000"
-            iso_date = [logged_time[7:11]]
-            month_num = "%02d" % month_name_to_number.index(logged_time[3:6])
-            iso_date.append(month_num)
-            iso_date.append(logged_time[0:2])
-            iso_date = "-".join(iso_date)
-            iso_date += " " + logged_time[12:20] + logged_time[21:]
+args = None
+time_range = None
 
-            end_timestamp = ciso8601.parse_datetime(iso_date).timestamp()
-            start_time = end_timestamp - req_duration
 
-            drive_counters[drive].add(start_time, end_timestamp)
+def init(argv=None):
+    """
+    Parse the command line (or argv, when run from logflow.py).
+    """
+    global args, time_range
+    args = parser.parse_args(argv)
+    args.filenames = logfiles.expand(args.filenames, parser)
+    time_range = timerange.from_args(args, parser)
 
-print("\nDone", file=sys.stderr)
 
+# how many drives to list in the --follow summary
+SUMMARY_DRIVES = 10
 
-all_drives = list(drive_counters.keys())
-all_drives.sort()  # so subsequent runs have the same order
-print(len(all_drives))
+drive_counters = {}
+request_counts = {}
+# the globals holding the totals, saved by logflow.py --checkpoint
+STATE = ("drive_counters", "request_counts")
 
-mpl.rcParams.update(mpl.rcParamsDefault)
-fig_height = max(len(all_drives) * 2 / 96, 4)
-fig, ax = plt.subplots(1, 1, figsize=(12, fig_height))
 
+# the AccessColumns columns add_columns reads
+COLUMNS = ("kind", "host", "server_type", "drive", "start_time", "end_time")
 
-# find global min and max to know how to scale colors
-global_min = 9999999999
-global_max = -1
-for drive in all_drives:
-    global_min = min(global_min, min(drive_counters[drive].buckets.values()))
-    global_max = max(global_max, max(drive_counters[drive].buckets.values()))
 
-print(global_min, global_max)
+def add_columns(columns):
+    selected = (columns["kind"] == record_cache.STORAGE) & columns.where(
+        "server_type", "object-server"
+    )
+    # drive names are only unique within a server
+    drive_labels = columns.labels["drive"]
+    keys = columns["host"][selected].astype(np.int64) * len(drive_labels)
+    keys += columns["drive"][selected]
+    starts = columns["start_time"][selected]
+    ends = columns["end_time"][selected]
+
+    # group the requests by drive with one sort instead of a pass per drive
+    order = np.argsort(keys, kind="stable")
+    boundaries = np.flatnonzero(np.diff(keys[order])) + 1
+    for group in np.split(order, boundaries):
+        if not len(group):
+            continue
+        host_code, drive_code = divmod(int(keys[group[0]]), len(drive_labels))
+        drive = (columns.labels["host"][host_code], drive_labels[drive_code])
+        if drive not in drive_counters:
+            drive_counters[drive] = ConcurrencyCounter(TIME_BUCKET_SIZE)
+            request_counts[drive] = 0
+        drive_counters[drive].add_many(starts[group], ends[group])
+        request_counts[drive] += len(group)
+
+
+def update(lines):
+    add_columns(record_cache.AccessColumns.from_lines(lines, COLUMNS))
+
+
+def busiest():
+    """
+    (drive, requests, now, peak) for the SUMMARY_DRIVES drives with the
+    most requests.
+    """
+    result = []
+    # ties by name, so the list doesn't depend on the order drives were seen
+    drives = sorted(request_counts, key=lambda d: (-request_counts[d], d))
+    for drive in drives[:SUMMARY_DRIVES]:
+        keys, values = drive_counters[drive].series()
+        result.append(
+            (drive, request_counts[drive], int(values[-1]), int(values.max()))
+        )
+    return result
+
+
+def summarize():
+    t = [(None, "%d drives" % len(drive_counters))]
+    t.append(("Drive", "Requests", "Now", "Peak"))
+    for drive, requests, now, peak in busiest():
+        t.append(("%s %s" % drive, requests, now, peak))
+    return t
+
+
+def summary():
+    return {
+        "drives": len(drive_counters),
+        "busiest": [
+            {
+                "host": host,
+                "drive": name,
+                "requests": requests,
+                "now": now,
+                "peak": peak,
+            }
+            for (host, name), requests, now, peak in busiest()
+        ],
+    }
+
+
+def write_matrix(path, all_drives):
+    series = [drive_counters[drive].series() for drive in all_drives]
+    first = min(keys[0] for keys, _ in series)
+    stop = max(keys[-1] for keys, _ in series) + 1
+    peak = max(values.max() for _, values in series)
+    drive_matrix.write(
+        path,
+        all_drives,
+        first * TIME_BUCKET_SIZE,
+        TIME_BUCKET_SIZE,
+        stop - first,
+        ((keys[0] - first, values) for keys, values in series),
+        np.min_scalar_type(max(peak, 0)),
+    )
 
-len_colors = len(color_palette)
-bucket_width = (global_max - global_min) / len_colors
 
-# plot drive counters here
-# one line per drive, 1px tall with no gaps, change color based on value
-for i, drive in enumerate(all_drives):
-    plotable_x = []
-    color_vals = []
-    for k in sorted(drive_counters[drive].buckets):
-        plotable_x.append(k)
-        color_index = (
-            int(
-                (drive_counters[drive].buckets[k] - global_min) // bucket_width
-            )
-            - 1
-        )
-        color_vals.append(color_palette[color_index])
-    ax.scatter(
-        plotable_x, [i] * len(plotable_x), s=1, c=color_vals, marker=","
+def render():
+    if not drive_counters:
+        # nothing logged yet with --follow
+        return
+    all_drives = list(drive_counters.keys())
+    all_drives.sort()  # so subsequent runs have the same order
+    print(len(all_drives))
+    if args.matrix:
+        write_matrix(args.matrix, all_drives)
+
+    mpl, plt = plotting.pyplot()
+    from matplotlib.colors import ListedColormap
+
+    mpl.rcParams.update(mpl.rcParamsDefault)
+    fig_height = max(len(all_drives) * 2 / 96, 4)
+    fig, ax = plt.subplots(1, 1, figsize=(12, fig_height))
+
+    series = [drive_counters[drive].series() for drive in all_drives]
+    first = min(keys[0] for keys, _ in series)
+    stop = max(keys[-1] for keys, _ in series) + 1
+
+    # one row per drive, one column per pixel (or bucket, if fewer)
+    width, height = heatmap.pixel_size(fig)
+    drive_map = heatmap.Heatmap(len(all_drives), stop - first, width)
+    for i, (keys, values) in enumerate(series):
+        drive_map.add_row(i, keys[0] - first, values)
+
+    # scale colors between the lowest and highest busy bucket; idle ones
+    # are left white
+    busy = drive_map.matrix[drive_map.matrix > 0]
+    global_min, global_max = busy.min(), busy.max()
+    print(global_min, global_max)
+    cmap = ListedColormap(color_palette)
+    cmap.set_under("white")
+    heatmap.draw(
+        ax,
+        drive_map,
+        (first, stop, 0, len(all_drives)),
+        cmap,
+        vmin=global_min,
+        vmax=global_max,
+        max_rows=height,
     )
 
-ax.yaxis.set_visible(False)
-ax.xaxis.set_major_formatter(time_formatter)
-# ax.legend(loc="best", fancybox=True)
+    ax.yaxis.set_visible(False)
+    ax.xaxis.set_major_formatter(time_formatter)
+    # ax.legend(loc="best", fancybox=True)
 
-labels = ax.get_xticklabels()
-plt.setp(labels, rotation=45, horizontalalignment="right")
+    labels = ax.get_xticklabels()
+    plt.setp(labels, rotation=45, horizontalalignment="right")
 
-plt.title(
-    "Concurrent Drive Usage Over Time (%ss resolution)" % TIME_BUCKET_SIZE
-)
+    plt.title(
+        "Concurrent Drive Usage Over Time (%ss resolution)" % TIME_BUCKET_SIZE
+    )
 
-plt.tight_layout()
+    plt.tight_layout()
+
+    plt.style.use("fivethirtyeight")
+    mpl.rcParams["font.sans-serif"] = "B612"
+    mpl.rcParams["font.family"] = "B612"
+    mpl.rcParams["axes.labelsize"] = 10
+    mpl.rcParams["xtick.labelsize"] = 8
+    mpl.rcParams["ytick.labelsize"] = 8
+    mpl.rcParams["text.color"] = "k"
+
+    fig.savefig("drive_usage.png")
+    plt.close(fig)
+
+
+def finish():
+    if args.format == "png":
+        with stages.stage("render"):
+            render()
+        return
+
+    if args.matrix and drive_counters:
+        write_matrix(args.matrix, sorted(drive_counters))
+    if args.format == "json":
+        print(json.dumps(summary(), indent=2))
+    else:
+        print(table_print.table_print(summarize()))
+
+
+if __name__ == "__main__":
+    init()
+    if args.follow:
+        follow.run(
+            args.filenames,
+            update,
+            summarize,
+            render if args.format == "png" else None,
+            args.refresh,
+            args.render_interval,
+        )
+    else:
+        with stages.stage("parse"):
+            columns = record_cache.load_columns(
+                args.filenames,
+                args.jobs,
+                not args.no_cache,
+                needles=(b"object-server: ", b" - - ["),
+                time_range=time_range,
+                names=COLUMNS,
+            )
+        with stages.stage("aggregate"):
+            add_columns(columns)
 
-plt.style.use("fivethirtyeight")
-mpl.rcParams["font.sans-serif"] = "B612"
-mpl.rcParams["font.family"] = "B612"
-mpl.rcParams["axes.labelsize"] = 10
-mpl.rcParams["xtick.labelsize"] = 8
-mpl.rcParams["ytick.labelsize"] = 8
-mpl.rcParams["text.color"] = "k"
+        print("Done", file=sys.stderr)
 
-fig.savefig("drive_usage.png")
+        finish()
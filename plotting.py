@@ -0,0 +1,37 @@
+# matplotlib, imported only when a chart is actually drawn
+#
+# With --format text or json the reports just print their summaries, so
+# they run on hosts without a plotting stack and skip the second or so that
+# importing matplotlib takes. The charts are only ever saved to files, so the
+# non-interactive Agg backend is forced instead of looking for a display.
+
+import sys
+
+
+FORMATS = ("png", "text", "json")
+
+
+def add_arguments(parser):
+    """
+    Add the --format option shared by the reports to an argparse parser.
+    """
+    parser.add_argument(
+        "--format",
+        choices=FORMATS,
+        default="png",
+        help="draw the charts, or only print the summary as a table (text) "
+        "or as JSON; text and json don't need matplotlib",
+    )
+
+
+def pyplot():
+    """
+    Return (matplotlib, matplotlib.pyplot), importing them on first use.
+    """
+    import matplotlib
+
+    if "matplotlib.pyplot" not in sys.modules:
+        matplotlib.use("Agg")
+    import matplotlib.pyplot
+
+    return matplotlib, matplotlib.pyplot
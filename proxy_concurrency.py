@@ -1,255 +1,326 @@
 #!/usr/bin/env python3.7
 
+import argparse
+import os
 import sys
-from collections import defaultdict
 import datetime
-import re
-import math
-import matplotlib as mpl
-import matplotlib.pyplot as plt
-from matplotlib.ticker import FuncFormatter
-import ciso8601
+import json
+import numpy as np
+from concurrency import ConcurrencyCounter
+import errors
+import follow
+import logfiles
+import logparse
+import parallel
+import plotting
+import record_cache
+import stages
+import table_print
+import timerange
+import timestamps
 
 
 TIME_BUCKET_SIZE = 1.0
+# about how many bars to count the timeouts into on the chart
+TIMEOUT_BINS = 300
+# how many of the backends with the most timeouts to list
+SUMMARY_BACKENDS = 5
 
 
-class ConcurrencyCounter(object):
-    def __init__(self, resolution=1):
-        self._mult = 1 / resolution
-        self.buckets = defaultdict(int)
-
-    def add(self, start, end):
-        start = int(start * self._mult)
-        end = int(math.ceil(end * self._mult))
-        if end == start:
-            end += 1
-        for i in range(start, end, 1):
-            self.buckets[i] += 1
-
-
-@FuncFormatter
 def time_formatter(x, pos):
     x *= TIME_BUCKET_SIZE
     dt = datetime.datetime.fromtimestamp(x)
     return dt.strftime("%H:%M:%S")
 
 
-month_name_to_number = [
-    None,
-    "Jan",
-    "Feb",
-    "Mar",
-    "Apr",
-    "May",
-    "Jun",
-    "Jul",
-    "Aug",
-    "Sep",
-    "Oct",
-    "Nov",
-    "Dec",
-]
-
-
-storage_log_pattern = r"""
-.*?  # remote_addr
-\s-\s-\s
-\[(.*?)\]  # datetime
-\s
-"(.*?)\s.*?"  # req method and path
-\s
-(\d\d\d)  # status int
-\s
-.*?  # content length
-\s
-".*?"  # referrer
-\s
-".*?"  # txn id
-\s
-"(.*?)\s(\d*?)"  # user agent
-\s
-(.*?)  # transaction time
-\s
-"-"  # additional info
-\s
-(\d{1,6})  # server pid
-"""
-storage_log_regex = re.compile(storage_log_pattern, re.VERBOSE | re.MULTILINE)
-
-
-error_line_pattern = r".*? proxy-server: ERROR with .*? server .*? re: Trying to GET .*?: (.*?)Timeout \((.*?)s\)"
-error_line_regex = re.compile(error_line_pattern, re.MULTILINE)
+twenty_seconds = datetime.timedelta(seconds=20)
 
-internal_counter = ConcurrencyCounter(TIME_BUCKET_SIZE)
-external_counter = ConcurrencyCounter(TIME_BUCKET_SIZE)
-container_counter = ConcurrencyCounter(TIME_BUCKET_SIZE)
-obj_counter = ConcurrencyCounter(TIME_BUCKET_SIZE)
+parser = argparse.ArgumentParser()
+parser.add_argument("--jobs", type=int, default=1)
+parser.add_argument("--no-cache", default=False, action="store_true")
+plotting.add_arguments(parser)
+follow.add_arguments(parser)
+timerange.add_arguments(parser)
+logfiles.add_arguments(parser)
 
-twenty_seconds = datetime.timedelta(seconds=20)
+args = None
+time_range = None
+syslog_time = None
 
-error_timestamps = set()
 
-filename = sys.argv[1]
+def init(argv=None):
+    """
+    Parse the command line (or argv, when run from logflow.py).
+    """
+    global args, time_range, syslog_time
+    args = parser.parse_args(argv)
+    args.filenames = logfiles.expand(args.filenames, parser)
+    time_range = timerange.from_args(args, parser)
+    # syslog times have no year, so take it from the newest log
+    syslog_time = timestamps.SyslogTimestamps(
+        reference=max(os.path.getmtime(f) for f in args.filenames)
+    )
+
+
+# the records add_records wants, and strings every line of them contains
+KINDS = (logparse.ErrorLine,)
+NEEDLES = errors.NEEDLES
 
-with open(filename, "r", buffering=65536) as f:
-    for i, raw_line in enumerate(f):
-        if not i % 50:
-            print("\rLines processed: %d..." % i, end="", file=sys.stderr)
-            sys.stderr.flush()
-        raw_line = raw_line.strip()
-        if not raw_line or raw_line[0] == "#":
-            continue
 
-        line = raw_line[16:]  # filter off syslog timestamp
+def new_partial():
+    return errors.Timeouts()
 
-        try:
-            server_type, parts = line.split(":", 1)
-        except ValueError:
+
+def add_records(partial, records):
+    for record in records:
+        if record.server_type not in logparse.PROXY_SERVER_TYPES:
+            continue
+        event = errors.parse_timeout(record)
+        if event is None:
+            continue
+        if not time_range.contains_syslog(record.timestamp):
             continue
+        # the proxy gave up waiting timeout seconds before it logged it
+        partial.add(syslog_time(record.timestamp) - event.timeout, event)
+
+
+def add_partial(partial):
+    timeouts.merge(partial)
+
 
-        server_type = server_type.strip()
-        try:
-            server_name, server_type = server_type.split()
-        except ValueError:
+def collect_errors(lines):
+    partial = new_partial()
+    add_records(partial, logparse.parse_lines(lines, kinds=KINDS))
+    return partial
+
+
+# internal requests
+internal_counter = ConcurrencyCounter(TIME_BUCKET_SIZE)
+# client requests
+external_counter = ConcurrencyCounter(TIME_BUCKET_SIZE)
+container_counter = ConcurrencyCounter(TIME_BUCKET_SIZE)
+obj_counter = ConcurrencyCounter(TIME_BUCKET_SIZE)
+timeouts = errors.Timeouts()
+# the globals holding the totals, saved by logflow.py --checkpoint
+STATE = (
+    "internal_counter",
+    "external_counter",
+    "container_counter",
+    "obj_counter",
+    "timeouts",
+)
+
+
+# the AccessColumns columns add_columns reads
+COLUMNS = ("kind", "client", "server_type", "start_time", "end_time")
+
+
+def add_columns(columns):
+    proxy = columns["kind"] == record_cache.PROXY
+    storage = columns["kind"] == record_cache.STORAGE
+    for counter, selected in (
+        (internal_counter, proxy & ~columns["client"]),
+        (external_counter, proxy & columns["client"]),
+        (
+            container_counter,
+            storage & columns.where("server_type", "container-server"),
+        ),
+        (obj_counter, storage & columns.where("server_type", "object-server")),
+    ):
+        counter.add_many(
+            columns["start_time"][selected], columns["end_time"][selected]
+        )
+
+
+def update(lines):
+    add_columns(record_cache.AccessColumns.from_lines(lines, COLUMNS))
+    add_partial(collect_errors(errors.timeout_lines(lines)))
+
+
+def peaks():
+    """
+    (label, now, peak, peak bucket) for each counter, None for the times of
+    an empty one.
+    """
+    result = []
+    for counter, label in (
+        (internal_counter, "Internal Requests"),
+        (external_counter, "Client Requests"),
+        (container_counter, "Container Requests"),
+        (obj_counter, "Object Requests"),
+    ):
+        keys, values = counter.series()
+        if not len(values):
+            result.append((label, 0, 0, None))
             continue
-        parts = parts.strip()
-        splitted = parts.split()
-        if server_type in ("proxy-server", "swift"):
-            try:
-                (
-                    client_ip,
-                    remote_addr,
-                    timestamp,
-                    method,
-                    path,
-                    protocol,
-                    status_int,
-                    referer,
-                    user_agent,
-                    auth_token,
-                    bytes_recvd,
-                    bytes_sent,
-                    client_etag,
-                    transaction_id,
-                    headers,
-                    request_time,
-                    source,
-                    log_info,
-                    start_time,
-                    end_time,
-                    policy_index,
-                ) = splitted
-            except ValueError:
-                # not a proxy access log line
-                m = error_line_regex.match(line)
-                if m:
-                    timeout_type, timeout_amt = m.groups()
-                    if timeout_type == "Connection":
-                        continue
-                    ts = datetime.datetime.strptime(
-                        "2020 " + raw_line[:15], "%Y %b %d %H:%M:%S"
-                    )
-                    error_timestamps.add(
-                        ts - datetime.timedelta(seconds=float(timeout_amt))
-                    )
-                continue
-
-            try:
-                start_time = float(start_time)
-                end_time = float(end_time)
-            except ValueError:
-                continue
-            if source == "-":
-                # client request
-                external_counter.add(start_time, end_time)
-            else:
-                # internal request
-                internal_counter.add(start_time, end_time)
-        elif server_type in ("container-server", "object-server"):
-            if "- -" not in line:
-                continue
-            (datetime_first, datetime_end) = splitted[3:5]
-            req_duration = float(splitted[-4])
-            logged_time = datetime_first + " " + datetime_end
-            logged_time = logged_time[1:-1]  # strip the []
-            iso_date = [logged_time[7:11]]
-            month_num = "%02d" % month_name_to_number.index(logged_time[3:6])
-            iso_date.append(month_num)
-            iso_date.append(logged_time[0:2])
-            iso_date = "-".join(iso_date)
-            iso_date += " " + logged_time[12:20] + logged_time[21:]
-
-            end_timestamp = ciso8601.parse_datetime(iso_date).timestamp()
-            start_time = end_timestamp - req_duration
-            if server_type == "container-server":
-                container_counter.add(start_time, end_timestamp)
-            elif server_type == "object-server":
-                obj_counter.add(start_time, end_timestamp)
-            # m = storage_log_regex.match(parts)
-            # if m:
-            #     (
-            #         logged_time,
-            #         method,
-            #         status,
-            #         source,
-            #         source_pid,
-            #         req_duration,
-            #         server_pid,
-            #     ) = m.groups()
-            #     end_timestamp = dateutil.parser.parse(
-            #         logged_time[:11] + " " + logged_time[12:]
-            #     )
-            #     req_duration = datetime.timedelta(seconds=float(req_duration))
-            #     start_time = end_timestamp - req_duration
-            #     if server_type == "container-server":
-            #         container_counter.add(
-            #             start_time.timestamp(), end_timestamp.timestamp()
-            #         )
-            #     elif server_type == "object-server":
-            #         obj_counter.add(
-            #             start_time.timestamp(), end_timestamp.timestamp()
-            #         )
-
-print("\nDone", file=sys.stderr)
-
-
-mpl.rcParams.update(mpl.rcParamsDefault)
-fig, ax = plt.subplots(1, 1, figsize=(12, 4))
-
-for counter, label in (
-    # (internal_counter, "Internal Requests"),
-    (external_counter, "Client Requests"),
-    (container_counter, "Container Requests"),
-    (obj_counter, "Object Requests"),
-):
-    plotable_x = []
-    plotable_y = []
-    for k in sorted(counter.buckets):
-        plotable_x.append(k)
-        plotable_y.append(counter.buckets[k])
-
-    ax.plot(plotable_x, plotable_y, label=label, linestyle="-", marker="None")
-
-# for ts in error_timestamps:
-#     plt.axvline(x=ts.timestamp(), color="#469bcf", linewidth=1)
-
-ax.xaxis.set_major_formatter(time_formatter)
-ax.legend(loc="best", fancybox=True)
-
-labels = ax.get_xticklabels()
-plt.setp(labels, rotation=45, horizontalalignment="right")
-
-plt.title("Concurrent Requests Over Time (%ss resolution)" % TIME_BUCKET_SIZE)
-
-plt.tight_layout()
-
-plt.style.use("fivethirtyeight")
-mpl.rcParams["font.sans-serif"] = "B612"
-mpl.rcParams["font.family"] = "B612"
-mpl.rcParams["axes.labelsize"] = 10
-mpl.rcParams["xtick.labelsize"] = 8
-mpl.rcParams["ytick.labelsize"] = 8
-mpl.rcParams["text.color"] = "k"
-
-fig.savefig("proxy_concurrency.png")
+        peak = values.argmax()
+        result.append((label, int(values[-1]), int(values[peak]), keys[peak]))
+    return result
+
+
+def summarize():
+    t = [("", "Now", "Peak", "Peak At")]
+    for label, now, peak, peak_at in peaks():
+        if peak_at is None:
+            t.append((label, now, peak, "-"))
+        else:
+            t.append((label, now, peak, time_formatter(peak_at, None)))
+    t.append((None, "%d timeouts" % len(timeouts)))
+    for timeout_type, count in timeouts.by_type.most_common():
+        t.append((timeout_type, count))
+    for backend, count in timeouts.by_backend.most_common(SUMMARY_BACKENDS):
+        t.append((backend, count))
+    return t
+
+
+def summary():
+    return {
+        "requests": {
+            label: {
+                "now": now,
+                "peak": peak,
+                "peak_at": None
+                if peak_at is None
+                else float(peak_at * TIME_BUCKET_SIZE),
+            }
+            for label, now, peak, peak_at in peaks()
+        },
+        "timeouts": {
+            "total": len(timeouts),
+            "by_type": dict(timeouts.by_type),
+            "by_backend": dict(timeouts.by_backend),
+        },
+    }
+
+
+def draw_timeouts(ax):
+    """
+    Timeouts per bin as stacked bars on a second y axis behind the lines.
+    Returns the bars' legend handles and labels.
+    """
+    first, last = min(timeouts.times), max(timeouts.times)
+    bin_size = max(
+        TIME_BUCKET_SIZE, np.ceil((last - first) / TIMEOUT_BINS) or 1.0
+    )
+    edges, counts = timeouts.binned(bin_size)
+    # the chart's x axis is in buckets
+    lefts = edges[:-1] / TIME_BUCKET_SIZE
+    width = bin_size / TIME_BUCKET_SIZE
+
+    overlay = ax.twinx()
+    bottom = np.zeros(len(lefts))
+    for timeout_type, type_counts in counts.items():
+        overlay.bar(
+            lefts,
+            type_counts,
+            width=width,
+            bottom=bottom,
+            align="edge",
+            alpha=0.3,
+            label=timeout_type,
+        )
+        bottom += type_counts
+    overlay.set_ylabel("Timeouts per %gs" % bin_size)
+    # draw the concurrency lines over the bars
+    ax.set_zorder(overlay.get_zorder() + 1)
+    ax.patch.set_visible(False)
+    return overlay.get_legend_handles_labels()
+
+
+def render():
+    mpl, plt = plotting.pyplot()
+    mpl.rcParams.update(mpl.rcParamsDefault)
+    fig, ax = plt.subplots(1, 1, figsize=(12, 4))
+
+    for counter, label in (
+        # (internal_counter, "Internal Requests"),
+        (external_counter, "Client Requests"),
+        (container_counter, "Container Requests"),
+        (obj_counter, "Object Requests"),
+    ):
+        plotable_x = []
+        plotable_y = []
+        for k in sorted(counter.buckets):
+            plotable_x.append(k)
+            plotable_y.append(counter.buckets[k])
+
+        ax.plot(
+            plotable_x, plotable_y, label=label, linestyle="-", marker="None"
+        )
+
+    ax.xaxis.set_major_formatter(time_formatter)
+    handles, legend_labels = ax.get_legend_handles_labels()
+    if len(timeouts):
+        timeout_handles, timeout_labels = draw_timeouts(ax)
+        handles += timeout_handles
+        legend_labels += timeout_labels
+    ax.legend(handles, legend_labels, loc="best", fancybox=True)
+
+    labels = ax.get_xticklabels()
+    plt.setp(labels, rotation=45, horizontalalignment="right")
+
+    plt.title(
+        "Concurrent Requests Over Time (%ss resolution)" % TIME_BUCKET_SIZE
+    )
+
+    plt.tight_layout()
+
+    plt.style.use("fivethirtyeight")
+    mpl.rcParams["font.sans-serif"] = "B612"
+    mpl.rcParams["font.family"] = "B612"
+    mpl.rcParams["axes.labelsize"] = 10
+    mpl.rcParams["xtick.labelsize"] = 8
+    mpl.rcParams["ytick.labelsize"] = 8
+    mpl.rcParams["text.color"] = "k"
+
+    fig.savefig("proxy_concurrency.png")
+    plt.close(fig)
+
+
+def finish():
+    if args.format == "json":
+        print(json.dumps(summary(), indent=2))
+    elif args.format == "text":
+        print(table_print.table_print(summarize()))
+    else:
+        with stages.stage("render"):
+            render()
+
+
+if __name__ == "__main__":
+    init()
+    if args.follow:
+        follow.run(
+            args.filenames,
+            update,
+            summarize,
+            render if args.format == "png" else None,
+            args.refresh,
+            args.render_interval,
+        )
+    else:
+        with stages.stage("parse"):
+            columns = record_cache.load_columns(
+                args.filenames,
+                args.jobs,
+                not args.no_cache,
+                time_range=time_range,
+                names=COLUMNS,
+            )
+            # error lines aren't cached, but they're rare enough to find
+            # quickly
+            error_chunks = parallel.map_chunks(
+                args.filenames,
+                collect_errors,
+                args.jobs,
+                needles=NEEDLES,
+                time_range=time_range,
+            )
+        with stages.stage("aggregate"):
+            add_columns(columns)
+            for chunk in error_chunks:
+                add_partial(chunk)
+
+        print("Done", file=sys.stderr)
+
+        finish()
@@ -0,0 +1,441 @@
+# parsed access records as numpy columns, cached on disk next to the log
+#
+# Parsing is most of the cost of every report, and the same day's log gets
+# charted many times over. The first run writes the columns every report
+# needs to <log>.logflow-cache; later runs memory map them instead of
+# parsing again, as long as the log's path, size and mtime haven't changed.
+#
+# Cache file layout: 8 byte magic, 8 byte little endian header length, a
+# JSON header, then each column's raw data aligned to ALIGNMENT bytes.
+
+import functools
+import json
+import os
+import struct
+import sys
+
+import numpy as np
+
+import logparse
+import parallel
+import stages
+
+
+CACHE_SUFFIX = ".logflow-cache"
+CACHE_MAGIC = b"LOGFLOWC"
+CACHE_VERSION = 2
+ALIGNMENT = 64
+
+PROXY = 0
+STORAGE = 1
+
+# name, dtype. host, method, server_type and drive are codes into labels
+COLUMNS = (
+    ("kind", np.uint8),
+    ("host", np.uint32),
+    ("server_type", np.uint16),
+    ("method", np.uint16),
+    ("status", np.uint16),
+    ("client", np.bool_),
+    ("path_depth", np.uint8),
+    ("drive", np.uint32),
+    ("start_time", np.float64),
+    ("end_time", np.float64),
+    ("request_time", np.float64),
+    ("bytes_recvd", np.int64),
+    ("bytes_sent", np.int64),
+)
+LABELED_COLUMNS = ("host", "server_type", "method", "drive")
+
+# the record fields each column is made from, so that a report needing only
+# a few columns can have just those fields parsed (see logparse.projection)
+COLUMN_FIELDS = {
+    "kind": (),
+    "host": ("host",),
+    "server_type": ("server_type",),
+    "method": ("method",),
+    "status": ("status",),
+    "client": ("source",),
+    "path_depth": ("path",),
+    "drive": ("path",),
+    "start_time": ("start_time",),
+    "end_time": ("end_time",),
+    "request_time": ("request_time",),
+    "bytes_recvd": ("bytes_recvd",),
+    "bytes_sent": ("bytes_sent", "content_length"),
+}
+
+# each column's value for a proxy or storage record, for AccessColumns made
+# with only some columns. code(column, label) numbers a labeled column.
+PROXY_VALUES = {
+    "kind": lambda record, code: PROXY,
+    "host": lambda record, code: code("host", record.host),
+    "server_type": lambda record, code: code(
+        "server_type", record.server_type
+    ),
+    "method": lambda record, code: code("method", record.method),
+    "status": lambda record, code: record.status,
+    "client": lambda record, code: record.source == "-",
+    "path_depth": lambda record, code: logparse.path_depth(record),
+    "drive": lambda record, code: code("drive", ""),
+    "start_time": lambda record, code: record.start_time,
+    "end_time": lambda record, code: record.end_time,
+    "request_time": lambda record, code: record.request_time,
+    "bytes_recvd": lambda record, code: record.bytes_recvd,
+    "bytes_sent": lambda record, code: record.bytes_sent,
+}
+STORAGE_VALUES = dict(
+    PROXY_VALUES,
+    kind=lambda record, code: STORAGE,
+    client=lambda record, code: False,
+    drive=lambda record, code: code("drive", record.path.split("/")[1]),
+    bytes_recvd=lambda record, code: 0,
+    bytes_sent=lambda record, code: record.content_length,
+)
+
+
+def column_fields(names):
+    """
+    The record fields needed to make the named columns.
+    """
+    fields = set()
+    for name in names:
+        fields.update(COLUMN_FIELDS[name])
+    return tuple(sorted(fields))
+
+
+class AccessColumns(object):
+    """
+    Proxy and storage access records as parallel arrays, one row per
+    request in file order.
+
+    kind is PROXY or STORAGE. client is True for proxy requests that came
+    from a client rather than another swift service. path_depth is 2 for an
+    account, 3 for a container and 4 or more for an object (see
+    logparse.path_depth). host is the syslog host that logged the line.
+    drive is only set for storage requests.
+
+    Made with only some of the columns (see from_lines), it has just those
+    and kind, and can't be written to the cache.
+    """
+
+    def __init__(self, arrays, labels):
+        self.arrays = arrays
+        self.labels = labels
+
+    def __len__(self):
+        return len(self.arrays["kind"])
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def where(self, column, *labels):
+        """
+        Boolean mask of the rows whose column has one of the given labels.
+        """
+        codes = [
+            i for i, label in enumerate(self.labels[column]) if label in labels
+        ]
+        return np.isin(self.arrays[column], codes)
+
+    def select(self, selected):
+        """
+        A copy holding only the rows where the mask selected is True.
+        """
+        arrays = {name: array[selected] for name, array in self.arrays.items()}
+        return AccessColumns(arrays, self.labels)
+
+    @classmethod
+    def from_records(cls, records, names=None):
+        if names is not None:
+            return cls._from_some_records(records, names)
+        rows = {name: [] for name, _ in COLUMNS}
+        codes = {name: {} for name in LABELED_COLUMNS}
+
+        def code(column, label):
+            table = codes[column]
+            if label not in table:
+                table[label] = len(table)
+            return table[label]
+
+        for record in records:
+            if isinstance(record, logparse.ProxyAccess):
+                rows["kind"].append(PROXY)
+                rows["client"].append(record.source == "-")
+                rows["drive"].append(code("drive", ""))
+                rows["bytes_recvd"].append(record.bytes_recvd)
+                rows["bytes_sent"].append(record.bytes_sent)
+            elif isinstance(record, logparse.StorageAccess):
+                rows["kind"].append(STORAGE)
+                rows["client"].append(False)
+                rows["drive"].append(code("drive", record.path.split("/")[1]))
+                rows["bytes_recvd"].append(0)
+                rows["bytes_sent"].append(record.content_length)
+            else:
+                continue
+            rows["host"].append(code("host", record.host))
+            rows["server_type"].append(code("server_type", record.server_type))
+            rows["method"].append(code("method", record.method))
+            rows["status"].append(record.status)
+            rows["path_depth"].append(logparse.path_depth(record))
+            rows["start_time"].append(record.start_time)
+            rows["end_time"].append(record.end_time)
+            rows["request_time"].append(record.request_time)
+
+        arrays = {
+            name: np.array(rows[name], dtype=dtype) for name, dtype in COLUMNS
+        }
+        labels = {name: list(codes[name]) for name in LABELED_COLUMNS}
+        return cls(arrays, labels)
+
+    @classmethod
+    def _from_some_records(cls, records, names):
+        names = [n for n, _ in COLUMNS if n == "kind" or n in names]
+        rows = {name: [] for name in names}
+        codes = {name: {} for name in LABELED_COLUMNS if name in rows}
+
+        def code(column, label):
+            table = codes[column]
+            if label not in table:
+                table[label] = len(table)
+            return table[label]
+
+        proxy_values = [(rows[n].append, PROXY_VALUES[n]) for n in names]
+        storage_values = [(rows[n].append, STORAGE_VALUES[n]) for n in names]
+        for record in records:
+            if isinstance(record, logparse.ProxyAccess):
+                values = proxy_values
+            elif isinstance(record, logparse.StorageAccess):
+                values = storage_values
+            else:
+                continue
+            for append, value in values:
+                append(value(record, code))
+
+        arrays = {
+            name: np.array(rows[name], dtype=dtype)
+            for name, dtype in COLUMNS
+            if name in rows
+        }
+        labels = {name: list(table) for name, table in codes.items()}
+        return cls(arrays, labels)
+
+    @classmethod
+    def from_lines(cls, lines, names=None):
+        """
+        AccessColumns for the access lines among lines. With names, only
+        those columns are made, and only the fields of each line they need
+        are parsed.
+        """
+        kinds = (logparse.ProxyAccess, logparse.StorageAccess)
+        fields = None if names is None else column_fields(names)
+        return cls.from_records(
+            logparse.parse_lines(lines, kinds=kinds, fields=fields), names
+        )
+
+    @classmethod
+    def concatenate(cls, parts):
+        """
+        Join several AccessColumns in order, merging their label tables.
+        """
+        # only the columns they all have
+        names = [
+            name
+            for name, _ in COLUMNS
+            if all(name in part.arrays for part in parts)
+        ]
+        codes = {name: {} for name in LABELED_COLUMNS if name in names}
+        remapped = []
+        for part in parts:
+            arrays = dict(part.arrays)
+            for name in codes:
+                table = codes[name]
+                mapping = np.empty(len(part.labels[name]), dtype=np.int64)
+                for i, label in enumerate(part.labels[name]):
+                    mapping[i] = table.setdefault(label, len(table))
+                if len(mapping):
+                    arrays[name] = mapping[arrays[name]].astype(
+                        arrays[name].dtype
+                    )
+            remapped.append(arrays)
+        arrays = {
+            name: np.concatenate([a[name] for a in remapped]).astype(dtype)
+            if remapped
+            else np.empty(0, dtype)
+            for name, dtype in COLUMNS
+            if name in names
+        }
+        labels = {name: list(table) for name, table in codes.items()}
+        return cls(arrays, labels)
+
+
+def cache_filename(filename):
+    return filename + CACHE_SUFFIX
+
+
+def _source_key(filename):
+    st = os.stat(filename)
+    return {
+        "path": os.path.abspath(filename),
+        "size": st.st_size,
+        "mtime": st.st_mtime_ns,
+    }
+
+
+def write_cache(filename, columns):
+    header = {
+        "version": CACHE_VERSION,
+        "source": _source_key(filename),
+        "rows": len(columns),
+        "labels": columns.labels,
+        "columns": [],
+    }
+    blobs = []
+    for name, dtype in COLUMNS:
+        blobs.append(np.ascontiguousarray(columns[name], dtype=dtype))
+        header["columns"].append([name, np.dtype(dtype).str])
+
+    # offsets depend on the header length, so size it with room to spare
+    # for the offsets themselves
+    header_size = len(json.dumps(header)) + 32 * len(COLUMNS) + 64
+    offset = _aligned(16 + header_size)
+    for column, blob in zip(header["columns"], blobs):
+        column.append(offset)
+        offset = _aligned(offset + blob.nbytes)
+    header_bytes = json.dumps(header).encode("utf-8")
+    header_bytes += b" " * (header_size - len(header_bytes))
+
+    tmp_name = "%s.tmp.%d" % (cache_filename(filename), os.getpid())
+    try:
+        with open(tmp_name, "wb") as f:
+            f.write(CACHE_MAGIC)
+            f.write(struct.pack("<Q", header_size))
+            f.write(header_bytes)
+            for column, blob in zip(header["columns"], blobs):
+                f.write(b"\0" * (column[2] - f.tell()))
+                f.write(blob.tobytes())
+        os.replace(tmp_name, cache_filename(filename))
+    finally:
+        if os.path.exists(tmp_name):
+            os.unlink(tmp_name)
+
+
+def _aligned(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def read_cache(filename):
+    """
+    Return the cached AccessColumns for filename with every column memory
+    mapped, or None if there is no cache or it is out of date.
+    """
+    path = cache_filename(filename)
+    try:
+        with open(path, "rb") as f:
+            if f.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+                return None
+            (header_size,) = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(header_size).decode("utf-8"))
+    except (OSError, ValueError, struct.error):
+        return None
+    if header.get("version") != CACHE_VERSION:
+        return None
+    if header.get("source") != _source_key(filename):
+        return None
+
+    rows = header["rows"]
+    arrays = {}
+    for name, dtype, offset in header["columns"]:
+        if rows:
+            arrays[name] = np.memmap(
+                path, dtype=dtype, mode="r", offset=offset, shape=(rows,)
+            )
+        else:
+            arrays[name] = np.empty(0, dtype)
+    return AccessColumns(arrays, header["labels"])
+
+
+def select_range(columns, time_range):
+    """
+    The rows of columns for requests that ended in time_range.
+    """
+    selected = time_range.mask(columns["end_time"])
+    outside = len(selected) - int(selected.sum())
+    stages.skipped["outside the time range"] += outside
+    return columns.select(selected)
+
+
+def load_columns(
+    filenames,
+    jobs=1,
+    use_cache=True,
+    needles=None,
+    time_range=None,
+    names=None,
+):
+    """
+    Return AccessColumns for every access line in filenames (or in the one
+    log filenames names), from each log's cache file if that is still
+    current. The other logs are parsed with `jobs` processes and, if
+    use_cache, their caches are written for next time.
+
+    Without the cache, needles can limit parsing to the lines a report
+    needs (see logparse.scan_lines), and names to the columns it needs (see
+    AccessColumns.from_lines). Both are ignored when writing a cache, since
+    the cache is shared by every report.
+
+    With a time_range, only requests that ended in it are returned. Logs
+    without a cache already only have that part of them parsed, and no cache
+    is written, since it would only cover part of the log.
+    """
+    if isinstance(filenames, str):
+        filenames = [filenames]
+    parts = {}
+    if use_cache:
+        for filename in filenames:
+            columns = read_cache(filename)
+            if columns is not None:
+                parts[filename] = columns
+        if parts:
+            print(
+                "Loaded %d cached records"
+                % sum(len(columns) for columns in parts.values()),
+                file=sys.stderr,
+            )
+        if time_range:
+            use_cache = False
+        else:
+            needles = None
+            names = None
+
+    missing = [filename for filename in filenames if filename not in parts]
+    if missing:
+        from_lines = AccessColumns.from_lines
+        if names is not None:
+            if time_range:
+                # select_range needs end_time
+                names = set(names) | {"end_time"}
+            from_lines = functools.partial(from_lines, names=names)
+        chunks = parallel.map_files(
+            missing,
+            from_lines,
+            jobs,
+            needles=needles,
+            time_range=time_range,
+        )
+        for filename, file_chunks in zip(missing, chunks):
+            columns = parts[filename] = AccessColumns.concatenate(file_chunks)
+            if use_cache:
+                try:
+                    write_cache(filename, columns)
+                except OSError as e:
+                    print("Not writing cache: %s" % e, file=sys.stderr)
+
+    if len(filenames) == 1:
+        # keep a cache memory mapped rather than copying it
+        columns = parts[filenames[0]]
+    else:
+        columns = AccessColumns.concatenate([parts[f] for f in filenames])
+    if time_range:
+        columns = select_range(columns, time_range)
+    return columns
@@ -0,0 +1,134 @@
+# rolling latency percentiles over several lookback windows in one pass
+
+import math
+
+import numpy as np
+
+
+class SlidingHistogram(object):
+    """
+    Latency histogram with log spaced bins that supports removing samples as
+    well as adding them, so a time window can slide over it. Values are
+    reported to within `precision` relative error.
+    """
+
+    def __init__(self, precision=0.01, min_value=0.0001, max_value=100000.0):
+        self.min_value = min_value
+        self._log_base = math.log1p(precision)
+        self.bin_count = self._bin_of(max_value) + 1
+        self.counts = np.zeros(self.bin_count, dtype=np.int64)
+        # report the geometric middle of each bin
+        edges = min_value * np.exp(
+            np.arange(self.bin_count + 1) * self._log_base
+        )
+        self.values = np.sqrt(edges[:-1] * edges[1:])
+        self.values[0] = min_value
+
+    def _bin_of(self, value):
+        if value <= self.min_value:
+            return 0
+        return int(math.log(value / self.min_value) / self._log_base)
+
+    def bins(self, values):
+        """
+        Map an array of values to bin indexes.
+        """
+        values = np.maximum(
+            np.asarray(values, dtype=np.float64), self.min_value
+        )
+        bins = (np.log(values / self.min_value) / self._log_base).astype(
+            np.int64
+        )
+        return np.minimum(bins, self.bin_count - 1)
+
+    def add_bins(self, bins):
+        self.counts += np.bincount(bins, minlength=self.bin_count)
+
+    def remove_bins(self, bins):
+        self.counts -= np.bincount(bins, minlength=self.bin_count)
+
+    def percentiles(self, ps):
+        """
+        Return the value at each fraction in ps, or NaN if there are no
+        samples. Uses the same rank as indexing a sorted list at int(n * p).
+        """
+        cumulative = np.cumsum(self.counts)
+        total = cumulative[-1]
+        if not total:
+            return np.full(len(ps), np.nan)
+        ranks = (total * np.asarray(ps)).astype(np.int64)
+        return self.values[np.searchsorted(cumulative, ranks, side="right")]
+
+
+def rolling_percentiles(starts, durations, lookbacks, ps, precision=0.01):
+    """
+    For every second, compute the percentiles ps of all requests that were
+    running at any point in the preceding `lookback` seconds, for each
+    lookback. Each request is counted once per window no matter how many
+    seconds it spans.
+
+    Returns a dict of lookback to (times, {p: values}).
+    """
+    starts = np.asarray(starts, dtype=np.float64)
+    durations = np.asarray(durations, dtype=np.float64)
+    if not len(starts):
+        return {
+            lookback: (np.empty(0), {p: np.empty(0) for p in ps})
+            for lookback in lookbacks
+        }
+
+    # a request is active in seconds [first, last)
+    first = np.floor(starts).astype(np.int64)
+    last = np.maximum(np.ceil(starts + durations).astype(np.int64), first + 1)
+
+    histograms = {
+        lookback: SlidingHistogram(precision) for lookback in lookbacks
+    }
+    bins = next(iter(histograms.values())).bins(durations)
+
+    # the window ending at t covers seconds [t - lookback, t), so a request
+    # enters at first + 1 and leaves at last + lookback
+    add_order = np.argsort(first, kind="stable")
+    add_times = first[add_order] + 1
+    remove_order = np.argsort(last, kind="stable")
+    remove_times = last[remove_order]
+
+    t_begin = int(first.min()) + 1
+    t_end = int(last.max()) + 1
+    times = np.arange(t_begin, t_end)
+    results = {
+        lookback: {p: np.full(len(times), np.nan) for p in ps}
+        for lookback in lookbacks
+    }
+
+    add_bounds = np.searchsorted(add_times, times, side="right")
+    add_from = 0
+    remove_from = {lookback: 0 for lookback in lookbacks}
+    current = {lookback: None for lookback in lookbacks}
+    for i, t in enumerate(times):
+        add_to = add_bounds[i]
+        added = bins[add_order[add_from:add_to]] if add_to > add_from else None
+        add_from = add_to
+        for lookback, histogram in histograms.items():
+            changed = current[lookback] is None
+            if added is not None:
+                histogram.add_bins(added)
+                changed = True
+            remove_to = np.searchsorted(
+                remove_times, t - lookback, side="right"
+            )
+            if remove_to > remove_from[lookback]:
+                histogram.remove_bins(
+                    bins[remove_order[remove_from[lookback] : remove_to]]
+                )
+                remove_from[lookback] = remove_to
+                changed = True
+            if t - lookback < t_begin - 1:
+                # not a full window of data yet
+                continue
+            if changed:
+                current[lookback] = histogram.percentiles(ps)
+            for p, value in zip(ps, current[lookback]):
+                results[lookback][p][i] = value
+
+    return {lookback: (times, results[lookback]) for lookback in lookbacks}
@@ -0,0 +1,226 @@
+# time how long each stage of a report takes, and count what it read
+#
+# Reports wrap their work in `with stages.stage("parse"):` etc, and the
+# readers in logparse add "read" and "filter" stages inside that. Time spent
+# in a stage nested inside another is only charged to the inner one. Worker
+# processes send their numbers back with their results (see parallel.py),
+# and their stage times are kept apart since they overlap each other.
+#
+# Some environment variables turn on more:
+#
+#   LOGFLOW_STATS=FILE       write the stage times, counters and skipped
+#                            lines as JSON to FILE when the script exits
+#   LOGFLOW_PROFILE=STAGE    run cProfile while in STAGE and print the top
+#                            functions at exit; STAGE:FILE saves the stats
+#                            to FILE instead, for pstats or snakeviz. Only
+#                            this process is profiled, so use --jobs 1
+
+import atexit
+import collections
+import json
+import os
+import sys
+import time
+
+
+_totals = {}
+_worker_totals = {}
+_stack = []
+
+# eg "read.bytes"; see advance()
+_counters = collections.Counter()
+# lines that couldn't be used, by reason
+skipped = collections.Counter()
+
+_profile_stage, _, _profile_file = os.environ.get(
+    "LOGFLOW_PROFILE", ""
+).partition(":")
+_profiler = None
+_profile_depth = 0
+
+
+class stage(object):
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        global _profiler, _profile_depth
+        now = time.perf_counter()
+        if _stack:
+            name, started = _stack[-1]
+            _totals[name] = _totals.get(name, 0.0) + now - started
+        _stack.append((self.name, now))
+        if self.name == _profile_stage:
+            if _profiler is None:
+                import cProfile
+
+                _profiler = cProfile.Profile()
+            if not _profile_depth:
+                _profiler.enable()
+            _profile_depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        global _profile_depth
+        if self.name == _profile_stage:
+            _profile_depth -= 1
+            if not _profile_depth:
+                _profiler.disable()
+        now = time.perf_counter()
+        name, started = _stack.pop()
+        _totals[name] = _totals.get(name, 0.0) + now - started
+        if _stack:
+            # the outer stage starts counting again
+            _stack[-1] = (_stack[-1][0], now)
+        return False
+
+
+def timings():
+    """
+    Dict of stage name to seconds spent in it so far.
+    """
+    return dict(_totals)
+
+
+def count(name, n=1):
+    """
+    Add n to the counter called name, eg "parse.records".
+    """
+    _counters[name] += n
+
+
+def counters():
+    """
+    Dict of counter name to its count so far.
+    """
+    return dict(_counters)
+
+
+class Progress(object):
+    """
+    A progress line on stderr for reading total bytes (None if not known,
+    eg for a compressed file), redrawn at most every interval seconds.
+    """
+
+    def __init__(self, total=None, interval=1.0):
+        self.total = total
+        self.interval = interval
+        self.started = self.last_shown = time.perf_counter()
+        self.bytes = 0
+        self.lines = 0
+
+    def update(self, nbytes, nlines):
+        self.bytes += nbytes
+        self.lines += nlines
+        now = time.perf_counter()
+        if now - self.last_shown >= self.interval:
+            self.last_shown = now
+            print("\r" + self.line(now), end="", file=sys.stderr)
+            sys.stderr.flush()
+
+    def line(self, now, done=False):
+        mb = 2 ** 20
+        elapsed = max(now - self.started, 1e-9)
+        rate = self.bytes / elapsed
+        text = "Read %.1f MB, %d lines" % (self.bytes / mb, self.lines)
+        if done:
+            text += " in %.1fs" % elapsed
+        elif self.total:
+            text += " (%d%%)" % (100 * self.bytes // self.total)
+        text += ": %.1f MB/s, %d lines/s" % (
+            rate / mb,
+            self.lines / elapsed,
+        )
+        if not done and self.total and rate:
+            left = max(self.total - self.bytes, 0) / rate
+            text += ", ETA %d:%02d" % divmod(int(left), 60)
+        return text + ("" if done else "...")
+
+    def finish(self):
+        print("\r" + self.line(time.perf_counter(), True), file=sys.stderr)
+
+
+_progress = None
+
+
+def start_progress(total=None, interval=1.0):
+    global _progress
+    _progress = Progress(total, interval)
+
+
+def stop_progress():
+    global _progress
+    if _progress is not None:
+        _progress.finish()
+        _progress = None
+
+
+def advance(nbytes, nlines):
+    """
+    Count nbytes read from the log and the nlines of it handed on to be
+    parsed, and update the progress line if there is one.
+    """
+    _counters["read.bytes"] += nbytes
+    _counters["read.lines"] += nlines
+    if _progress is not None:
+        _progress.update(nbytes, nlines)
+
+
+def reset():
+    """
+    Forget everything so far, eg in a worker process forked mid-stage.
+    """
+    global _progress
+    _totals.clear()
+    _worker_totals.clear()
+    del _stack[:]
+    _counters.clear()
+    skipped.clear()
+    _progress = None
+
+
+def snapshot():
+    """
+    Everything counted so far, to send back from a worker process.
+    """
+    return {
+        "stages": timings(),
+        "counters": counters(),
+        "skipped": dict(skipped),
+    }
+
+
+def merge(worker):
+    """
+    Add a worker's snapshot() to this process's numbers.
+    """
+    for name, seconds in worker["stages"].items():
+        _worker_totals[name] = _worker_totals.get(name, 0.0) + seconds
+    _counters.update(worker["counters"])
+    skipped.update(worker["skipped"])
+
+
+def stats():
+    """
+    Everything counted, as written to LOGFLOW_STATS.
+    """
+    result = snapshot()
+    result["worker_stages"] = dict(_worker_totals)
+    return result
+
+
+@atexit.register
+def _write_stats():
+    path = os.environ.get("LOGFLOW_STATS")
+    if path:
+        with open(path, "w") as f:
+            json.dump(stats(), f, indent=2)
+    if _profiler is not None:
+        if _profile_file:
+            _profiler.dump_stats(_profile_file)
+        else:
+            import pstats
+
+            pstats.Stats(_profiler, stream=sys.stderr).sort_stats(
+                "cumulative"
+            ).print_stats(30)
@@ -0,0 +1,75 @@
+# flow --trace gives the same graph however many jobs read the log
+#
+#   python -m pytest -q
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import generate_log
+
+
+FLOW = os.path.join(os.path.dirname(os.path.abspath(__file__)), "flow.py")
+LOGFLOW = os.path.join(os.path.dirname(FLOW), "logflow.py")
+
+
+@pytest.fixture(scope="module")
+def log(tmp_path_factory):
+    filename = str(tmp_path_factory.mktemp("logs") / "all.log")
+    args = generate_log.make_parser().parse_args(
+        [filename, "--lines", "20000", "--seed", "3"]
+    )
+    with open(filename, "w") as f:
+        generate_log.generate(args, f)
+    return filename
+
+
+def _run(*argv):
+    return subprocess.run(
+        (sys.executable,) + argv,
+        check=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    ).stdout
+
+
+def test_trace_jobs(log):
+    # a transaction's lines mustn't be split between chunks of the log
+    serial = _run(FLOW, "--trace", "--format", "json", log)
+    assert b'"client"' in serial
+    parallel = _run(FLOW, "--trace", "--format", "json", "--jobs", "4", log)
+    assert parallel == serial
+
+
+def test_logflow_trace_jobs(log):
+    serial = _run(FLOW, "--trace", "--format", "json", log)
+    both = _run(
+        LOGFLOW,
+        "--reports",
+        "flow,latencies",
+        "--options",
+        "flow=--trace",
+        "--format",
+        "json",
+        "--jobs",
+        "4",
+        log,
+    )
+    assert json.loads(both)["flow"] == json.loads(serial)
+
+
+def test_trace_names_only_logged_nodes(log):
+    # with nothing held open, every proxy line comes after its hops have
+    # been evicted, so which proxy served it is never known
+    edges = json.loads(
+        _run(
+            FLOW, "--trace", "--format", "json", "--max-open-traces", "0", log
+        )
+    )["edges"]
+    assert edges
+    for edge in edges:
+        assert edge["from"] != "client"
+        assert edge["to"] != "proxy-server"
@@ -0,0 +1,147 @@
+# parsing only some fields of the access lines gives the same values as
+# parsing all of them
+#
+#   python -m pytest -q
+#
+# Every field subset a report asks for is checked line by line against the
+# full parse, over the sample all.log and over a log from generate_log.py.
+
+import importlib
+import io
+import os
+
+import pytest
+
+import flow
+import generate_log
+import logparse
+import record_cache
+
+
+SAMPLE_LOG = os.path.join(os.path.dirname(__file__), "all.log")
+COLUMN_REPORTS = (
+    "latencies",
+    "latency_hist",
+    "per_drive",
+    "proxy_concurrency",
+)
+
+
+def _field_sets():
+    field_sets = {}
+    all_columns = {"end_time"}
+    for name in COLUMN_REPORTS:
+        columns = importlib.import_module(name).COLUMNS
+        field_sets[name] = record_cache.column_fields(columns)
+        all_columns.update(columns)
+    # what logflow parses for all of them at once
+    field_sets["logflow"] = record_cache.column_fields(all_columns)
+    field_sets["flow"] = flow.EDGE_FIELDS
+    return field_sets
+
+
+FIELD_SETS = _field_sets()
+
+
+def _generated_lines():
+    args = generate_log.make_parser().parse_args(["-", "--lines", "20000"])
+    out = io.StringIO()
+    generate_log.generate(args, out)
+    return out.getvalue().splitlines()
+
+
+@pytest.fixture(scope="module", params=["all.log", "generate_log.py"])
+def lines(request):
+    if request.param == "all.log":
+        with open(SAMPLE_LOG) as f:
+            return f.read().splitlines()
+    return _generated_lines()
+
+
+def _check(lines, fields, storage_types=logparse.STORAGE_SERVER_TYPES):
+    # returns how many access records of each kind were compared
+    compared = {logparse.ProxyAccess: 0, logparse.StorageAccess: 0}
+    for line in lines:
+        full = logparse.parse_line(line, storage_types=storage_types)
+        projected = logparse.parse_line(
+            line, fields=fields, storage_types=storage_types
+        )
+        if full is None or projected is None:
+            assert full is projected, line
+            continue
+        assert type(projected) is type(full), line
+        if type(full) not in compared:
+            assert projected == full, line
+            continue
+        compared[type(full)] += 1
+        for name in ("host", "server_type") + tuple(fields):
+            if name in full._fields:
+                assert getattr(projected, name) == getattr(full, name), (
+                    name,
+                    line,
+                )
+    return compared
+
+
+@pytest.mark.parametrize("report", sorted(FIELD_SETS))
+def test_projection_matches_full_parse(lines, report):
+    compared = _check(lines, FIELD_SETS[report])
+    assert all(compared.values())
+
+
+def test_projection_matches_full_parse_of_any_server_type(lines):
+    compared = _check(lines, flow.EDGE_FIELDS, storage_types=None)
+    assert compared[logparse.StorageAccess]
+
+
+# proxy lines with too few fields for the full parser, whose last fields
+# (and first ones) still parse
+SHORT_PROXY_LINES = [
+    "Jul  8 03:01:55 saio proxy-server: a b c d e 1.0 2.0",
+    "Jul  8 03:01:55 saio proxy-server: " + " ".join(["1"] * 19),
+]
+
+
+@pytest.mark.parametrize(
+    "fields",
+    [("start_time", "end_time"), ("status",), ("status", "end_time")]
+    + [FIELD_SETS[report] for report in sorted(FIELD_SETS)],
+)
+def test_projection_skips_short_proxy_lines(fields):
+    _check(SHORT_PROXY_LINES, fields)
+    assert logparse.parse_line(SHORT_PROXY_LINES[0], fields=fields) is None
+
+
+def test_unknown_field():
+    with pytest.raises(ValueError):
+        logparse.projection(("method", "no_such_field"))
+
+
+# storage lines logged by the background daemons under other server types
+DAEMON_LINES = [
+    "Jul  8 03:01:55 saio obj-server: 127.0.0.1 - - [08/Jul/2014:03:01:55 "
+    '+0000] "PUT /d1/995/AUTH_test/c/o" 201 - "PUT http://saio:8080/v1/'
+    'AUTH_test/c/o" "txe2d57a8f439f4a88b29d9-0053bb5f23" '
+    '"proxy-server 1569" 0.0921 "-" 1561',
+    "Jul  8 03:01:26 saio swift: 127.0.0.1 - - [08/Jul/2014:03:01:26 "
+    '+0000] "PUT /d2/109/AUTH_test/c" 201 - "PUT http://saio:8080/v1/'
+    'AUTH_test/c" "txeb3ab30b492342819b515-0053bb5f05" "proxy-server 1569" '
+    '0.0559 "-" 1566',
+]
+
+
+def test_storage_types():
+    # other reports only want the storage servers' own lines
+    assert list(logparse.parse_lines(DAEMON_LINES)) == []
+    records = list(logparse.parse_lines(DAEMON_LINES, storage_types=None))
+    assert [r.server_type for r in records] == ["obj-server", "swift"]
+
+
+def test_flow_graphs_daemon_storage_lines():
+    flow.init([SAMPLE_LOG])
+    edges = flow.new_partial()
+    flow.add_lines(edges, DAEMON_LINES)
+    assert edges == {
+        ("proxy-server 1569", "object-server 1561", "PUT", ""): 1,
+        ("proxy-server 1569", "container-reconciler 1566", "PUT", ""): 1,
+    }
@@ -0,0 +1,184 @@
+# --start/--end: only read the part of a log between two times
+#
+# Syslog writes lines in roughly time order, so the byte offsets where a
+# time range starts and ends can be found by binary search on the syslog
+# prefix, and only that slice of the file read. Lines aren't perfectly in
+# order (each server's clock and buffering differ a little), so the slice is
+# widened by `slack` seconds each side and callers still check each record's
+# own time with contains() or mask().
+#
+# Syslog prefixes don't have a year, so they're decoded as whichever year
+# puts them nearest the range rather than the file's mtime (see
+# timestamps.SyslogTimestamps); that's right for any log covering less than
+# half a year either side of it.
+#
+# Compressed files can't be seeked into, so they're read whole and only the
+# per-record check applies.
+
+import argparse
+import datetime
+import os
+
+import numpy as np
+
+import compressed
+import timestamps
+
+
+# seconds lines can be out of order by
+SLACK = 60.0
+# stop bisecting once the slice is known to within this many bytes
+PRECISION = 2 ** 16
+# lines to try after a probe point before giving up on finding a timestamp
+MAX_PROBE_LINES = 1000
+HALF_YEAR = 182 * 86400
+
+
+def parse_time(text):
+    """
+    argparse type for a unix time or a local ISO date and time, eg
+    "2020-03-03 01:50:00".
+    """
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    try:
+        return datetime.datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "%r is not a unix time or YYYY-MM-DD HH:MM:SS" % text
+        )
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        "--start",
+        type=parse_time,
+        help="only include requests that ended at or after this time "
+        "(unix time or YYYY-MM-DD HH:MM:SS)",
+    )
+    parser.add_argument(
+        "--end",
+        type=parse_time,
+        help="only include requests that ended before this time",
+    )
+
+
+def from_args(args, parser):
+    """
+    The TimeRange given by a script's --start and --end.
+    """
+    time_range = TimeRange(args.start, args.end)
+    if time_range and getattr(args, "follow", False):
+        parser.error("--start and --end can't be used with --follow")
+    return time_range
+
+
+class TimeRange(object):
+    """
+    Times from start (inclusive) to end (exclusive); either can be None for
+    no limit. False if it's unlimited both ways.
+    """
+
+    def __init__(self, start=None, end=None, slack=SLACK):
+        self.start = start
+        self.end = end
+        self.slack = slack
+        known = [t for t in (start, end) if t is not None]
+        reference = None
+        if known:
+            reference = sum(known) / len(known) + HALF_YEAR
+        self.syslog_time = timestamps.SyslogTimestamps(reference)
+
+    def __bool__(self):
+        return self.start is not None or self.end is not None
+
+    def contains(self, t):
+        if self.start is not None and t < self.start:
+            return False
+        return self.end is None or t < self.end
+
+    def contains_syslog(self, prefix):
+        """
+        contains() for a line's syslog prefix, eg "Mar  3 01:46:40". False
+        if it isn't one.
+        """
+        try:
+            return self.contains(self.syslog_time(prefix))
+        except ValueError:
+            return False
+
+    def mask(self, times):
+        """
+        Boolean mask of the numpy array times that are in the range.
+        """
+        selected = np.ones(len(times), dtype=np.bool_)
+        if self.start is not None:
+            selected &= times >= self.start
+        if self.end is not None:
+            selected &= times < self.end
+        return selected
+
+    def offsets(self, filename):
+        """
+        (start, end) byte offsets of the slice of filename that holds the
+        range, both at the start of a line. end is None for the end of the
+        file.
+        """
+        if not self or compressed.compression(filename) is not None:
+            return 0, None
+        size = os.path.getsize(filename)
+        with open(filename, "rb") as f:
+            start, end = 0, None
+            if self.start is not None:
+                target = self.start - self.slack
+                start, _ = _bisect(f, size, self.syslog_time, target)
+            if self.end is not None:
+                target = self.end + self.slack
+                _, end = _bisect(f, size, self.syslog_time, target)
+                if end >= size:
+                    end = None
+                else:
+                    end = max(end, start)
+        return start, end
+
+
+def _line_start(f, offset):
+    # offset of the first line starting at or after offset
+    if offset <= 0:
+        return 0
+    f.seek(offset - 1)
+    f.readline()
+    return f.tell()
+
+
+def _time_after(f, offset, syslog_time):
+    # time of the first line after offset with a syslog prefix, or None at
+    # the end of the file
+    f.seek(_line_start(f, offset))
+    for _ in range(MAX_PROBE_LINES):
+        line = f.readline()
+        if not line:
+            return None
+        try:
+            return syslog_time(line[:15].decode("ascii"))
+        except (ValueError, UnicodeDecodeError):
+            continue
+    return None
+
+
+def _bisect(f, size, syslog_time, target):
+    """
+    Return (low, high) line start offsets with the lines before low logged
+    before target and the lines from high on logged at or after it.
+    """
+    low, high = 0, size
+    while high - low > PRECISION:
+        middle = (low + high) // 2
+        t = _time_after(f, middle, syslog_time)
+        if t is None or t >= target:
+            high = middle
+        else:
+            low = middle
+    return _line_start(f, low), _line_start(f, high)
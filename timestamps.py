@@ -0,0 +1,199 @@
+# decode the two timestamp formats found in swift logs
+#
+#   syslog prefix:  "Jul  8 03:00:28"              (no year, no timezone)
+#   storage access: "08/Jul/2014:03:00:34 +0000"   (inside the [] brackets)
+#
+# Both only have one second resolution and busy logs have thousands of lines
+# per second, so decoded values are memoized by the timestamp string.
+
+import calendar
+import time
+
+import numpy as np
+
+
+MONTHS = {
+    "Jan": 1,
+    "Feb": 2,
+    "Mar": 3,
+    "Apr": 4,
+    "May": 5,
+    "Jun": 6,
+    "Jul": 7,
+    "Aug": 8,
+    "Sep": 9,
+    "Oct": 10,
+    "Nov": 11,
+    "Dec": 12,
+}
+
+# a day of logs is 86400 distinct seconds, so this never gets in the way
+# of a normal run but keeps a long --follow from growing without bound
+MEMO_SIZE = 200000
+
+_storage_memo = {}
+
+
+def _tz_offset(tz):
+    # "+0130" -> seconds east of UTC
+    seconds = int(tz[1:3]) * 3600 + int(tz[3:5]) * 60
+    return -seconds if tz[0] == "-" else seconds
+
+
+def storage_timestamp(logged_time):
+    """
+    Unix time of a storage server timestamp like "27/Feb/2020:20:43:38 +0000".
+    """
+    try:
+        return _storage_memo[logged_time]
+    except KeyError:
+        pass
+    try:
+        value = float(
+            calendar.timegm(
+                (
+                    int(logged_time[7:11]),
+                    MONTHS[logged_time[3:6]],
+                    int(logged_time[0:2]),
+                    int(logged_time[12:14]),
+                    int(logged_time[15:17]),
+                    int(logged_time[18:20]),
+                )
+            )
+            - _tz_offset(logged_time[21:26])
+        )
+    except (KeyError, IndexError):
+        raise ValueError("bad storage timestamp %r" % logged_time)
+    if len(_storage_memo) >= MEMO_SIZE:
+        _storage_memo.clear()
+    _storage_memo[logged_time] = value
+    return value
+
+
+class SyslogTimestamps(object):
+    """
+    Decodes the "Jul  8 03:00:28" prefix syslog puts on every line.
+
+    The prefix has no year, so it's taken to be the latest year that doesn't
+    put the line more than a day after `reference` (unix time, eg the log
+    file's mtime; defaults to now). That way a log spanning new year gets
+    December lines from the year before.
+
+    The prefix has no timezone either. utc_offset is the logging host's
+    offset in seconds east of UTC; by default the local timezone is used.
+    """
+
+    def __init__(self, reference=None, utc_offset=None):
+        self.reference = time.time() if reference is None else reference
+        self.utc_offset = utc_offset
+        self._memo = {}
+
+    def _decode(self, prefix, year):
+        fields = (
+            year,
+            MONTHS[prefix[0:3]],
+            int(prefix[4:6]),
+            int(prefix[7:9]),
+            int(prefix[10:12]),
+            int(prefix[13:15]),
+        )
+        if self.utc_offset is None:
+            return time.mktime(fields + (0, 0, -1))
+        return float(calendar.timegm(fields) - self.utc_offset)
+
+    def __call__(self, prefix):
+        try:
+            return self._memo[prefix]
+        except KeyError:
+            pass
+        try:
+            year = time.gmtime(self.reference).tm_year
+            value = self._decode(prefix, year)
+            if value > self.reference + 86400:
+                value = self._decode(prefix, year - 1)
+        except (KeyError, ValueError, OverflowError):
+            raise ValueError("bad syslog timestamp %r" % prefix)
+        if len(self._memo) >= MEMO_SIZE:
+            self._memo.clear()
+        self._memo[prefix] = value
+        return value
+
+    def many(self, prefixes):
+        """
+        Decode an array of prefixes (str or bytes) into an array of unix
+        times. Each distinct second is only decoded once.
+        """
+        unique, inverse = np.unique(np.asarray(prefixes), return_inverse=True)
+        decoded = np.array(
+            [
+                self(p.decode("ascii") if isinstance(p, bytes) else str(p))
+                for p in unique.tolist()
+            ],
+            dtype=np.float64,
+        )
+        return decoded[inverse]
+
+
+def _days_from_civil(year, month, day):
+    # days since 1970-01-01 for the proleptic gregorian calendar, on arrays
+    # (http://howardhinnant.github.io/date_algorithms.html#days_from_civil)
+    year = year - (month <= 2)
+    era = np.floor_divide(year, 400)
+    year_of_era = year - era * 400
+    shift = np.where(month > 2, -3, 9)
+    day_of_year = (153 * (month + shift) + 2) // 5 + day - 1
+    day_of_era = (
+        year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    )
+    return era * 146097 + day_of_era - 719468
+
+
+def _month_key(a, b, c):
+    return a << 16 | b << 8 | c
+
+
+_MONTH_KEYS = sorted(
+    (_month_key(*name.encode("ascii")), number)
+    for name, number in MONTHS.items()
+)
+
+
+def _month_numbers(names):
+    # names is an (n, 3) int array of month abbreviation characters
+    keys = _month_key(names[:, 0], names[:, 1], names[:, 2])
+    known = np.array([key for key, _ in _MONTH_KEYS])
+    numbers = np.array([number for _, number in _MONTH_KEYS])
+    index = np.minimum(np.searchsorted(known, keys), len(known) - 1)
+    if not (known[index] == keys).all():
+        raise ValueError("bad month name in timestamps")
+    return numbers[index]
+
+
+def storage_timestamps(values):
+    """
+    Vectorized storage_timestamp() for a sequence of timestamp strings or
+    bytes, all in the fixed width "27/Feb/2020:20:43:38 +0000" form.
+    """
+    raw = np.asarray(
+        [v.encode("ascii") if isinstance(v, str) else v for v in values],
+        dtype="S26",
+    )
+    if not len(raw):
+        return np.empty(0, dtype=np.float64)
+    chars = raw.view(np.uint8).reshape(-1, 26).astype(np.int64)
+    digits = chars - ord("0")
+
+    def number(start, end):
+        value = np.zeros(len(chars), dtype=np.int64)
+        for i in range(start, end):
+            value = value * 10 + digits[:, i]
+        return value
+
+    days = _days_from_civil(
+        number(7, 11), _month_numbers(chars[:, 3:6]), number(0, 2)
+    )
+    seconds = days * 86400 + number(12, 14) * 3600 + number(15, 17) * 60
+    seconds += number(18, 20)
+    offset = number(22, 24) * 3600 + number(24, 26) * 60
+    offset = np.where(chars[:, 21] == ord("-"), -offset, offset)
+    return (seconds - offset).astype(np.float64)
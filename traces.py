@@ -0,0 +1,201 @@
+# join each request's log lines by transaction id into a call tree
+#
+# A client request shows up as one proxy access line plus a line from every
+# storage server it touched, all with the same txn id. The proxy logs its
+# line when the response is done, so that line completes the transaction.
+# Transactions that never get one (eg cut off at the end of the log) are
+# evicted once they've been quiet for max_age seconds of log time, or when
+# too many are open at once, so memory stays bounded however long the log.
+
+import collections
+
+import hdr
+import logparse
+
+
+# from_proxy marks the proxy's calls to the storage servers
+Hop = collections.namedtuple(
+    "Hop",
+    ["caller", "callee", "method", "status", "duration", "from_proxy"],
+    defaults=(False,),
+)
+
+
+class EdgeStats(object):
+    """
+    Call count, hop time histogram and how often the edge was on the
+    critical path, for one (caller, callee, method) edge.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.critical = 0
+        self.histogram = hdr.HdrHistogram()
+
+    def add(self, duration, critical):
+        self.calls += 1
+        self.critical += critical
+        self.histogram.record(duration)
+
+    def merge(self, other):
+        self.calls += other.calls
+        self.critical += other.critical
+        self.histogram.merge(other.histogram)
+
+    def percentiles(self, ps):
+        return self.histogram.percentiles(ps)
+
+
+class TraceIndex(object):
+    """
+    Collects access records into transactions and, as each one completes or
+    is evicted, adds its hops to per-edge stats in self.edges.
+
+    names(record) returns the (caller, callee) node names for a storage
+    record. The client's request is a hop from "client" to the proxy,
+    named as the proxy's own calls to the storage servers name it; with
+    none of those to go by, it's left out. A proxy request made by the
+    proxy itself is a hop from its source (eg GET_INFO) to the proxy. A
+    hop's parent is the hop whose callee is the hop's caller (eg an object
+    server's container update hangs off the object request), or the proxy
+    request if there isn't one. Storage times only have one second
+    resolution, so the critical path follows the slowest child at each
+    level rather than comparing end times.
+    """
+
+    def __init__(self, names, max_open=100000, max_age=300.0):
+        self.names = names
+        self.max_open = max_open
+        self.max_age = max_age
+        # txn id -> (last seen, hops), least recently seen first
+        self._open = collections.OrderedDict()
+        self.edges = {}
+        self.completed = 0
+        self.evicted = 0
+
+    def add(self, record):
+        txn_id = record.txn_id
+        from_proxy = False
+        if isinstance(record, logparse.StorageAccess):
+            caller, callee = self.names(record)
+            from_proxy = record.source == "proxy-server"
+        elif record.source != "-":
+            # the proxy calling itself for a middleware (eg GET_INFO); which
+            # proxy is only known from the other hops, when it's finished
+            caller, callee = record.source, None
+        else:
+            # the client's request, so the transaction is done
+            _, hops = self._open.pop(txn_id, (None, []))
+            self._finish(record, hops)
+            self.completed += 1
+            self._expire(record.end_time)
+            return
+        _, hops = self._open.pop(txn_id, (None, []))
+        hops.append(
+            Hop(
+                caller,
+                callee,
+                record.method,
+                record.status,
+                record.request_time,
+                from_proxy,
+            )
+        )
+        self._open[txn_id] = (record.end_time, hops)
+        self._expire(record.end_time)
+
+    def close(self):
+        """
+        Evict every transaction still open, eg at the end of the log.
+        """
+        while self._open:
+            _, (_, hops) = self._open.popitem(last=False)
+            self._finish(None, hops)
+            self.evicted += 1
+
+    def _expire(self, now):
+        while self._open:
+            txn_id, (last_seen, hops) = next(iter(self._open.items()))
+            if len(self._open) <= self.max_open and (
+                last_seen >= now - self.max_age
+            ):
+                break
+            del self._open[txn_id]
+            self._finish(None, hops)
+            self.evicted += 1
+
+    def _edge(self, hop):
+        key = (hop.caller, hop.callee, hop.method)
+        if key not in self.edges:
+            self.edges[key] = EdgeStats()
+        return self.edges[key]
+
+    def _finish(self, proxy_record, hops):
+        # the proxy line doesn't say which of the host's proxy processes
+        # logged it, only the storage servers' lines do
+        proxy_name = None
+        for hop in hops:
+            if hop.from_proxy:
+                proxy_name = hop.caller
+                break
+        internal = set()
+        for i, hop in enumerate(hops):
+            if hop.callee is None:
+                hops[i] = hop._replace(callee=proxy_name)
+                internal.add(i)
+        if proxy_name is None:
+            # nothing to call the proxy (eg its calls were evicted before
+            # its line came), so leave out the hops into it
+            hops = [hop for i, hop in enumerate(hops) if i not in internal]
+            internal = set()
+
+        children = collections.defaultdict(list)
+        callees = {}
+        for i, hop in enumerate(hops):
+            if i in internal:
+                # the proxy's calls to the storage servers for it look just
+                # like the ones for the client's request, so it can't be
+                # their parent
+                continue
+            # the slowest call into a server is the likeliest parent
+            best = callees.get(hop.callee)
+            if best is None or hop.duration > hops[best].duration:
+                callees[hop.callee] = i
+        for i, hop in enumerate(hops):
+            parent = callees.get(hop.caller)
+            children[parent if parent != i else None].append(i)
+
+        critical = set()
+        if proxy_record is not None:
+            if proxy_name is not None:
+                root = Hop(
+                    "client",
+                    proxy_name,
+                    proxy_record.method,
+                    proxy_record.status,
+                    proxy_record.request_time,
+                )
+                self._edge(root).add(root.duration, True)
+            # follow the slowest call down from the top
+            level = children[None]
+            while level:
+                slowest = max(level, key=lambda i: hops[i].duration)
+                if slowest in critical:
+                    # servers calling each other in a loop
+                    break
+                critical.add(slowest)
+                level = children[slowest]
+        for i, hop in enumerate(hops):
+            self._edge(hop).add(hop.duration, i in critical)
+
+    def merge(self, other):
+        """
+        Add other's edge stats (eg from another part of the log) to these.
+        """
+        for key, stats in other.edges.items():
+            if key in self.edges:
+                self.edges[key].merge(stats)
+            else:
+                self.edges[key] = stats
+        self.completed += other.completed
+        self.evicted += other.evicted